@@ -0,0 +1,105 @@
+# benchmarks/batch_preprocessing.py
+"""
+Wall time to preprocess a merchant's batch of receipt photos.
+
+- per_request: what a dozen separate /verify_*_from_image requests do on one worker. Each
+  photo is decoded by OpenCV for the QR threshold and decoded again by PIL for the Gemini
+  copy, one photo after another.
+- batch: services/image_batch.py. Each photo is decoded once, and that grayscale array feeds
+  both the QR threshold and the Gemini copy (utils.image_processor.prepare_receipt), on a
+  thread pool of BATCH_PREPROCESS_WORKERS.
+
+zbar is not run in either scenario (it may not be installed, and costs the same in both).
+The Gemini requests each scenario would send are printed alongside.
+
+Usage:
+    python -m benchmarks.batch_preprocessing
+    python -m benchmarks.batch_preprocessing --images 24 --width 2448 --height 3264
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# Keeps QR decoding out of both scenarios: prepare_receipt treats a failed import as "no QR code".
+sys.modules["pyzbar"] = None
+
+
+def _build_photos(count: int, width: int, height: int):
+    """Photo-like JPEGs of a receipt on a desk: noisy background, a white slip with dark text."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(11)
+    photos = []
+    for number in range(count):
+        image = rng.integers(60, 140, size=(height, width, 3), dtype=np.uint8)
+        image = cv2.GaussianBlur(image, (5, 5), 0)
+        cv2.rectangle(image, (width // 6, height // 8), (width * 5 // 6, height * 7 // 8), (245, 245, 245), -1)
+        for line in range(12):
+            y = height // 5 + line * height // 20
+            cv2.putText(image, f"Reference No. FT25{number:03d}ABC{line:02d}", (width // 5, y), cv2.FONT_HERSHEY_SIMPLEX, width / 1600, (20, 20, 20), 3)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        photos.append(encoded.tobytes())
+    return photos
+
+
+def run_per_request(photos) -> float:
+    from utils.gemini_client import prepare_image_for_gemini
+    from utils.image_processor import _binarize_for_qr
+
+    started_at = time.perf_counter()
+    for photo in photos:
+        _binarize_for_qr(photo)
+        prepare_image_for_gemini(photo)
+    return time.perf_counter() - started_at
+
+
+def run_batch(photos, workers: int) -> float:
+    from utils.image_processor import prepare_receipt
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        started_at = time.perf_counter()
+        list(executor.map(prepare_receipt, photos))
+        return time.perf_counter() - started_at
+
+
+def main(argv=None) -> int:
+    from services.image_batch import BATCH_OCR_IMAGES_PER_REQUEST, BATCH_PREPROCESS_WORKERS
+
+    parser = argparse.ArgumentParser(description="Batch receipt preprocessing, per request vs. batched.")
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--width", type=int, default=2448)
+    parser.add_argument("--height", type=int, default=3264)
+    parser.add_argument("--workers", type=int, default=BATCH_PREPROCESS_WORKERS)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+    logging.getLogger("utils.image_processor").setLevel(logging.ERROR)
+
+    photos = _build_photos(args.images, args.width, args.height)
+    # Loads the image stack once so neither scenario pays the imports.
+    run_per_request(photos[:1])
+    run_batch(photos[:1], 1)
+
+    per_request = min(run_per_request(photos) for _ in range(args.rounds))
+    batch = min(run_batch(photos, args.workers) for _ in range(args.rounds))
+
+    print(f"{args.images} photos of {args.width}x{args.height}, best of {args.rounds}, {args.workers} workers")
+    print(f"{'scenario':<12} {'ms total':>10} {'ms/image':>10} {'Gemini requests':>16}")
+    print(f"{'per_request':<12} {per_request * 1000:>10.0f} {per_request * 1000 / args.images:>10.1f} {args.images:>16}")
+    packed = math.ceil(args.images / BATCH_OCR_IMAGES_PER_REQUEST)
+    print(f"{'batch':<12} {batch * 1000:>10.0f} {batch * 1000 / args.images:>10.1f} {packed:>16}")
+    print(f"\nspeed-up: {per_request / batch:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# benchmarks/cache_hits.py
+"""
+Requests per second for verifications answered from the shared cache.
+
+Both scenarios serve the same cached Telebirr result through an ASGI app driven in-process by
+httpx (no sockets, so the numbers isolate the application's own per-request work):
+
+- before: the previous response path. The traffic-class header is read by a sync dependency
+  (run in the threadpool), the cached JSON is decoded to a dict and copied into a
+  VerificationResult, which is returned with response_model, so FastAPI validates it again
+  and encodes it with the standard JSON encoder.
+- after:  main.py's endpoint. The dependency runs inline and the cached bytes are sent as
+  stored, without decoding or validation.
+
+Usage:
+    python -m benchmarks.cache_hits
+    python -m benchmarks.cache_hits --requests 20000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# A private cache file, set before utils.shared_cache reads its settings.
+os.environ["SHARED_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="cache-hits-"), "cache.sqlite3")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_DEBUG_SAMPLE_RATE", "0")
+
+TRANSACTION_ID = "CHQ0ABC123"
+LEGACY_KEY = "legacy:telebirr:CHQ0ABC123:"
+
+
+def _cached_result():
+    from models import VerificationResult, VerifiedDataDetails
+
+    return VerificationResult(
+        transaction_id=TRANSACTION_ID,
+        status="Completed",
+        message="Transaction verification successful. Status: Completed.",
+        verified_data=VerifiedDataDetails(
+            sender_name="Selam Tadesse Bekele", receiver_name="Dawit Alemu Worku",
+            receiver_bank_name="Commercial Bank of Ethiopia", status="Completed",
+            date="2025-07-06T10:08:00", amount=15000.0
+        )
+    )
+
+
+def build_apps():
+    from typing import Optional
+
+    from fastapi import Depends, FastAPI, Header
+
+    import main
+    from models import TransactionDetails, VerificationResult
+    from utils.admission import normalize_traffic_class
+    from utils.shared_cache import shared_cache, ttl_for_status
+
+    def legacy_traffic_class(x_traffic_class: Optional[str] = Header(None)) -> str:
+        return normalize_traffic_class(x_traffic_class)
+
+    async def never_fetch():
+        raise AssertionError("benchmark requests must be cache hits")
+
+    before = FastAPI()
+
+    @before.post("/verify_telebirr_payment", response_model=VerificationResult)
+    async def legacy_endpoint(transaction_details: TransactionDetails, traffic_class: str = Depends(legacy_traffic_class)):
+        result = await shared_cache.single_flight(
+            LEGACY_KEY, never_fetch, lambda result: ttl_for_status(result.get("status")),
+            encode=lambda result: json.dumps(result).encode(), decode=json.loads
+        )
+        return VerificationResult(**result)
+
+    after = FastAPI()
+    after.add_api_route(
+        "/verify_telebirr_payment", main.verify_telebirr_payment_by_id,
+        methods=["POST"], response_model=VerificationResult
+    )
+    return before, after
+
+
+async def seed_cache() -> None:
+    import main
+    from services.payment_service import VerificationOutcome, verification_engine
+    from utils.shared_cache import shared_cache, ttl_for_status
+
+    result = _cached_result()
+
+    async def verify_payment(transaction_id, account=None):
+        return result
+
+    real_verify = main.telebirr_service.verify_payment
+    main.telebirr_service.verify_payment = verify_payment
+    try:
+        await verification_engine.verify("telebirr", TRANSACTION_ID, None, "interactive")
+    finally:
+        main.telebirr_service.verify_payment = real_verify
+
+    async def legacy_fetch():
+        return result.model_dump(mode="json")
+
+    await shared_cache.single_flight(
+        LEGACY_KEY, legacy_fetch, lambda r: ttl_for_status(r.get("status")),
+        encode=lambda r: json.dumps(r).encode(), decode=json.loads
+    )
+
+
+async def drive(app, requests: int, concurrency: int) -> float:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        body = {"transaction_id": TRANSACTION_ID}
+        for _ in range(200):
+            response = await client.post("/verify_telebirr_payment", json=body)
+            response.raise_for_status()
+
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                response = await client.post("/verify_telebirr_payment", json=body)
+                if response.status_code != 200:
+                    raise RuntimeError(f"unexpected {response.status_code}: {response.text}")
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started_at
+
+
+async def run(requests: int, concurrency: int, rounds: int) -> None:
+    before, after = build_apps()
+    await seed_cache()
+
+    print(f"{requests} cache-hit requests per round, concurrency {concurrency}, best of {rounds}")
+    print(f"{'path':<8} {'req/s':>10} {'us/request':>12}")
+    best = {}
+    for name, app in (("before", before), ("after", after)):
+        elapsed = min([await drive(app, requests, concurrency) for _ in range(rounds)])
+        best[name] = requests / elapsed
+        print(f"{name:<8} {best[name]:>10.0f} {elapsed / requests * 1e6:>12.1f}")
+    print(f"\nspeed-up: {best['after'] / best['before']:.2f}x")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cache-hit requests per second, before and after the fast response path.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.requests, args.concurrency, args.rounds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
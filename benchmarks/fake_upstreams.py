@@ -0,0 +1,309 @@
+# benchmarks/fake_upstreams.py
+"""
+Local stand-ins for every service the verifier calls, so recorded traffic can be replayed
+(benchmarks/replay.py) without touching the banks, Ethio Telecom or Gemini:
+
+- /telebirr/receipt/{id}              Telebirr receipt pages, from benchmarks/fixtures/telebirr
+- /boa/slip/{id}{account suffix}      BOA slip pages, from benchmarks/fixtures/boa
+- /cbe/?id={id}{account suffix}       CBE receipt PDFs
+- /gemini/models/{model}:generateContent
+                                      answers the single-ID, packed and CBE receipt schemas
+- /callbacks                          accepts watch webhooks
+- /stats                              requests served per upstream
+
+What a receipt looks like is decided by the last character of its transaction ID (see
+outcome_of), so a replay can reproduce the outcome a captured request had. Receipt images
+carry their transaction ID as a grid of black and white cells (encode_receipt_image), which
+the Gemini stand-in reads back; CBE PDFs embed the same grid.
+
+Point the verifier at it with upstream_env(), or run it on its own:
+    python -m benchmarks.fake_upstreams --port 8900
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import random
+import sys
+from collections import Counter
+from typing import Dict, Optional
+
+import orjson
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Last character of a synthetic transaction ID -> what its upstream does. Any other character
+# (the replay uses digits) is a completed receipt.
+OUTCOME_MARKERS = {"P": "pending", "N": "not_found", "F": "failed", "S": "slow"}
+MARKER_FOR_OUTCOME = {outcome: marker for marker, outcome in OUTCOME_MARKERS.items()}
+
+# Receipt image layout: the ID is written as bits, one cell each, in a grid whose position is
+# relative to the image size, inside a dark frame that keeps the verifier's margin crop a no-op.
+IMAGE_WIDTH, IMAGE_HEIGHT = 1000, 1400
+GRID_COLUMNS = 32
+_IMAGE_MAGIC = b"RX"
+
+
+def outcome_of(transaction_id: str) -> str:
+    return OUTCOME_MARKERS.get(transaction_id[-1:].upper(), "found") if transaction_id else "not_found"
+
+
+def upstream_env(base_url: str) -> Dict[str, str]:
+    """Environment that points a verifier worker at the stand-ins served from base_url."""
+    base_url = base_url.rstrip("/")
+    return {
+        "TELEBIRR_RECEIPT_BASE_URL": f"{base_url}/telebirr/receipt/",
+        "BOA_SLIP_BASE_URL": f"{base_url}/boa/slip/",
+        "CBE_RECEIPT_BASE_URL": f"{base_url}/cbe/",
+        "GEMINI_API_BASE": f"{base_url}/gemini",
+        "GEMINI_API_KEY": "replay",
+    }
+
+
+def _grid_geometry(width: int, height: int):
+    cell = width * 0.8 / GRID_COLUMNS
+    return width * 0.1, height * 0.1, cell
+
+
+def _draw_grid(transaction_id: str):
+    import numpy as np
+
+    payload = _IMAGE_MAGIC + bytes([len(transaction_id)]) + transaction_id.encode()
+    bits = [(byte >> (7 - shift)) & 1 for byte in payload for shift in range(8)]
+    image = np.full((IMAGE_HEIGHT, IMAGE_WIDTH), 245, dtype=np.uint8)
+    image[:6, :] = image[-6:, :] = image[:, :6] = image[:, -6:] = 0
+    left, top, cell = _grid_geometry(IMAGE_WIDTH, IMAGE_HEIGHT)
+    for index, bit in enumerate(bits):
+        if bit:
+            x = int(left + (index % GRID_COLUMNS) * cell)
+            y = int(top + (index // GRID_COLUMNS) * cell)
+            image[y:int(y + cell), x:int(x + cell)] = 20
+    return image
+
+
+def encode_receipt_image(transaction_id: str, size_bytes: int = 0, image_format: str = "jpeg") -> bytes:
+    """A receipt image carrying transaction_id, padded after its end marker to about size_bytes."""
+    import cv2
+
+    _, encoded = cv2.imencode(".png" if image_format == "png" else ".jpg", _draw_grid(transaction_id))
+    data = encoded.tobytes()
+    if size_bytes > len(data):
+        # Decoders stop at the end of the image, so the padding only costs upload and buffering.
+        data += bytes(size_bytes - len(data))
+    return data
+
+
+def decode_receipt_image(data: bytes) -> Optional[str]:
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    height, width = image.shape
+    left, top, cell = _grid_geometry(width, height)
+
+    def read_bytes(start: int, count: int) -> bytes:
+        values = []
+        for byte_index in range(start, start + count):
+            byte = 0
+            for shift in range(8):
+                index = byte_index * 8 + shift
+                x = int(left + (index % GRID_COLUMNS + 0.5) * cell)
+                y = int(top + (index // GRID_COLUMNS + 0.5) * cell)
+                if y >= height or x >= width:
+                    return b""
+                byte = (byte << 1) | (1 if image[y, x] < 128 else 0)
+            values.append(byte)
+        return bytes(values)
+
+    header = read_bytes(0, 3)
+    if header[:2] != _IMAGE_MAGIC:
+        return None
+    return read_bytes(3, header[2]).decode("ascii", "replace") or None
+
+
+def build_receipt_pdf(transaction_id: str) -> bytes:
+    import cv2
+    import fitz
+
+    _, png = cv2.imencode(".png", _draw_grid(transaction_id))
+    doc = fitz.open()
+    # CBEService renders pages at 2x, which gives back an image of IMAGE_WIDTH x IMAGE_HEIGHT.
+    page = doc.new_page(width=IMAGE_WIDTH / 2, height=IMAGE_HEIGHT / 2)
+    page.insert_image(page.rect, stream=png.tobytes())
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def _read_fixture(*parts: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, *parts), encoding="utf-8") as f:
+        return f.read()
+
+
+def _load_pages() -> Dict[str, Dict[str, tuple]]:
+    with open(os.path.join(FIXTURES_DIR, "manifest.json"), encoding="utf-8") as f:
+        manifest = f.read()
+    fixtures = orjson.loads(manifest)
+
+    def page(provider: str, name: str):
+        return _read_fixture(provider, f"{name}.html"), fixtures[provider][name]["transaction_id"]
+
+    boa_not_found = "<html><body><div class=\"alert alert-danger\">Transaction not found.</div></body></html>"
+    return {
+        "telebirr": {
+            "found": page("telebirr", "individual_to_wallet"),
+            "pending": page("telebirr", "organization_to_bank_pending"),
+            "not_found": page("telebirr", "not_found"),
+        },
+        "boa": {
+            "found": page("boa", "intra_bank"),
+            "pending": page("boa", "intra_bank"),
+            "not_found": (boa_not_found, ""),
+        },
+    }
+
+
+def _gemini_response(data: dict, images: int) -> dict:
+    return {
+        "candidates": [{"content": {"parts": [{"text": orjson.dumps(data).decode()}], "role": "model"}}],
+        # Roughly what Gemini bills: 258 tokens per image plus the prompt.
+        "usageMetadata": {"promptTokenCount": 258 * images + 200, "candidatesTokenCount": 20 * images},
+    }
+
+
+def build_app(latencies_ms: Optional[Dict[str, float]] = None, slow_ms: float = 30_000):
+    """
+    The stand-in app. latencies_ms gives each upstream's ("telebirr", "boa", "cbe", "gemini")
+    base response time; receipts marked slow take slow_ms instead.
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import HTMLResponse, JSONResponse, Response
+    from starlette.routing import Route
+
+    latencies_ms = latencies_ms or {}
+    pages = _load_pages()
+    served = Counter()
+    rng = random.Random(7)
+
+    async def delay(upstream: str, transaction_id: str = "") -> None:
+        base_ms = slow_ms if outcome_of(transaction_id) == "slow" else latencies_ms.get(upstream, 0)
+        if base_ms > 0:
+            # +/-25% so requests that arrive together do not all finish together.
+            await asyncio.sleep(base_ms * rng.uniform(0.75, 1.25) / 1000)
+
+    async def scraped_page(upstream: str, transaction_id: str) -> Response:
+        served[upstream] += 1
+        await delay(upstream, transaction_id)
+        outcome = outcome_of(transaction_id)
+        if outcome == "failed":
+            return HTMLResponse("<html><body>Service unavailable</body></html>", status_code=503)
+        html, fixture_id = pages[upstream].get(outcome, pages[upstream]["not_found"])
+        return HTMLResponse(html.replace(fixture_id, transaction_id) if fixture_id else html)
+
+    async def telebirr_receipt(request):
+        return await scraped_page("telebirr", request.path_params["transaction_id"])
+
+    async def boa_slip(request):
+        # The slip reference is the 12-character transaction ID followed by 5 account digits.
+        return await scraped_page("boa", request.path_params["reference"][:12])
+
+    async def cbe_receipt(request):
+        if request.method == "HEAD":
+            return Response()
+        served["cbe"] += 1
+        transaction_id = request.query_params.get("id", "")[:12]
+        await delay("cbe", transaction_id)
+        outcome = outcome_of(transaction_id)
+        if outcome in ("not_found", "failed"):
+            return Response("Receipt not found", status_code=404 if outcome == "not_found" else 503)
+        pdf_bytes = await asyncio.to_thread(build_receipt_pdf, transaction_id)
+        return Response(pdf_bytes, media_type="application/pdf")
+
+    async def gemini_models(request):
+        return JSONResponse({"models": []})
+
+    async def gemini_generate(request):
+        served["gemini"] += 1
+        payload = orjson.loads(await request.body())
+        images = [
+            base64.b64decode(part["inlineData"]["data"])
+            for content in payload.get("contents", []) for part in content.get("parts", []) if "inlineData" in part
+        ]
+        served["gemini_images"] += len(images)
+        await delay("gemini")
+        found = await asyncio.to_thread(lambda: [decode_receipt_image(image) for image in images])
+        properties = payload.get("generationConfig", {}).get("responseSchema", {}).get("properties", {})
+
+        if "receipts" in properties:
+            data = {"receipts": [
+                {"image": number, "transaction_id": transaction_id, "confidence": 0.97 if transaction_id else 0.0}
+                for number, transaction_id in enumerate(found, start=1)
+            ]}
+        elif "sender_name" in properties:
+            transaction_id = found[0] if found else None
+            data = {
+                "transaction_id": transaction_id, "sender_name": "Replay Payer", "receiver_name": "Replay Merchant",
+                "amount": 1250.0, "date": "2025-07-14T09:15:42",
+                "status": "Pending" if transaction_id and outcome_of(transaction_id) == "pending" else "Completed",
+            }
+        else:
+            transaction_id = found[0] if found else None
+            data = {"transaction_id": transaction_id, "confidence": 0.97 if transaction_id else 0.0}
+        return JSONResponse(_gemini_response(data, len(images)))
+
+    async def callbacks(request):
+        served["callbacks"] += 1
+        await request.body()
+        return Response(status_code=204)
+
+    async def stats(request):
+        return JSONResponse(dict(served))
+
+    return Starlette(routes=[
+        Route("/telebirr/receipt/{transaction_id}", telebirr_receipt),
+        Route("/boa/slip/{reference}", boa_slip),
+        Route("/cbe/", cbe_receipt, methods=["GET", "HEAD"]),
+        Route("/gemini/models", gemini_models),
+        Route("/gemini/models/{model}:generateContent", gemini_generate, methods=["POST"]),
+        Route("/callbacks", callbacks, methods=["POST"]),
+        Route("/stats", stats),
+    ])
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--telebirr-ms", type=float, default=800, help="Telebirr receipt page response time.")
+    parser.add_argument("--boa-ms", type=float, default=1200, help="BOA slip page response time.")
+    parser.add_argument("--cbe-ms", type=float, default=1500, help="CBE PDF response time.")
+    parser.add_argument("--gemini-ms", type=float, default=2500, help="Gemini generateContent response time.")
+    parser.add_argument("--slow-ms", type=float, default=30_000, help="Response time of receipts replayed as timeouts.")
+
+
+def latencies_from_args(args) -> Dict[str, float]:
+    return {"telebirr": args.telebirr_ms, "boa": args.boa_ms, "cbe": args.cbe_ms, "gemini": args.gemini_ms}
+
+
+def main(argv=None) -> int:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stand-ins for the verifier's upstreams.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_latency_arguments(parser)
+    args = parser.parse_args(argv)
+
+    print("Verifier environment:")
+    for name, value in upstream_env(f"http://{args.host}:{args.port}").items():
+        print(f"  {name}={value}")
+    uvicorn.run(build_app(latencies_from_args(args), args.slow_ms), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
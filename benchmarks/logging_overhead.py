@@ -0,0 +1,108 @@
+# benchmarks/logging_overhead.py
+"""
+Logging overhead on the event-loop thread, per verification.
+
+One Telebirr verification used to print about 25 DEBUG lines synchronously to stdout. Each mode
+emits the same 25 debug events plus one INFO summary line per simulated verification, with
+stdout piped to the parent process the way a container runtime collects logs:
+
+- print:    the old `print("DEBUG: ...")` calls.
+- sampled:  utils.log with the default DEBUG sampling; unsampled requests drop debug events
+            before they are queued, and the summary line goes through the queue.
+- all:      utils.log with LOG_LEVEL=DEBUG; every event is queued and written by the
+            listener thread.
+
+Reported: microseconds per verification spent on the calling thread, which is the cost the
+event loop pays.
+
+Usage:
+    python -m benchmarks.logging_overhead
+    python -m benchmarks.logging_overhead --verifications 20000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+DEBUG_EVENTS_PER_VERIFICATION = 25
+MODES = ("print", "sampled", "all")
+
+
+def _run_print(verifications: int) -> float:
+    started_at = time.perf_counter()
+    for i in range(verifications):
+        for step in range(DEBUG_EVENTS_PER_VERIFICATION):
+            print(f"DEBUG: Could not find label {step} for transaction ID 'CHQ0ABC{i:04d}'.")
+        print(f"Verification CHQ0ABC{i:04d} finished.")
+    return time.perf_counter() - started_at
+
+
+def _run_logging(verifications: int) -> float:
+    import logging
+    import random
+
+    from utils import log
+
+    log.configure_logging()
+    logger = logging.getLogger("services.benchmark")
+    started_at = time.perf_counter()
+    for i in range(verifications):
+        # What RequestLogMiddleware does at the start of each request.
+        request_token = log._request_id.set(f"req-{i}")
+        sampled_token = log._debug_sampled.set(random.random() < log.LOG_DEBUG_SAMPLE_RATE)
+        for step in range(DEBUG_EVENTS_PER_VERIFICATION):
+            logger.debug("Could not find label %s for transaction ID '%s'.", step, f"CHQ0ABC{i:04d}")
+        logger.info("request_completed", extra={"provider": "telebirr", "outcome": "Completed", "duration_ms": 1.0})
+        log._debug_sampled.reset(sampled_token)
+        log._request_id.reset(request_token)
+    elapsed = time.perf_counter() - started_at
+    log.shutdown_logging()
+    return elapsed
+
+
+def run_mode(mode: str, verifications: int) -> dict:
+    elapsed = _run_print(verifications) if mode == "print" else _run_logging(verifications)
+    return {"mode": mode, "us_per_verification": elapsed / verifications * 1e6}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Logging overhead per verification.")
+    parser.add_argument("--verifications", type=int, default=5000)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        sys.stderr.write(json.dumps(run_mode(args.mode, args.verifications)) + "\n")
+        return 0
+
+    print(f"{args.verifications} simulated verifications, {DEBUG_EVENTS_PER_VERIFICATION} debug events each")
+    print(f"{'mode':<10} {'us/verification on caller':>26}")
+    results = {}
+    for mode in MODES:
+        env = dict(os.environ)
+        env.pop("LOG_LEVEL", None)
+        if mode == "all":
+            env["LOG_LEVEL"] = "DEBUG"
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.logging_overhead", "--mode", mode, "--verifications", str(args.verifications)],
+            cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        if completed.returncode != 0:
+            print(completed.stderr[-2000:])
+            return 1
+        results[mode] = json.loads(completed.stderr.strip().splitlines()[-1])["us_per_verification"]
+        print(f"{mode:<10} {results[mode]:>26.1f}")
+
+    print(f"\nsampled logging is {results['print'] / results['sampled']:.1f}x cheaper than print on the calling thread")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# benchmarks/parsers.py
+"""
+Microbenchmarks for the CPU-bound parts of verification, run over the fixture corpus
+in benchmarks/fixtures without any network or browser.
+
+Covered stages:
+- Telebirr receipt HTML parsing (_parse_telebirr_receipt_html)
+- Bank of Abyssinia slip parsing (_parse_boa_receipt_html)
+- CBE PDF page rendering (CBEService._render_pdf_pages)
+- Receipt screenshot QR decoding (extract_qr_code_data)
+
+CBE PDFs and receipt screenshots are generated deterministically at startup so the
+corpus does not need binary files checked in.
+
+Usage:
+    python -m benchmarks.parsers                      # compare against baselines.json
+    python -m benchmarks.parsers --update-baselines   # record new baselines
+    python -m benchmarks.parsers --filter telebirr    # run a subset
+
+Exits with status 1 if any case regresses past its threshold or returns wrong data.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+DEFAULT_TOLERANCE = 1.5
+# Sub-millisecond cases are dominated by timer noise; never flag less than this absolute slowdown.
+MIN_SLACK_MS = 0.5
+
+
+class BenchCase:
+    def __init__(self, name: str, func: Callable[[], object], check: Optional[Callable[[object], Optional[str]]] = None):
+        self.name = name
+        self.func = func
+        self.check = check
+
+
+def _load_manifest() -> dict:
+    with open(os.path.join(FIXTURES_DIR, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_fixture(*parts: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, *parts), encoding="utf-8") as f:
+        return f.read()
+
+
+def _expect_fields(expected: dict) -> Callable[[object], Optional[str]]:
+    def check(result):
+        for key, value in expected.items():
+            if result.get(key) != value:
+                return f"{key}: expected {value!r}, got {result.get(key)!r}"
+        return None
+    return check
+
+
+def _build_cbe_pdf(page_count: int) -> bytes:
+    import fitz
+
+    doc = fitz.open()
+    for page_index in range(page_count):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((72, 80), "Commercial Bank of Ethiopia", fontsize=20)
+        page.insert_text((72, 110), "VAT Invoice / Customer Receipt", fontsize=14)
+        rows = [
+            ("Payer", "EHITEMUSIE NEBIYU MENGISTIE"),
+            ("Account", "1****5678"),
+            ("Receiver", "ABDULSHEKUR SULTAN AHIMED"),
+            ("Payment Date & Time", "7/6/2025, 10:08:00 AM"),
+            ("Reference No. (VAT Invoice No)", "FT25188TN19J"),
+            ("Transferred Amount", "100.00 ETB"),
+            ("Commission or Service Charge", "0.50 ETB"),
+            ("Total amount debited from customers account", "100.58 ETB"),
+        ]
+        y = 160
+        for label, value in rows:
+            page.insert_text((72, y), label, fontsize=11)
+            page.insert_text((330, y), value, fontsize=11)
+            y += 26
+        page.draw_rect(fitz.Rect(60, 140, 535, y), color=(0.4, 0.2, 0.5), width=1)
+        page.insert_text((72, 800), f"Page {page_index + 1} of {page_count}", fontsize=9)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def _build_receipt_image(qr_payload: Optional[str], contrast: float = 1.0) -> bytes:
+    import cv2
+    import numpy as np
+
+    # Roughly a phone screenshot: 1080x2340 with text blocks and an optional QR code.
+    canvas = np.full((2340, 1080, 3), 255, dtype=np.uint8)
+    cv2.rectangle(canvas, (0, 0), (1080, 260), (63, 198, 141), thickness=-1)
+    cv2.putText(canvas, "Transfer successful", (90, 170), cv2.FONT_HERSHEY_SIMPLEX, 2.2, (255, 255, 255), 5)
+    lines = ["Amount: 100.00 ETB", "To: ABDULSHEKUR SULTAN", "Ref: FT25188TN19J", "Date: 06/07/2025 10:08"]
+    for index, line in enumerate(lines):
+        cv2.putText(canvas, line, (90, 420 + index * 110), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (40, 40, 40), 3)
+
+    if qr_payload:
+        qr = cv2.QRCodeEncoder.create().encode(qr_payload)
+        qr = cv2.resize(qr, (600, 600), interpolation=cv2.INTER_NEAREST)
+        qr_bgr = cv2.cvtColor(qr, cv2.COLOR_GRAY2BGR)
+        if contrast < 1.0:
+            qr_bgr = (255 - (255 - qr_bgr.astype(np.float32)) * contrast).astype(np.uint8)
+        canvas[1050:1650, 240:840] = qr_bgr
+
+    ok, encoded = cv2.imencode(".png", canvas)
+    if not ok:
+        raise RuntimeError("Could not encode synthetic receipt image.")
+    return encoded.tobytes()
+
+
+def build_cases(manifest: dict) -> List[BenchCase]:
+    from services.telebirr_service import _parse_telebirr_receipt_html
+    from services.boa_service import _parse_boa_receipt_html
+    from services.cbe_service import CBEService
+
+    cases = []
+
+    for name, spec in manifest["telebirr"].items():
+        html = _read_fixture("telebirr", f"{name}.html")
+        transaction_id = spec["transaction_id"]
+        cases.append(BenchCase(
+            f"telebirr_parse/{name}",
+            lambda html=html, transaction_id=transaction_id: _parse_telebirr_receipt_html(html, transaction_id),
+            _expect_fields(spec["expected"]),
+        ))
+
+    for name, spec in manifest["boa"].items():
+        html = _read_fixture("boa", f"{name}.html")
+        transaction_id = spec["transaction_id"]
+        cases.append(BenchCase(
+            f"boa_parse/{name}",
+            lambda html=html, transaction_id=transaction_id: _parse_boa_receipt_html(html, transaction_id),
+            _expect_fields(spec["expected"]),
+        ))
+
+    cbe_service = CBEService()
+    for name, spec in manifest["cbe_pdf"].items():
+        pdf_bytes = _build_cbe_pdf(spec["pages"])
+        expected_pages = spec["pages"]
+        cases.append(BenchCase(
+            f"cbe_render/{name}",
+            lambda pdf_bytes=pdf_bytes: cbe_service._render_pdf_pages(pdf_bytes),
+            lambda pages, expected_pages=expected_pages: None if len(pages) == expected_pages else f"expected {expected_pages} pages, got {len(pages)}",
+        ))
+
+    try:
+        # image_processor loads zbar lazily, so probe for the native library up front.
+        import pyzbar.pyzbar  # noqa: F401
+        from utils.image_processor import extract_qr_code_data
+    except ImportError as e:
+        print(f"Skipping QR cases: {e}")
+        extract_qr_code_data = None
+
+    if extract_qr_code_data:
+        for name, spec in manifest["receipt_images"].items():
+            image_bytes = _build_receipt_image(spec["qr_payload"], spec.get("contrast", 1.0))
+            expected_payload = spec["qr_payload"] if spec["expect_qr"] else None
+            cases.append(BenchCase(
+                f"qr_decode/{name}",
+                lambda image_bytes=image_bytes: extract_qr_code_data(image_bytes),
+                lambda data, expected_payload=expected_payload: None if data == expected_payload else f"expected {expected_payload!r}, got {data!r}",
+            ))
+
+    return cases
+
+
+def run_case(case: BenchCase, rounds: int, warmup: int) -> Dict[str, object]:
+    # The parsers still print debug output; keep it out of the benchmark report.
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = None
+        for _ in range(warmup):
+            result = case.func()
+        timings_ms = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = case.func()
+            timings_ms.append((time.perf_counter() - start) * 1000)
+
+    timings_ms.sort()
+    p95_index = min(len(timings_ms) - 1, int(round(0.95 * (len(timings_ms) - 1))))
+    return {
+        "median_ms": statistics.median(timings_ms),
+        "p95_ms": timings_ms[p95_index],
+        "min_ms": timings_ms[0],
+        "error": case.check(result) if case.check else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Parser and image-pipeline microbenchmarks.")
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--filter", default=None, help="Only run cases whose name contains this string.")
+    parser.add_argument("--tolerance", type=float, default=None, help="Override the allowed median slowdown factor.")
+    parser.add_argument("--update-baselines", action="store_true")
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH, encoding="utf-8") as f:
+            baselines = json.load(f)
+    tolerance = args.tolerance or baselines.get("tolerance", DEFAULT_TOLERANCE)
+    case_baselines = baselines.get("cases", {})
+
+    cases = [case for case in build_cases(_load_manifest()) if not args.filter or args.filter in case.name]
+
+    failed = False
+    measured = {}
+    print(f"{'case':<45} {'median ms':>10} {'p95 ms':>10} {'baseline':>10} {'limit':>10}  result")
+    for case in cases:
+        stats = run_case(case, args.rounds, args.warmup)
+        measured[case.name] = round(stats["median_ms"], 3)
+
+        baseline = case_baselines.get(case.name, {}).get("median_ms")
+        limit = max(baseline * tolerance, baseline + MIN_SLACK_MS) if baseline is not None else None
+        if stats["error"]:
+            outcome = f"WRONG ({stats['error']})"
+            failed = True
+        elif limit is not None and stats["median_ms"] > limit and not args.update_baselines:
+            outcome = "REGRESSED"
+            failed = True
+        elif baseline is None:
+            outcome = "no baseline"
+        else:
+            outcome = "ok"
+
+        print(
+            f"{case.name:<45} {stats['median_ms']:>10.3f} {stats['p95_ms']:>10.3f} "
+            f"{baseline if baseline is not None else '-':>10} {round(limit, 3) if limit is not None else '-':>10}  {outcome}"
+        )
+
+    if args.update_baselines:
+        case_baselines.update({name: {"median_ms": median} for name, median in measured.items()})
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump({"tolerance": tolerance, "cases": dict(sorted(case_baselines.items()))}, f, indent=2)
+            f.write("\n")
+        print(f"Baselines written to {BASELINES_PATH}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+# benchmarks/replay.py
+"""
+Replays a traffic capture (TRAFFIC_CAPTURE_PATH, see utils/capture.py) against a verifier
+wired to local stand-ins (benchmarks/fake_upstreams.py), at the recorded pace or N times
+faster, and reports how the caches, pools and admission limits held up.
+
+Requests are sent open loop: each one leaves at its recorded offset divided by --speed,
+whether or not earlier ones have finished, so a slow server builds a queue the way it would
+in production. Each captured request is rebuilt from its fingerprints:
+
+- transaction IDs become synthetic IDs in the same provider grammar. The same fingerprint
+  always gives the same ID, so repeats in the capture (cache and single-flight hits) repeat
+  in the replay. IDs local validation rejected are replayed as invalid IDs. The ID's last
+  character tells the stand-in which outcome the capture saw (found, pending, not found,
+  upstream failure or timeout).
+- account numbers become digit strings of the recorded length.
+- uploads become receipt images of the recorded size carrying a synthetic ID that the Gemini
+  stand-in reads back. QR codes are not reproduced, so every image goes through OCR.
+- a watch ID or image session token the server issued in the capture is replaced by the one
+  it issues in the replay; a request that uses one waits for the request that obtains it.
+- webhook callback URLs point at the stand-in.
+
+The report gives latency percentiles and status codes per route, how often the replayed
+outcome matched the captured one, upstream calls served by the stand-ins, the verifier's
+counters (/metrics) that changed during the replay and the peak of every gauge sampled
+while it ran. /metrics is per worker, so use --workers 1 (the default) for exact counts.
+
+Usage:
+    python -m benchmarks.replay capture.jsonl                    # recorded pace
+    python -m benchmarks.replay capture.jsonl --speed 10         # ten times faster
+    python -m benchmarks.replay capture.jsonl --speed 5 --gemini-ms 4000 --workers 2
+    python -m benchmarks.replay capture.jsonl --target http://127.0.0.1:8000 --upstreams http://127.0.0.1:8900
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import orjson
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.fake_upstreams import MARKER_FOR_OUTCOME, add_latency_arguments, encode_receipt_image, upstream_env  # noqa: E402
+from utils.capture import ACCOUNT_FIELDS, ID_FIELDS, ISSUED_FIELDS, PLAIN_FIELDS  # noqa: E402
+
+ROUTE_PROVIDERS = (
+    ("/verify_telebirr_payment", "telebirr"),
+    ("/verify_boa_payment", "boa"),
+    ("/verify_cbe_payment", "cbe"),
+)
+# Captured verification statuses (lower case) -> the stand-in outcome that reproduces them.
+OUTCOME_FOR_STATUS = {
+    "pending": "pending",
+    "partial data extracted": "pending",
+    "invalid transaction id": "not_found",
+    "pdf_fetch_failed": "not_found",
+    "network/load timeout": "slow",
+    "deadline exceeded": "slow",
+    "deadline_exceeded": "slow",
+    "playwright error": "failed",
+    "failed": "failed",
+}
+# Average size of one image inside a captured zip, to decide how many to put in its stand-in.
+ZIP_MEMBER_BYTES = 400 * 1024
+ISSUED_WAIT_SECONDS = 60
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest().upper()
+
+
+def synthetic_transaction_id(fp: str, provider: str, outcome: str = "found", valid: bool = True, length: int = 10) -> str:
+    digest = _digest(fp, provider)
+    if not valid:
+        # '-' fails every provider's grammar, as the captured ID did.
+        return ("X-" + digest)[:length]
+    marker = MARKER_FOR_OUTCOME.get(outcome) or str(int(digest[0], 16) % 10)
+    if provider == "telebirr":
+        return "C" + digest[1:9] + marker
+    return f"FT25{int(digest[1:4], 16) % 365 + 1:03d}{digest[4:8]}{marker}"
+
+
+def synthetic_account(described: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not described:
+        return None
+    digits = str(int(_digest(described["fp"]), 16))
+    return (digits * (described["digits"] // len(digits) + 1))[:described["digits"]]
+
+
+def _outcome(record: Dict[str, Any]) -> str:
+    return OUTCOME_FOR_STATUS.get((record.get("outcome") or "").lower(), "found")
+
+
+def _provider(record: Dict[str, Any]) -> str:
+    provider = record.get("provider") or (record.get("json") or {}).get("provider") or (record.get("form") or {}).get("provider")
+    if provider:
+        return provider
+    path = record.get("route") or record.get("path") or ""
+    return next((name for prefix, name in ROUTE_PROVIDERS if path.startswith(prefix)), "telebirr")
+
+
+def _transaction_id(described: Dict[str, Any], provider: str, outcome: str) -> str:
+    formats = described.get("formats") or []
+    if not formats:
+        return synthetic_transaction_id(described["fp"], provider, valid=False, length=described.get("length", 10))
+    # An ID in another provider's grammar fails validation the same way the captured one did.
+    return synthetic_transaction_id(described["fp"], provider if provider in formats else formats[0], outcome)
+
+
+@dataclass
+class PlannedRequest:
+    offset: float
+    record: Dict[str, Any]
+    method: str
+    route: str
+    headers: Dict[str, str]
+    params: Dict[str, str]
+    json: Optional[Dict[str, Any]] = None
+    # (field, filename, content type, image bytes without padding, padded size)
+    files: List[Tuple[str, str, str, bytes, int]] = field(default_factory=list)
+    form: Dict[str, str] = field(default_factory=dict)
+    # field -> fingerprint of an identifier the server issued earlier
+    issued_refs: Dict[str, str] = field(default_factory=dict)
+    path_refs: Dict[str, str] = field(default_factory=dict)
+
+
+class ReplayState:
+    """Identifiers the server issued during the replay, by the fingerprint they had in the capture."""
+
+    def __init__(self, callback_url: Optional[str], expected: set):
+        self.callback_url = callback_url
+        # (name, fingerprint) of every identifier some replayed request obtains.
+        self.expected = expected
+        self._values: Dict[Tuple[str, str], str] = {}
+        self._events: Dict[Tuple[str, str], asyncio.Event] = defaultdict(asyncio.Event)
+
+    def resolve(self, name: str, fp: str, value: Optional[str]) -> None:
+        if value:
+            self._values[(name, fp)] = value
+        self._events[(name, fp)].set()
+
+    async def lookup(self, name: str, fp: str) -> str:
+        if (name, fp) not in self.expected:
+            # Issued before the capture started: send the fingerprint, which the server rejects.
+            return fp
+        try:
+            await asyncio.wait_for(self._events[(name, fp)].wait(), ISSUED_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        # The request that obtains it failed this time; the server rejects the fingerprint in its place.
+        return self._values.get((name, fp), fp)
+
+
+def _image_cache():
+    cache: Dict[Tuple[str, str], bytes] = {}
+
+    def image(transaction_id: str, image_format: str) -> bytes:
+        key = (transaction_id, image_format)
+        if key not in cache:
+            cache[key] = encode_receipt_image(transaction_id, image_format=image_format)
+        return cache[key]
+
+    return image
+
+
+def plan_requests(records: List[Dict[str, Any]], speed: float) -> List[PlannedRequest]:
+    image = _image_cache()
+    started_at = records[0]["ts"]
+    planned = []
+    for record in records:
+        provider = _provider(record)
+        outcome = _outcome(record)
+        request = PlannedRequest(
+            offset=(record["ts"] - started_at) / speed,
+            record=record,
+            method=record["method"],
+            route=record.get("route") or record["path"],
+            headers=dict(record.get("headers") or {}),
+            params=dict(record.get("query") or {}),
+        )
+        for name, fp in (record.get("path_params") or {}).items():
+            if name in ISSUED_FIELDS:
+                request.path_refs[name] = fp
+        if request.path_refs.keys() != (record.get("path_params") or {}).keys():
+            request.route = record["path"]
+
+        if record.get("json") is not None:
+            request.json = {}
+            for key, value in record["json"].items():
+                if key in ID_FIELDS:
+                    request.json[key] = _transaction_id(value, provider, outcome)
+                elif key in ACCOUNT_FIELDS:
+                    request.json[key] = synthetic_account(value)
+                elif key in PLAIN_FIELDS:
+                    request.json[key] = value
+                elif key in ISSUED_FIELDS:
+                    request.issued_refs[key] = value["fp"]
+                # Other fields were only fingerprinted; callback_url is handled below, the rest are left out.
+
+        for key, value in (record.get("form") or {}).items():
+            if key in ACCOUNT_FIELDS and isinstance(value, dict) and "fp" in value:
+                request.form[key] = synthetic_account(value) or ""
+            elif key in PLAIN_FIELDS and isinstance(value, str):
+                request.form[key] = value
+
+        for number, described in enumerate(record.get("files") or []):
+            image_format = "png" if described["format"] == "png" else "jpeg"
+            if described["format"] == "zip":
+                members = max(1, round(described["size"] / ZIP_MEMBER_BYTES))
+                buffer = io.BytesIO()
+                with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+                    for member in range(members):
+                        transaction_id = synthetic_transaction_id(f"{described['fp']}:{member}", provider, outcome)
+                        archive.writestr(f"receipt-{member}.jpg", encode_receipt_image(transaction_id, described["size"] // members))
+                request.files.append((described["field"], f"upload-{number}.zip", "application/zip", buffer.getvalue(), 0))
+            else:
+                transaction_id = synthetic_transaction_id(described["fp"], provider, outcome)
+                content_type = described.get("content_type") or f"image/{image_format}"
+                request.files.append((described["field"], f"upload-{number}.{image_format}", content_type, image(transaction_id, image_format), described["size"]))
+        planned.append(request)
+    return planned
+
+
+@dataclass
+class Observation:
+    route: str
+    status: int
+    latency_ms: float
+    lag_ms: float
+    captured_outcome: Optional[str]
+    replayed_outcome: Optional[str]
+    error: Optional[str] = None
+
+
+async def send(client, request: PlannedRequest, state: ReplayState, started_at: float, max_stream_seconds: float) -> Observation:
+    lag_ms = (time.perf_counter() - started_at - request.offset) * 1000
+    path = request.route
+    for name, fp in request.path_refs.items():
+        path = path.replace("{" + name + "}", await state.lookup(name, fp))
+    body = dict(request.json) if request.json is not None else None
+    for name, fp in request.issued_refs.items():
+        body[name] = await state.lookup(name, fp)
+    if body is not None and "callback_url" in request.record["json"] and state.callback_url:
+        body["callback_url"] = state.callback_url
+
+    kwargs: Dict[str, Any] = {"headers": request.headers, "params": request.params}
+    if body is not None:
+        kwargs["json"] = body
+    if request.files:
+        kwargs["files"] = [
+            (field_name, (filename, data + bytes(max(0, size - len(data))), content_type))
+            for field_name, filename, content_type, data, size in request.files
+        ]
+        kwargs["data"] = request.form
+
+    sent_at = time.perf_counter()
+    status, text, error = 0, b"", None
+    try:
+        async with client.stream(request.method, path, **kwargs) as response:
+            status = response.status_code
+            if response.headers.get("content-type", "").startswith("text/event-stream"):
+                # Event streams stay open until the watch settles; hold them as long as the captured client did.
+                held = max(1.0, min(max_stream_seconds, request.record.get("duration_ms", 0) / 1000))
+                try:
+                    await asyncio.wait_for(response.aread(), held)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                text = await response.aread()
+    except Exception as e:
+        error = type(e).__name__
+    latency_ms = (time.perf_counter() - sent_at) * 1000
+
+    data = None
+    if text[:1] == b"{":
+        try:
+            data = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    for name, fp in (request.record.get("issued") or {}).items():
+        state.resolve(name, fp, data.get(name) if isinstance(data, dict) else None)
+    replayed = data.get("status") if isinstance(data, dict) and isinstance(data.get("status"), str) else None
+    route = request.record.get("route") or request.record["path"]
+    return Observation(route, status, latency_ms, lag_ms, request.record.get("outcome"), replayed, error)
+
+
+async def sample_gauges(client, peaks: Dict[str, float], stop: asyncio.Event, interval: float) -> None:
+    while not stop.is_set():
+        try:
+            response = await client.get("/metrics")
+            for name, value in response.json().get("gauges", {}).items():
+                peaks[name] = max(peaks.get(name, value), value)
+        except Exception:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _get_json(client, url: str) -> Dict[str, Any]:
+    try:
+        response = await client.get(url)
+        return response.json()
+    except Exception:
+        return {}
+
+
+async def replay(planned: List[PlannedRequest], target: str, upstreams: Optional[str], args) -> Dict[str, Any]:
+    import httpx
+
+    expected = {(name, fp) for request in planned for name, fp in (request.record.get("issued") or {}).items()}
+    state = ReplayState(f"{upstreams.rstrip('/')}/callbacks" if upstreams else None, expected)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=target, timeout=args.request_timeout, limits=limits) as client, \
+            httpx.AsyncClient(base_url=target, timeout=10) as metrics_client, httpx.AsyncClient(timeout=10) as side_client:
+        metrics_before = await _get_json(metrics_client, "/metrics")
+        upstream_before = await _get_json(side_client, f"{upstreams}/stats") if upstreams else {}
+
+        peaks: Dict[str, float] = {}
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_gauges(metrics_client, peaks, stop, args.sample_interval))
+        tasks = []
+        started_at = time.perf_counter()
+        for request in planned:
+            wait = request.offset - (time.perf_counter() - started_at)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            tasks.append(asyncio.create_task(send(client, request, state, started_at, args.max_stream_seconds)))
+        observations = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started_at
+        stop.set()
+        await sampler
+
+        metrics_after = await _get_json(metrics_client, "/metrics")
+        upstream_after = await _get_json(side_client, f"{upstreams}/stats") if upstreams else {}
+
+    return {
+        "observations": observations,
+        "elapsed": elapsed,
+        "counters": {
+            name: value - metrics_before.get("counters", {}).get(name, 0)
+            for name, value in metrics_after.get("counters", {}).items()
+            if value != metrics_before.get("counters", {}).get(name, 0)
+        },
+        "upstream": {name: value - upstream_before.get(name, 0) for name, value in upstream_after.items()},
+        "gauge_peaks": peaks,
+    }
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1)]
+
+
+def print_report(result: Dict[str, Any], records: List[Dict[str, Any]], speed: float) -> None:
+    observations: List[Observation] = result["observations"]
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"{len(observations)} requests, captured over {span:.1f} s, replayed at {speed:g}x in {result['elapsed']:.1f} s")
+    lags = sorted(observation.lag_ms for observation in observations)
+    print(f"send lag behind schedule: p50 {_percentile(lags, 50):.1f} ms, max {lags[-1]:.1f} ms")
+
+    by_route: Dict[str, List[Observation]] = defaultdict(list)
+    for observation in observations:
+        by_route[observation.route].append(observation)
+    print(f"\n{'route':<42} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for route, group in sorted(by_route.items(), key=lambda item: -len(item[1])):
+        latencies = sorted(observation.latency_ms for observation in group)
+        statuses = Counter(observation.error or observation.status for observation in group)
+        print(
+            f"{route:<42} {len(group):>6} {_percentile(latencies, 50):>9.0f} {_percentile(latencies, 95):>9.0f} "
+            f"{_percentile(latencies, 99):>9.0f} {latencies[-1]:>9.0f}  {dict(statuses)}"
+        )
+
+    compared = [o for o in observations if o.captured_outcome and o.replayed_outcome]
+    if compared:
+        matched = sum(o.captured_outcome == o.replayed_outcome for o in compared)
+        print(f"\noutcome matched the capture: {matched}/{len(compared)}")
+        mismatches = Counter((o.captured_outcome, o.replayed_outcome) for o in compared if o.captured_outcome != o.replayed_outcome)
+        for (captured, replayed), count in mismatches.most_common(5):
+            print(f"  captured {captured!r} -> replayed {replayed!r}: {count}")
+
+    if result["upstream"]:
+        print("\nupstream calls (stand-ins): " + ", ".join(f"{name} {value}" for name, value in sorted(result["upstream"].items()) if value))
+    if result["counters"]:
+        print("\nverifier counters during the replay:")
+        for name, value in sorted(result["counters"].items()):
+            print(f"  {name:<70} {value:>10g}")
+    if result["gauge_peaks"]:
+        print("\npeak gauges:")
+        for name, value in sorted(result["gauge_peaks"].items()):
+            print(f"  {name:<70} {value:>10g}")
+
+
+def load_capture(path: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                records.append(orjson.loads(line))
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, timeout: float) -> bool:
+    import urllib.error
+    import urllib.request
+
+    deadline_at = time.monotonic() + timeout
+    while time.monotonic() < deadline_at:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def _stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a traffic capture against local stand-ins.")
+    parser.add_argument("capture", help="JSONL file written with TRAFFIC_CAPTURE_PATH.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay N times faster than recorded.")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N requests.")
+    parser.add_argument("--target", default=None, help="Verifier to replay against; by default one is started.")
+    parser.add_argument("--upstreams", default=None, help="Stand-ins the target uses; by default they are started.")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the verifier started here.")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--request-timeout", type=float, default=180.0)
+    parser.add_argument("--max-stream-seconds", type=float, default=30.0, help="Longest an event stream is held open.")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between /metrics samples for gauge peaks.")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    add_latency_arguments(parser)
+    args = parser.parse_args(argv)
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        print("The capture is empty.")
+        return 1
+    planned = plan_requests(records, args.speed)
+
+    processes = []
+    try:
+        upstreams = args.upstreams
+        if upstreams is None and args.target is None:
+            port = _free_port()
+            upstreams = f"http://127.0.0.1:{port}"
+            processes.append(subprocess.Popen(
+                [
+                    sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(port),
+                    "--telebirr-ms", str(args.telebirr_ms), "--boa-ms", str(args.boa_ms), "--cbe-ms", str(args.cbe_ms),
+                    "--gemini-ms", str(args.gemini_ms), "--slow-ms", str(args.slow_ms)
+                ],
+                cwd=ROOT_DIR, stdout=subprocess.DEVNULL
+            ))
+            if not _wait_for(f"{upstreams}/stats", args.startup_timeout):
+                print("The stand-in upstreams did not start.")
+                return 1
+
+        target = args.target
+        if target is None:
+            port = _free_port()
+            target = f"http://127.0.0.1:{port}"
+            work_dir = tempfile.mkdtemp(prefix="replay-")
+            env = {
+                **os.environ,
+                **upstream_env(upstreams),
+                # A cold, private result cache, and no capture of the replay itself.
+                "SHARED_CACHE_PATH": os.path.join(work_dir, "cache.sqlite3"),
+                "TRAFFIC_CAPTURE_PATH": "",
+                # Watch callbacks go to the stand-ins, which a public-address check would refuse.
+                "WATCH_CALLBACK_ALLOWED_HOSTS": urlsplit(upstreams).hostname,
+                "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            }
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers)],
+                cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(work_dir, "verifier.log"), "wb")
+            ))
+            print(f"verifier log: {os.path.join(work_dir, 'verifier.log')}")
+            if not _wait_for(f"{target}/", args.startup_timeout):
+                print("The verifier did not start.")
+                return 1
+            if not _wait_for(f"{target}/ready", args.startup_timeout):
+                print("warning: the verifier never reported ready (see /ready); replaying anyway.")
+
+        result = asyncio.run(replay(planned, target, upstreams, args))
+    finally:
+        for process in reversed(processes):
+            _stop(process)
+
+    print_report(result, records, args.speed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
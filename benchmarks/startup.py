@@ -0,0 +1,142 @@
+# benchmarks/startup.py
+"""
+Cold-start benchmark for the API worker.
+
+Import mode (default) runs `python -X importtime -c "import main"` in fresh interpreters and
+reports the median import time plus the most expensive modules. It fails if any heavy,
+per-provider dependency (OpenCV, numpy, zbar, PyMuPDF, Playwright, BeautifulSoup, PIL) is
+loaded at import time instead of lazily on its own code path.
+
+Serve mode (--serve) starts uvicorn and measures time until the worker answers `/` (listening)
+and `/ready` (warm-up finished). It needs the full runtime: Chromium, zbar and friends.
+
+Usage:
+    python -m benchmarks.startup                       # import-time report
+    python -m benchmarks.startup --max-import-ms 800   # also fail past an import budget
+    python -m benchmarks.startup --serve               # time to listening and to ready
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that only some code paths need; none of them may be imported by `import main`.
+LAZY_MODULES = ("cv2", "numpy", "pyzbar", "fitz", "playwright", "bs4", "PIL")
+
+
+def _parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """Maps module name to (self us, cumulative us) from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_import(rounds: int) -> Tuple[List[float], Dict[str, Tuple[int, int]]]:
+    timings_ms = []
+    modules: Dict[str, Tuple[int, int]] = {}
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=ROOT_DIR, capture_output=True, text=True
+        )
+        timings_ms.append((time.perf_counter() - started_at) * 1000)
+        if completed.returncode != 0:
+            raise RuntimeError(f"`import main` failed:\n{completed.stderr[-2000:]}")
+        modules = _parse_importtime(completed.stderr)
+    return timings_ms, modules
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, deadline_at: float) -> Optional[float]:
+    while time.perf_counter() < deadline_at:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def measure_serve(timeout_s: float) -> Dict[str, Optional[float]]:
+    port = _free_port()
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline_at = started_at + timeout_s
+        listening_at = _wait_for(f"http://127.0.0.1:{port}/", deadline_at)
+        ready_at = _wait_for(f"http://127.0.0.1:{port}/ready", deadline_at) if listening_at else None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        "listening_ms": (listening_at - started_at) * 1000 if listening_at else None,
+        "ready_ms": (ready_at - started_at) * 1000 if ready_at else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Worker cold-start benchmark.")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="How many of the slowest modules to list.")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if the median `import main` exceeds this.")
+    parser.add_argument("--serve", action="store_true", help="Also time uvicorn until / and /ready answer.")
+    parser.add_argument("--serve-timeout", type=float, default=120.0)
+    args = parser.parse_args(argv)
+
+    failed = False
+    timings_ms, modules = measure_import(args.rounds)
+    median_ms = statistics.median(timings_ms)
+    main_cumulative_ms = modules.get("main", (0, 0))[1] / 1000
+
+    print(f"`import main` wall time: median {median_ms:.1f} ms over {args.rounds} fresh interpreters")
+    print(f"`import main` cumulative import time: {main_cumulative_ms:.1f} ms")
+    print(f"\n{'module':<50} {'self ms':>10} {'cumulative ms':>14}")
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:args.top]:
+        print(f"{name:<50} {self_us / 1000:>10.1f} {cumulative_us / 1000:>14.1f}")
+
+    eager = sorted({name.split(".")[0] for name in modules} & set(LAZY_MODULES))
+    if eager:
+        print(f"\nFAIL: imported at startup but should be lazy: {', '.join(eager)}")
+        failed = True
+    if args.max_import_ms is not None and median_ms > args.max_import_ms:
+        print(f"\nFAIL: median import {median_ms:.1f} ms exceeds budget {args.max_import_ms:.1f} ms")
+        failed = True
+
+    if args.serve:
+        serve = measure_serve(args.serve_timeout)
+        print(f"\nlistening after: {serve['listening_ms']:.0f} ms" if serve["listening_ms"] else "\nFAIL: never started listening")
+        print(f"ready after:     {serve['ready_ms']:.0f} ms" if serve["ready_ms"] else "FAIL: never became ready")
+        failed = failed or serve["ready_ms"] is None
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
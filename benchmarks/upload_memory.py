@@ -0,0 +1,197 @@
+# benchmarks/upload_memory.py
+"""
+Memory-per-request benchmark for the image upload path.
+
+Each scenario handles one large phone photo the way an image endpoint does, in a fresh
+interpreter so peaks do not leak between runs:
+
+- legacy: `await image_file.read()` into bytes, a base64 copy of the raw upload, QR
+  preprocessing through a BGR matrix, a grayscale copy and a PIL copy, and Gemini preparation
+  decoding the full-resolution image from a BytesIO copy.
+- streaming: the spooled upload is mapped with utils.uploads.open_upload, QR preprocessing
+  decodes straight to grayscale and thresholds in place, and Gemini preparation reads the
+  mapping through a chunked reader with JPEG draft decoding. Only the downscaled image is
+  base64-encoded.
+
+Reported per scenario: tracemalloc peak (Python and numpy allocations) and the growth of the
+resident-set high-water mark (everything, including OpenCV and PIL internals). zbar itself is
+not run; its working set is the same in both scenarios.
+
+Usage:
+    python -m benchmarks.upload_memory
+    python -m benchmarks.upload_memory --width 4032 --height 3024
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+SPOOL_MAX_SIZE = 1024 * 1024  # Starlette's UploadFile spool threshold.
+CHUNK_BYTES = 64 * 1024
+
+
+def _build_photo(width: int, height: int) -> bytes:
+    """A noisy, photo-like JPEG: noise compresses badly, like a real camera shot of paper."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(7)
+    image = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    cv2.putText(image, "FT25189TY6KT", (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, width / 800, (0, 0, 0), 8)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return encoded.tobytes()
+
+
+def _spool(path: str) -> tempfile.SpooledTemporaryFile:
+    """Recreates what Starlette hands the endpoint: the multipart file streamed into a spool."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_BYTES):
+            spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def _current_rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _high_water_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_high_water() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _legacy(spooled) -> None:
+    import cv2
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    image_bytes = spooled.read()
+    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+
+    np_array = np.frombuffer(image_bytes, np.uint8)
+    cv_image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+    gray_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+    thresh_image = cv2.adaptiveThreshold(gray_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+    pil_image = Image.fromarray(thresh_image)
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        gray = ImageOps.exif_transpose(image).convert("L")
+    gray.thumbnail((1600, 1600), Image.LANCZOS)
+    buffer = io.BytesIO()
+    gray.save(buffer, format="JPEG", quality=80)
+    base64.b64encode(buffer.getvalue())
+    del image_base64, cv_image, gray_image, thresh_image, pil_image
+
+
+def _streaming(spooled) -> None:
+    from starlette.datastructures import UploadFile
+
+    from utils.gemini_client import prepare_image_for_gemini
+    from utils.image_processor import _binarize_for_qr
+    from utils.uploads import open_upload
+
+    async def handle():
+        upload = UploadFile(spooled, size=None)
+        async with open_upload(upload) as image_buffer:
+            binary = _binarize_for_qr(image_buffer)
+            del binary
+            prepare_image_for_gemini(image_buffer)
+
+    asyncio.run(handle())
+
+
+def run_scenario(name: str, path: str) -> dict:
+    # Import everything first so module loading is not counted against either scenario.
+    import cv2  # noqa: F401
+    import numpy  # noqa: F401
+    import PIL.Image  # noqa: F401
+    import PIL.JpegImagePlugin  # noqa: F401
+    import starlette.datastructures  # noqa: F401
+    import utils.gemini_client  # noqa: F401
+    import utils.uploads  # noqa: F401
+
+    spooled = _spool(path)
+    handler = {"legacy": _legacy, "streaming": _streaming}[name]
+
+    _reset_high_water()
+    rss_before_kb = _current_rss_kb()
+    tracemalloc.start()
+    handler(spooled)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "scenario": name,
+        "traced_peak_mb": traced_peak / (1024 * 1024),
+        "rss_growth_mb": max(0, _high_water_kb() - rss_before_kb) / 1024,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Image upload memory-per-request benchmark.")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--scenario", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--photo", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args.scenario, args.photo)))
+        return 0
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as photo:
+        photo.write(_build_photo(args.width, args.height))
+    try:
+        size_mb = os.path.getsize(photo.name) / (1024 * 1024)
+        print(f"photo: {args.width}x{args.height} JPEG, {size_mb:.1f} MB")
+        print(f"{'scenario':<12} {'traced peak MB':>15} {'RSS growth MB':>15}")
+        results = {}
+        for scenario in ("legacy", "streaming"):
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.upload_memory", "--scenario", scenario, "--photo", photo.name],
+                cwd=ROOT_DIR, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(completed.stderr[-2000:])
+                return 1
+            results[scenario] = json.loads(completed.stdout.strip().splitlines()[-1])
+            row = results[scenario]
+            print(f"{scenario:<12} {row['traced_peak_mb']:>15.1f} {row['rss_growth_mb']:>15.1f}")
+    finally:
+        os.unlink(photo.name)
+
+    legacy, streaming = results["legacy"], results["streaming"]
+    if streaming["rss_growth_mb"]:
+        print(f"\nRSS growth reduced {legacy['rss_growth_mb'] / streaming['rss_growth_mb']:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,86 @@
 # main.py (Your FastAPI application entry point)
 
-import re
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, status
-from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+# Before any project import: services and utils read their settings from the environment when imported.
+load_dotenv()
+
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Form, Header, Request, WebSocket, status
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
-from models import TransactionDetails, VerificationResult, ImageVerificationRequest, BoATransactionDetails, CBETransactionDetails, VerifiedDataDetails 
+from models import TransactionDetails, VerificationResult, ImageVerificationRequest, BoATransactionDetails, CBETransactionDetails, AccountRequiredResult, ImageSessionDetails, WatchRequest, PaymentProviderName
 from services.telebirr_service import TelebirrService
 from services.boa_service import BOAService 
 from services.cbe_service import CBEService 
+from services.payment_service import VerificationOutcome, verification_engine
 from utils.image_processor import extract_text_id_from_image_gemini, extract_qr_code_data 
-import base64
-from typing import Optional 
+from utils.metrics import metrics
+from utils.deadline import DeadlineExceeded, deadline_scope, parse_request_budget
+from utils.admission import AdmissionRejected, admission_controller, normalize_traffic_class
+from utils.uploads import BATCH_MAX_UPLOAD_BYTES, MULTIPART_OVERHEAD_BYTES, UploadSizeLimitMiddleware, detach_upload, open_upload
+from utils.log import RequestLogMiddleware, configure_logging, shutdown_logging
+from utils.profiling import PROFILING_ENABLED, ProfilingMiddleware, profile_store
+from utils.capture import CAPTURE_ENABLED, TrafficCaptureMiddleware, capture_writer
+from utils.image_sessions import IMAGE_SESSION_TTL_SECONDS, ImageSessionError, issue_session_token, open_session_token
+from utils.transaction_ids import (
+    PROVIDER_TELEBIRR, PROVIDER_BOA, PROVIDER_CBE, PROVIDER_LABELS, TransactionIdError,
+    validate_transaction_id, validate_account_number, classify_transaction_id, split_cbe_qr_reference
+)
+from services.browser_pool import browser_pool
+from services.browser_supervisor import browser_supervisor
+from services.scrape_profiles import TELEBIRR_SCRAPE_PROFILE, BOA_SCRAPE_PROFILE
+from services.warmup import WARMUP_PROVIDERS, readiness, warm_parsers
+from services.image_batch import collect_images, stream_batch
+from services.watcher import CallbackNotAllowed, WatchCapacityReached, check_callback_url, transaction_watcher
+from services.pos_channel import CLOSE_UNAUTHORIZED, PosChannel, authenticate_terminal, bearer_token, pos_channels
+from utils import gemini_client, image_processor, profiling, progress
+from utils.gemini_client import close_client as close_gemini_client
+import asyncio
+import time
+from typing import List, Optional 
+from contextlib import AsyncExitStack, asynccontextmanager
 
 from starlette.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv 
 import os 
 
-load_dotenv()
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scrape_profiles = [
+        profile for provider, profile in ((PROVIDER_TELEBIRR, TELEBIRR_SCRAPE_PROFILE), (PROVIDER_BOA, BOA_SCRAPE_PROFILE))
+        if provider in WARMUP_PROVIDERS
+    ]
+    if scrape_profiles:
+        readiness.register("browser", lambda: browser_pool.warm_up(scrape_profiles))
+    readiness.register("parsers", lambda: asyncio.to_thread(warm_parsers))
+    if WARMUP_PROVIDERS & {"cbe", "ocr"}:
+        readiness.register("image_stack", lambda: asyncio.to_thread(image_processor.warm_up))
+        readiness.register("gemini_connection", gemini_client.warm_up, required=False)
+    if PROVIDER_CBE in WARMUP_PROVIDERS:
+        readiness.register("cbe_connection", cbe_service.warm_up, required=False)
+    readiness.start()
+    browser_supervisor.start(browser_pool)
+    transaction_watcher.start()
+    yield
+    await readiness.stop()
+    await transaction_watcher.stop()
+    await browser_supervisor.stop()
+    await browser_pool.close()
+    await cbe_service.close()
+    await close_gemini_client()
+    capture_writer.close()
+    shutdown_logging()
 
 app = FastAPI(
     title="Transaction Verifier",
-    description="API to verify Telebirr transactions by ID or from image, Bank of Abyssinia transactions, and CBE transactions from PDF links."
+    description="API to verify Telebirr transactions by ID or from image, Bank of Abyssinia transactions, and CBE transactions from PDF links.",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    path_limits={"/verify_payments_from_images": BATCH_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES}
 )
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +90,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_deadline_middleware(request: Request, call_next):
+    try:
+        budget_seconds = parse_request_budget(
+            request.headers.get("X-Request-Timeout-Ms"),
+            request.query_params.get("timeout_ms")
+        )
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={
+                "detail": {
+                    "transaction_id": "N/A",
+                    "status": "Failed",
+                    "message": "Invalid request timeout. Use X-Request-Timeout-Ms or timeout_ms with a positive number of milliseconds.",
+                    "debug_info": str(e)
+                }
+            },
+        )
+
+    started_at = time.perf_counter()
+    with deadline_scope(budget_seconds):
+        response = await call_next(request)
+    metrics.observe(
+        "request_latency_ms", (time.perf_counter() - started_at) * 1000,
+        path=request.url.path, budgeted="yes" if budget_seconds is not None else "no"
+    )
+    return response
+
+# Opt-in (TRAFFIC_CAPTURE_PATH): records anonymized request shapes for benchmarks/replay.py.
+if CAPTURE_ENABLED:
+    app.add_middleware(TrafficCaptureMiddleware)
+
+# Opt-in (PROFILE_ADMIN_TOKEN / PROFILE_SAMPLE_RATE); not installed otherwise. Sits just inside the
+# request log so profiles carry the request ID.
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Added last so it is the outermost layer: its request ID and summary cover everything below.
+app.add_middleware(RequestLogMiddleware)
+
+def _deadline_exceeded_detail(exc: DeadlineExceeded) -> dict:
+    return {
+        "transaction_id": "N/A",
+        "status": "Deadline Exceeded",
+        "message": "The request could not be completed within its time budget.",
+        "debug_info": str(exc)
+    }
+
+def _admission_rejected_detail(exc: AdmissionRejected) -> dict:
+    return {
+        "transaction_id": "N/A",
+        "status": "Service Overloaded",
+        "message": f"{PROVIDER_LABELS.get(exc.provider, exc.provider)} verification is at capacity. Retry after {exc.retry_after} seconds.",
+        "debug_info": str(exc)
+    }
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": _deadline_exceeded_detail(exc)},
+    )
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    metrics.increment("requests_shed", path=request.url.path, reason=exc.reason)
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={"detail": _admission_rejected_detail(exc)},
+    )
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     error_details = []
@@ -49,37 +182,99 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         },
     )
 
-telebirr_service = TelebirrService()
-boa_service = BOAService() 
-cbe_service = CBEService() 
+telebirr_service = verification_engine.register(TelebirrService())
+boa_service = verification_engine.register(BOAService())
+cbe_service = verification_engine.register(CBEService())
 
-@app.post("/verify_telebirr_payment", response_model=VerificationResult) 
-async def verify_telebirr_payment_by_id(transaction_details: TransactionDetails):
-    result = await telebirr_service.verify_payment(transaction_details)
-    return result
-
-@app.post("/verify_telebirr_payment_from_image", response_model=VerificationResult) 
-async def verify_telebirr_payment_from_image(image_file: UploadFile = File(...)):
-    
-    transaction_id = None
-    image_base64 = None
+async def get_traffic_class(x_traffic_class: Optional[str] = Header(None)) -> str:
+    # POS terminals are interactive by default; reconciliation jobs send X-Traffic-Class: batch.
+    # Async so FastAPI calls it inline instead of handing a sync dependency to the threadpool.
+    return normalize_traffic_class(x_traffic_class)
 
+def _validate_extracted_transaction_id(provider: str, transaction_id: str) -> str:
     try:
-        image_bytes = await image_file.read()
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        return validate_transaction_id(provider, transaction_id)
+    except TransactionIdError as e:
+        hint = ""
+        likely_providers = classify_transaction_id(transaction_id)
+        if likely_providers and provider not in likely_providers:
+            hint = f" It looks like a {' or '.join(PROVIDER_LABELS[p] for p in likely_providers)} reference instead."
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "transaction_id": transaction_id,
+                "status": "Invalid Transaction ID",
+                "message": f"{e.message}{hint}",
+                "debug_info": "The transaction ID extracted from the image failed local validation."
+            }
+        )
 
-    except Exception as e:
+def _validate_optional_account_number(provider: str, transaction_id: str, account_number: Optional[str]) -> Optional[str]:
+    if not account_number:
+        return None
+    try:
+        return validate_account_number(provider, account_number)
+    except TransactionIdError as e:
         raise HTTPException(
             status_code=400,
             detail={
-                "transaction_id": "N/A",
+                "transaction_id": transaction_id,
                 "status": "Failed",
-                "message": f"Could not read or process uploaded image file: {e}",
-                "debug_info": str(e)
+                "message": e.message,
+                "debug_info": "Invalid account number."
             }
         )
 
-    extracted_details = await extract_text_id_from_image_gemini(image_base64) 
+def _describe_error(exc: Exception, channel: str):
+    """
+    Maps the errors the exception handlers turn into responses onto (status code, detail), for
+    channels that report errors in-band: SSE streams and the POS WebSocket.
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return status.HTTP_504_GATEWAY_TIMEOUT, _deadline_exceeded_detail(exc)
+    if isinstance(exc, AdmissionRejected):
+        metrics.increment("requests_shed", path=channel, reason=exc.reason)
+        return status.HTTP_503_SERVICE_UNAVAILABLE, {**_admission_rejected_detail(exc), "retry_after": exc.retry_after}
+    return None
+
+class PreserializedJSONResponse(Response):
+    media_type = "application/json"
+
+def _result_response(outcome: VerificationOutcome) -> Response:
+    """
+    Sends the already-encoded VerificationResult as is. Returning a Response skips FastAPI's
+    response_model re-validation and JSON encoding; response_model stays on the routes for the
+    OpenAPI schema.
+    """
+    return PreserializedJSONResponse(outcome.body)
+
+def _progress_stream(run, on_close=None) -> StreamingResponse:
+    """
+    Streams a verification as Server-Sent Events (see utils/progress.py): stage and partial
+    events while it runs, then the same VerificationResult the plain endpoint returns.
+    """
+    return StreamingResponse(
+        progress.stream_events(run, lambda exc: _describe_error(exc, "stream"), on_close=on_close),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _verify_telebirr(transaction_details: TransactionDetails, traffic_class: str) -> VerificationOutcome:
+    return await verification_engine.verify(PROVIDER_TELEBIRR, transaction_details.transaction_id, None, traffic_class)
+
+@app.post("/verify_telebirr_payment", response_model=VerificationResult) 
+async def verify_telebirr_payment_by_id(transaction_details: TransactionDetails, traffic_class: str = Depends(get_traffic_class)):
+    return _result_response(await _verify_telebirr(transaction_details, traffic_class))
+
+@app.post("/verify_telebirr_payment/stream")
+async def verify_telebirr_payment_by_id_stream(transaction_details: TransactionDetails, traffic_class: str = Depends(get_traffic_class)):
+    return _progress_stream(lambda: _verify_telebirr(transaction_details, traffic_class))
+
+async def _verify_telebirr_from_image(image_file: UploadFile, traffic_class: str) -> VerificationOutcome:
+    transaction_id = None
+
+    async with open_upload(image_file) as image_buffer, admission_controller.admit("ocr", traffic_class):
+        extracted_details = await extract_text_id_from_image_gemini(image_buffer)
     
     transaction_id = extracted_details.get("transaction_id") if extracted_details and isinstance(extracted_details, dict) else None
 
@@ -94,74 +289,43 @@ async def verify_telebirr_payment_from_image(image_file: UploadFile = File(...))
             }
         )
     
+    transaction_id = _validate_extracted_transaction_id(PROVIDER_TELEBIRR, transaction_id)
+    progress.report("ocr_done", transaction_id=transaction_id)
     transaction_details = TransactionDetails(transaction_id=transaction_id)
-    result = await telebirr_service.verify_payment(transaction_details)
-    return result
+    return await _verify_telebirr(transaction_details, traffic_class)
 
-@app.post("/verify_boa_payment", response_model=VerificationResult)
-async def verify_boa_payment(boa_details: BoATransactionDetails):
-    
-    if len(boa_details.sender_account) < 5:
-        raise HTTPException(
-            status_code=400,
-            detail={
-                "transaction_id": boa_details.transaction_id,
-                "status": "Failed",
-                "message": "Sender account number must have at least 5 digits to extract the last five.",
-                "debug_info": "Invalid sender_account length."
-            }
-        )
-        
-    sender_account_last_5_digits = boa_details.sender_account[-5:]
+@app.post("/verify_telebirr_payment_from_image", response_model=VerificationResult) 
+async def verify_telebirr_payment_from_image(image_file: UploadFile = File(...), traffic_class: str = Depends(get_traffic_class)):
+    return _result_response(await _verify_telebirr_from_image(image_file, traffic_class))
 
-    extracted_data_dict = await boa_service.verify_payment(
-        transaction_id=boa_details.transaction_id, 
-        sender_account_last_5_digits=sender_account_last_5_digits
-    )
+@app.post("/verify_telebirr_payment_from_image/stream")
+async def verify_telebirr_payment_from_image_stream(image_file: UploadFile = File(...), traffic_class: str = Depends(get_traffic_class)):
+    image_file = detach_upload(image_file)
+    return _progress_stream(lambda: _verify_telebirr_from_image(image_file, traffic_class), on_close=image_file.close)
 
-    verified_details = VerifiedDataDetails(
-        sender_name=extracted_data_dict.get('sender_name'),
-        sender_bank_name=extracted_data_dict.get('sender_bank_name'), 
-        receiver_name=extracted_data_dict.get('receiver_name'),
-        receiver_bank_name=extracted_data_dict.get('receiver_bank_name'), 
-        status=extracted_data_dict.get('status'),
-        date=extracted_data_dict.get('date'),
-        amount=extracted_data_dict.get('amount')
-    )
-    
-    result = VerificationResult(
-        transaction_id=extracted_data_dict.get('transaction_id', boa_details.transaction_id), 
-        status=extracted_data_dict.get('status', 'Failed'),
-        message="Bank of Abyssinia verification completed." if extracted_data_dict.get('status') not in ["Network/Load Timeout", "Playwright Error", "Failed", "Invalid Transaction ID"] else "Bank of Abyssinia verification failed.",
-        verified_data=verified_details,
-        debug_info=extracted_data_dict.get('debug_info')
-    )
-    
-    return result
+async def _verify_boa(boa_details: BoATransactionDetails, traffic_class: str) -> VerificationOutcome:
+    return await verification_engine.verify(PROVIDER_BOA, boa_details.transaction_id, boa_details.sender_account, traffic_class)
 
-@app.post("/verify_boa_payment_from_image", response_model=VerificationResult)
-async def verify_boa_payment_from_image(
-    image_file: UploadFile = File(...),
-    sender_account_input: Optional[str] = Form(None)
-):
-    
-    image_base64 = None
-    try:
-        image_bytes = await image_file.read()
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-    except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail={
-                "transaction_id": "N/A", "status": "Failed",
-                "message": f"Could not read or process uploaded image file: {e}", "debug_info": str(e)
-            }
-        )
+@app.post("/verify_boa_payment", response_model=VerificationResult)
+async def verify_boa_payment(boa_details: BoATransactionDetails, traffic_class: str = Depends(get_traffic_class)):
+    return _result_response(await _verify_boa(boa_details, traffic_class))
+
+@app.post("/verify_boa_payment/stream")
+async def verify_boa_payment_stream(boa_details: BoATransactionDetails, traffic_class: str = Depends(get_traffic_class)):
+    return _progress_stream(lambda: _verify_boa(boa_details, traffic_class))
 
+def _account_required(provider: str, transaction_id: str, from_qr: bool = False) -> VerificationOutcome:
+    # The token carries what the image gave us, so the follow-up skips the QR decode and OCR.
+    token = issue_session_token(provider, transaction_id, from_qr=from_qr)
+    result = verification_engine.get(provider).account_required_result(transaction_id, token, IMAGE_SESSION_TTL_SECONDS)
+    return VerificationOutcome(result)
+
+async def _verify_boa_from_image(image_file: UploadFile, sender_account_input: Optional[str], traffic_class: str) -> VerificationOutcome:
     transaction_id_for_service = None
     sender_account_for_service = sender_account_input
 
-    extracted_details_from_gemini = await extract_text_id_from_image_gemini(image_base64)
+    async with open_upload(image_file) as image_buffer, admission_controller.admit("ocr", traffic_class):
+        extracted_details_from_gemini = await extract_text_id_from_image_gemini(image_buffer)
     
     if extracted_details_from_gemini and isinstance(extracted_details_from_gemini, dict):
         transaction_id_for_service = extracted_details_from_gemini.get("transaction_id")
@@ -178,86 +342,60 @@ async def verify_boa_payment_from_image(
             }
         )
     
-    sender_account_last_5_digits = sender_account_for_service[-5:] if sender_account_for_service and len(sender_account_for_service) >= 5 else None
-
-    if not sender_account_last_5_digits:
-        return VerificationResult(
-            transaction_id=transaction_id_for_service,
-            status="Account_Number_Required",
-            message=f"Bank of Abyssinia transaction ID ({transaction_id_for_service}) extracted. Please provide the sender's full account number to complete verification.",
-            verified_data=VerifiedDataDetails(
-                sender_account_number=None,
-                receiver_account_number=None,
-                transaction_id=transaction_id_for_service
-            ),
-            debug_info="Missing sender account for BOA verification."
-        )
+    transaction_id_for_service = _validate_extracted_transaction_id(PROVIDER_BOA, transaction_id_for_service)
+    progress.report("ocr_done", transaction_id=transaction_id_for_service)
+    sender_account_for_service = _validate_optional_account_number(PROVIDER_BOA, transaction_id_for_service, sender_account_for_service)
 
-    extracted_data_dict = await boa_service.verify_payment(
-        transaction_id=transaction_id_for_service, 
-        sender_account_last_5_digits=sender_account_last_5_digits
-    )
+    if not sender_account_for_service:
+        return _account_required(PROVIDER_BOA, transaction_id_for_service)
 
-    final_verified_data = VerifiedDataDetails(
-        sender_name=extracted_data_dict.get('sender_name'),
-        sender_bank_name=extracted_data_dict.get('sender_bank_name'), 
-        receiver_name=extracted_data_dict.get('receiver_name'),
-        receiver_bank_name=extracted_data_dict.get('receiver_bank_name'), 
-        status=extracted_data_dict.get('status'),
-        date=extracted_data_dict.get('date'),
-        amount=extracted_data_dict.get('amount'),
-        sender_account_number=sender_account_for_service, 
-        receiver_account_number=None
-    )
-    
-    result = VerificationResult(
-        transaction_id=extracted_data_dict.get('transaction_id', transaction_id_for_service), 
-        status=extracted_data_dict.get('status', 'Failed'),
-        message="Bank of Abyssinia image verification completed." if extracted_data_dict.get('status') not in ["Network/Load Timeout", "Playwright Error", "Failed", "Invalid Transaction ID"] else "Bank of Abyssinia image verification failed.",
-        verified_data=final_verified_data,
-        debug_info=extracted_data_dict.get('debug_info')
-    )
-    
-    return result
+    return await verification_engine.verify(PROVIDER_BOA, transaction_id_for_service, sender_account_for_service, traffic_class)
 
-@app.post("/verify_cbe_payment_from_image", response_model=VerificationResult)
-async def verify_cbe_payment_from_image(
+@app.post("/verify_boa_payment_from_image", response_model=AccountRequiredResult)
+async def verify_boa_payment_from_image(
     image_file: UploadFile = File(...),
-    account_number_input: Optional[str] = Form(None)
+    sender_account_input: Optional[str] = Form(None),
+    traffic_class: str = Depends(get_traffic_class)
 ):
-    
-    image_base64 = None
-    image_bytes = None 
-    try:
-        image_bytes = await image_file.read()
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-    except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail={
-                "transaction_id": "N/A", "status": "Failed",
-                "message": f"Could not read or process uploaded image file: {e}", "debug_info": str(e)
-            }
-        )
+    return _result_response(await _verify_boa_from_image(image_file, sender_account_input, traffic_class))
 
+@app.post("/verify_boa_payment_from_image/stream")
+async def verify_boa_payment_from_image_stream(
+    image_file: UploadFile = File(...),
+    sender_account_input: Optional[str] = Form(None),
+    traffic_class: str = Depends(get_traffic_class)
+):
+    image_file = detach_upload(image_file)
+    return _progress_stream(
+        lambda: _verify_boa_from_image(image_file, sender_account_input, traffic_class),
+        on_close=image_file.close
+    )
+
+async def _verify_cbe_from_image(image_file: UploadFile, account_number_input: Optional[str], traffic_class: str) -> VerificationOutcome:
     transaction_id_for_service = None
     account_number_for_service = account_number_input
+    decoded_from_qr = False
     
-    qr_data = extract_qr_code_data(image_bytes)
-    if qr_data:
-        cbe_qr_match = re.search(r'id=([A-Z0-9]+)(\d{8})', qr_data, re.IGNORECASE)
-        if cbe_qr_match:
-            transaction_id_for_service = cbe_qr_match.group(1)
-            account_number_for_service = account_number_for_service or cbe_qr_match.group(2) 
-        else:
-            pass
-    
-    if not transaction_id_for_service:
-        extracted_details_from_gemini = await extract_text_id_from_image_gemini(image_base64)
-        if extracted_details_from_gemini and isinstance(extracted_details_from_gemini, dict):
-            transaction_id_for_service = extracted_details_from_gemini.get("transaction_id")
-        else:
-            pass
+    async with open_upload(image_file) as image_buffer:
+        qr_data = await asyncio.to_thread(extract_qr_code_data, image_buffer)
+        if qr_data:
+            cbe_qr_reference = split_cbe_qr_reference(qr_data)
+            if cbe_qr_reference:
+                transaction_id_for_service = cbe_qr_reference[0]
+                account_number_for_service = account_number_for_service or cbe_qr_reference[1] 
+                decoded_from_qr = True
+                progress.report("qr_decoded", transaction_id=transaction_id_for_service)
+            else:
+                pass
+        
+        if not transaction_id_for_service:
+            async with admission_controller.admit("ocr", traffic_class):
+                extracted_details_from_gemini = await extract_text_id_from_image_gemini(image_buffer)
+            if extracted_details_from_gemini and isinstance(extracted_details_from_gemini, dict):
+                transaction_id_for_service = extracted_details_from_gemini.get("transaction_id")
+                progress.report("ocr_done", transaction_id=transaction_id_for_service)
+            else:
+                pass
 
     if not transaction_id_for_service:
         raise HTTPException(
@@ -269,76 +407,330 @@ async def verify_cbe_payment_from_image(
             }
         )
     
+    transaction_id_for_service = _validate_extracted_transaction_id(PROVIDER_CBE, transaction_id_for_service)
+    account_number_for_service = _validate_optional_account_number(PROVIDER_CBE, transaction_id_for_service, account_number_for_service)
+
     if not account_number_for_service:
-        return VerificationResult(
-            transaction_id=transaction_id_for_service,
-            status="Account_Number_Required",
-            message=f"Commercial Bank of Ethiopia transaction ID ({transaction_id_for_service}) extracted. Sender account number could not be provided. Please provide it manually.",
-            verified_data=VerifiedDataDetails(
-                sender_account_number=None,
-                receiver_account_number=None,
-                transaction_id=transaction_id_for_service
-            ),
-            debug_info="Missing sender account for CBE verification."
-        )
+        return _account_required(PROVIDER_CBE, transaction_id_for_service, from_qr=decoded_from_qr)
 
-    extracted_data_dict = await cbe_service.verify_payment(
-        transaction_id=transaction_id_for_service,
-        account_number=account_number_for_service
+    # A QR-decoded receipt skipped OCR entirely, so it is cheap to finish and jumps the queue.
+    return await verification_engine.verify(
+        PROVIDER_CBE, transaction_id_for_service, account_number_for_service, traffic_class, cheap=decoded_from_qr
     )
 
-    final_verified_data = VerifiedDataDetails(
-        sender_name=extracted_data_dict.get('sender_name'),
-        sender_bank_name=extracted_data_dict.get('sender_bank_name'),
-        receiver_name=extracted_data_dict.get('receiver_name'),
-        receiver_bank_name=extracted_data_dict.get('receiver_bank_name'),
-        status=extracted_data_dict.get('status'),
-        date=extracted_data_dict.get('date'),
-        amount=extracted_data_dict.get('amount'),
-        sender_account_number=account_number_for_service, 
-        receiver_account_number=None
-    )
+@app.post("/verify_cbe_payment_from_image", response_model=AccountRequiredResult)
+async def verify_cbe_payment_from_image(
+    image_file: UploadFile = File(...),
+    account_number_input: Optional[str] = Form(None),
+    traffic_class: str = Depends(get_traffic_class)
+):
+    return _result_response(await _verify_cbe_from_image(image_file, account_number_input, traffic_class))
 
-    result = VerificationResult(
-        transaction_id=extracted_data_dict.get('transaction_id', transaction_id_for_service),
-        status=extracted_data_dict.get('status', 'Failed'),
-        message="CBE image verification completed." if extracted_data_dict.get('status') not in ["PDF_FETCH_FAILED", "INVALID_INPUT_OR_PDF_FORMAT", "PDF_PARSE_FAILED"] else "CBE image verification failed.",
-        verified_data=final_verified_data,
-        debug_info=extracted_data_dict.get('debug_info')
+@app.post("/verify_cbe_payment_from_image/stream")
+async def verify_cbe_payment_from_image_stream(
+    image_file: UploadFile = File(...),
+    account_number_input: Optional[str] = Form(None),
+    traffic_class: str = Depends(get_traffic_class)
+):
+    image_file = detach_upload(image_file)
+    return _progress_stream(
+        lambda: _verify_cbe_from_image(image_file, account_number_input, traffic_class),
+        on_close=image_file.close
     )
 
-    return result
 
+# Background verifications started by /verify_image_session with prefetch; held so they are not
+# garbage-collected mid-flight.
+IMAGE_SESSION_MAX_PREFETCHES = int(os.getenv("IMAGE_SESSION_MAX_PREFETCHES", "32"))
+_image_session_prefetches = set()
+
+def _open_image_session(token: str):
+    try:
+        return open_session_token(token)
+    except ImageSessionError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "transaction_id": "N/A",
+                "status": "Invalid Session",
+                "message": str(e),
+                "debug_info": "The session_token was not issued by this service, was altered, or has expired."
+            }
+        )
+
+def _finish_prefetch(task: asyncio.Task) -> None:
+    _image_session_prefetches.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # The confirming call runs the verification again and reports the error itself.
+        metrics.increment("image_session_prefetches", outcome="error")
+
+@app.post("/verify_image_session", response_model=VerificationResult, responses={202: {"description": "Verification started in the background (prefetch)."}})
+async def verify_image_session(session_details: ImageSessionDetails, traffic_class: str = Depends(get_traffic_class)):
+    """
+    Second step of a BOA or CBE image verification that answered Account_Number_Required: send
+    its session_token with the account number, and the transaction ID extracted from the image is
+    verified without uploading the image again.
+
+    With `prefetch: true` the upstream fetch starts in the background and the call returns 202 at
+    once. Repeating the call without prefetch joins that fetch, or reads its cached result.
+    """
+    session = _open_image_session(session_details.session_token)
+    account = _validate_optional_account_number(session.provider, session.transaction_id, session_details.account_number)
+    if not account:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "transaction_id": session.transaction_id,
+                "status": "Account_Number_Required",
+                "message": "account_number is required to complete the verification.",
+                "debug_info": "Empty account_number."
+            }
+        )
+
+    run = lambda: verification_engine.verify(session.provider, session.transaction_id, account, traffic_class, cheap=session.from_qr)
+    if session_details.prefetch:
+        started = len(_image_session_prefetches) < IMAGE_SESSION_MAX_PREFETCHES
+        if started:
+            task = asyncio.create_task(run())
+            _image_session_prefetches.add(task)
+            task.add_done_callback(_finish_prefetch)
+        metrics.increment("image_session_prefetches", outcome="started" if started else "skipped")
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={
+                "transaction_id": session.transaction_id,
+                "status": "Pending",
+                "message": "Verification started. Repeat this request without prefetch to get the result.",
+                "debug_info": None if started else "Too many prefetches in flight; the verification runs when the result is requested."
+            }
+        )
+    return _result_response(await run())
+
+
+async def _verify_batch_image(
+    transaction_id: str, qr_account: Optional[str], from_qr: bool,
+    provider: Optional[str], account_number: Optional[str], traffic_class: str
+) -> VerificationOutcome:
+    """One receipt of a batch: the single-image endpoints' checks, then the verification engine."""
+    if provider is None:
+        # A CBE QR code carries the account; otherwise the ID's format has to be unambiguous.
+        likely_providers = [PROVIDER_CBE] if qr_account else classify_transaction_id(transaction_id)
+        if len(likely_providers) != 1:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "transaction_id": transaction_id,
+                    "status": "Failed",
+                    "message": "Could not tell which provider issued this receipt. Send the provider field with the batch.",
+                    "debug_info": f"Candidate providers: {', '.join(likely_providers) or 'none'}."
+                }
+            )
+        provider = likely_providers[0]
+
+    transaction_id = _validate_extracted_transaction_id(provider, transaction_id)
+    if provider == PROVIDER_TELEBIRR:
+        return await verification_engine.verify(provider, transaction_id, None, traffic_class, cheap=from_qr)
+    account = _validate_optional_account_number(provider, transaction_id, qr_account or account_number)
+    if not account:
+        return _account_required(provider, transaction_id, from_qr=from_qr)
+    return await verification_engine.verify(provider, transaction_id, account, traffic_class, cheap=from_qr)
+
+@app.post("/verify_payments_from_images")
+async def verify_payments_from_images(
+    files: List[UploadFile] = File(...),
+    provider: Optional[PaymentProviderName] = Form(None),
+    account_number: Optional[str] = Form(None),
+    traffic_class: str = Depends(get_traffic_class)
+):
+    """
+    Verifies many receipt images in one request: several `files`, each an image or a zip of
+    images. Without `provider`, each receipt's provider is inferred from its QR code or ID
+    format. `account_number` applies to every BOA and CBE receipt that lacks one in its QR code.
+
+    Responds with NDJSON (`application/x-ndjson`), one line per image as it finishes:
+    {"index", "filename", "source", "status_code", "result"} on success, or "error" in place
+    of "result", holding the detail the single-image endpoint would have returned.
+    """
+    uploads = [detach_upload(upload) for upload in files]
+    stack = AsyncExitStack()
+
+    async def close() -> None:
+        await stack.aclose()
+        for upload in uploads:
+            await upload.close()
+
+    try:
+        images, rejected = await collect_images(stack, uploads)
+    except BaseException:
+        await close()
+        raise
+
+    async def lines():
+        try:
+            async for line in stream_batch(
+                images, rejected,
+                lambda transaction_id, qr_account, from_qr: _verify_batch_image(
+                    transaction_id, qr_account, from_qr, provider.value if provider else None, account_number, traffic_class
+                ),
+                lambda exc: _describe_error(exc, "batch"),
+                traffic_class
+            ):
+                yield line
+        finally:
+            await close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
+async def _verify_cbe(cbe_details: CBETransactionDetails, traffic_class: str) -> VerificationOutcome:
+    return await verification_engine.verify(PROVIDER_CBE, cbe_details.transaction_id, cbe_details.account_number, traffic_class)
 
 @app.post("/verify_cbe_payment", response_model=VerificationResult)
-async def verify_cbe_payment(cbe_details: CBETransactionDetails):
-    extracted_data_dict = await cbe_service.verify_payment(
-        transaction_id=cbe_details.transaction_id,
-        account_number=cbe_details.account_number
-    )
+async def verify_cbe_payment(cbe_details: CBETransactionDetails, traffic_class: str = Depends(get_traffic_class)):
+    return _result_response(await _verify_cbe(cbe_details, traffic_class))
 
-    verified_details = VerifiedDataDetails(
-        sender_name=extracted_data_dict.get('sender_name'),
-        sender_bank_name=extracted_data_dict.get('sender_bank_name'),
-        receiver_name=extracted_data_dict.get('receiver_name'),
-        receiver_bank_name=extracted_data_dict.get('receiver_bank_name'),
-        status=extracted_data_dict.get('status'),
-        date=extracted_data_dict.get('date'),
-        amount=extracted_data_dict.get('amount')
-    )
+@app.post("/verify_cbe_payment/stream")
+async def verify_cbe_payment_stream(cbe_details: CBETransactionDetails, traffic_class: str = Depends(get_traffic_class)):
+    return _progress_stream(lambda: _verify_cbe(cbe_details, traffic_class))
 
-    result = VerificationResult(
-        transaction_id=extracted_data_dict.get('transaction_id', cbe_details.transaction_id),
-        status=extracted_data_dict.get('status', 'Failed'),
-        message="CBE PDF parsing completed." if extracted_data_dict.get('status') not in ["PDF_FETCH_FAILED", "INVALID_INPUT_OR_PDF_FORMAT", "PDF_PARSE_FAILED"] else "CBE PDF parsing failed.",
-        verified_data=verified_details,
-        debug_info=extracted_data_dict.get('debug_info')
+async def _get_watch(watch_id: str):
+    snapshot = await transaction_watcher.snapshot(watch_id)
+    if snapshot is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "transaction_id": "N/A",
+                "status": "Watch Not Found",
+                "message": "No such watch. It may have finished more than WATCH_RETENTION_SECONDS ago.",
+                "debug_info": f"watch_id={watch_id}"
+            }
+        )
+    return snapshot
+
+@app.post("/watches", status_code=status.HTTP_202_ACCEPTED)
+async def create_watch(watch_request: WatchRequest):
+    """
+    Watches a receipt that is not final yet (e.g. a Telebirr payment still pending). It is
+    rechecked in the background with increasing intervals until its status settles. Follow it
+    with GET /watches/{watch_id}/events (SSE), poll GET /watches/{watch_id}, or give a
+    callback_url to receive one POST with the final result. Registering a transaction that is
+    already watched joins the existing watch. callback_url must be an http(s) URL on a public
+    host, or on one listed in WATCH_CALLBACK_ALLOWED_HOSTS.
+    """
+    callback_url = str(watch_request.callback_url) if watch_request.callback_url else None
+    if callback_url:
+        try:
+            await check_callback_url(callback_url)
+        except CallbackNotAllowed as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "transaction_id": watch_request.transaction_id,
+                    "status": "Invalid Callback URL",
+                    "message": "callback_url must be an http or https URL on a public or allowed host.",
+                    "debug_info": str(e)
+                }
+            )
+    try:
+        snapshot = await transaction_watcher.register(
+            watch_request.provider.value, watch_request.transaction_id, watch_request.account_number, callback_url
+        )
+    except WatchCapacityReached as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={
+                "transaction_id": watch_request.transaction_id,
+                "status": "Service Overloaded",
+                "message": f"Too many transactions are being watched. Retry after {e.retry_after} seconds.",
+                "debug_info": str(e)
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return snapshot
+
+@app.get("/watches/{watch_id}")
+async def get_watch(watch_id: str):
+    """Current state of a watch, answered from the watch store without contacting the provider."""
+    return await _get_watch(watch_id)
+
+@app.get("/watches/{watch_id}/events")
+async def watch_events(watch_id: str):
+    snapshot = await _get_watch(watch_id)
+    return StreamingResponse(
+        transaction_watcher.events(watch_id, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
-    return result
+# POS terminals send {"provider", "transaction_id", "account"}; each runs the REST endpoint's code path.
+POS_HANDLERS = {
+    PROVIDER_TELEBIRR: lambda message, traffic_class: _verify_telebirr(
+        TransactionDetails(transaction_id=message.get("transaction_id")), traffic_class
+    ),
+    PROVIDER_BOA: lambda message, traffic_class: _verify_boa(
+        BoATransactionDetails(transaction_id=message.get("transaction_id"), sender_account=message.get("account")), traffic_class
+    ),
+    PROVIDER_CBE: lambda message, traffic_class: _verify_cbe(
+        CBETransactionDetails(transaction_id=message.get("transaction_id"), account_number=message.get("account")), traffic_class
+    ),
+}
+
+@app.websocket("/ws/pos")
+async def pos_websocket(websocket: WebSocket):
+    """
+    Persistent verification channel for POS terminals; see services/pos_channel.py for the
+    message format. Authenticate with `Authorization: Bearer <token>` or `?token=`.
+    """
+    terminal_id = authenticate_terminal(bearer_token(websocket))
+    if terminal_id is None:
+        metrics.increment("pos_rejected", reason="unauthorized")
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+    await websocket.accept()
+    channel = PosChannel(
+        websocket, terminal_id,
+        normalize_traffic_class(websocket.headers.get("x-traffic-class")),
+        POS_HANDLERS,
+        lambda exc: _describe_error(exc, "ws")
+    )
+    await pos_channels.attach(channel)
+    try:
+        await channel.run()
+    finally:
+        pos_channels.detach(channel)
 
 
 @app.get("/")
 async def root():
     return {"message": "Transaction Verification API. Use /docs for API documentation."}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until warm-up has finished, so traffic only arrives at a warm worker."""
+    status_body = readiness.status()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if status_body["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=status_body
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+def require_profile_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    # 404 rather than 401/403, so the endpoints are invisible unless profiling is set up.
+    if not profiling.is_admin(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+@app.get("/debug/profiles", dependencies=[Depends(require_profile_admin)], include_in_schema=False)
+async def list_profiles():
+    """Captured request profiles, newest first. Send a request with `X-Profile: <token>` to capture one."""
+    return {"profiles": await asyncio.to_thread(profile_store.list), "artifacts": sorted(profiling.ARTIFACTS)}
+
+@app.get("/debug/profiles/{profile_id}/{artifact}", dependencies=[Depends(require_profile_admin)], include_in_schema=False)
+async def download_profile_artifact(profile_id: str, artifact: str):
+    path = profile_store.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile artifact not found.")
+    return FileResponse(path, media_type=profiling.ARTIFACTS[artifact], filename=f"{profile_id}-{artifact}")
+
@@ -1,8 +1,19 @@
 # models/models.py
 
-from pydantic import BaseModel
+from enum import Enum
+from pydantic import BaseModel, HttpUrl, field_validator, model_validator
 from typing import Optional
 
+from utils.transaction_ids import (
+    PROVIDER_TELEBIRR, PROVIDER_BOA, PROVIDER_CBE,
+    validate_transaction_id, validate_account_number
+)
+
+class PaymentProviderName(str, Enum):
+    TELEBIRR = PROVIDER_TELEBIRR
+    BOA = PROVIDER_BOA
+    CBE = PROVIDER_CBE
+
 # Model for the detailed scraped/parsed data
 class VerifiedDataDetails(BaseModel):
     sender_name: Optional[str] = None
@@ -21,10 +32,21 @@ class VerificationResult(BaseModel):
     verified_data: Optional[VerifiedDataDetails] = None 
     debug_info: Optional[str] = None 
 
+# Returned by the image endpoints when the receipt names a transaction but no account. The token
+# lets the client finish through /verify_image_session without uploading the image again.
+class AccountRequiredResult(VerificationResult):
+    session_token: Optional[str] = None
+    session_expires_in: Optional[int] = None
+
 # Input model for the API endpoint (transaction ID directly)
 class TransactionDetails(BaseModel):
     transaction_id: str 
 
+    @field_validator("transaction_id")
+    @classmethod
+    def check_transaction_id(cls, value: str) -> str:
+        return validate_transaction_id(PROVIDER_TELEBIRR, value)
+
 # Input model for image-based verification (OCR only)
 class ImageVerificationRequest(BaseModel):
     image_base64: str # Base64 encoded string of the image (e.g., JPEG, PNG)
@@ -33,7 +55,54 @@ class ImageVerificationRequest(BaseModel):
 class BoATransactionDetails(BaseModel):
     transaction_id: str
     sender_account: str # Full sender account number
+
+    @field_validator("transaction_id")
+    @classmethod
+    def check_transaction_id(cls, value: str) -> str:
+        return validate_transaction_id(PROVIDER_BOA, value)
+
+    @field_validator("sender_account")
+    @classmethod
+    def check_sender_account(cls, value: str) -> str:
+        return validate_account_number(PROVIDER_BOA, value)
+
 class CBETransactionDetails(BaseModel):
     transaction_id: str # The transaction ID part (e.g., FT25189TY6KT)
     account_number: str # The full account number (e.g., 1234567890123)
 
+    @field_validator("transaction_id")
+    @classmethod
+    def check_transaction_id(cls, value: str) -> str:
+        return validate_transaction_id(PROVIDER_CBE, value)
+
+    @field_validator("account_number")
+    @classmethod
+    def check_account_number(cls, value: str) -> str:
+        return validate_account_number(PROVIDER_CBE, value)
+
+# Second step of an image verification that returned Account_Number_Required
+class ImageSessionDetails(BaseModel):
+    session_token: str
+    account_number: str
+    # Start the verification in the background and return 202 at once; a later call without
+    # prefetch picks up the result.
+    prefetch: bool = False
+
+# Registers a background watch on a receipt that is not final yet
+class WatchRequest(BaseModel):
+    provider: PaymentProviderName
+    transaction_id: str
+    account_number: Optional[str] = None # Required for BOA and CBE
+    callback_url: Optional[HttpUrl] = None # Receives one POST when the watch settles or expires
+
+    @model_validator(mode="after")
+    def check_ids(self) -> "WatchRequest":
+        provider = self.provider.value
+        self.transaction_id = validate_transaction_id(provider, self.transaction_id)
+        if provider == PROVIDER_TELEBIRR:
+            self.account_number = None
+        elif not self.account_number:
+            raise ValueError(f"account_number is required to watch a {provider.upper()} transaction.")
+        else:
+            self.account_number = validate_account_number(provider, self.account_number)
+        return self
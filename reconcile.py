@@ -0,0 +1,399 @@
+# reconcile.py
+"""
+Overnight bulk reconciliation: verifies a CSV of expected payments against the providers,
+calling the service classes directly (no HTTP hop through the API).
+
+Input CSV columns (header names are case-insensitive):
+    provider            telebirr, boa or cbe
+    transaction_id
+    account             sender account; required for BOA and CBE (aliases: account_number, sender_account)
+    expected_amount     (alias: amount)
+    expected_receiver   optional (aliases: receiver, receiver_name)
+
+The CSV is streamed, never loaded whole. Rows are verified concurrently with a separate limit
+per provider. Every finished row is appended to the results log (JSONL), which doubles as the
+checkpoint: re-running with the same --output skips rows that are already in it, so a crashed
+or interrupted run resumes where it stopped. When the run ends, rows whose latest outcome is
+not `match` are written to the mismatch report.
+
+Outcomes: match (the receipt is Completed and agrees with the row), amount_mismatch,
+receiver_mismatch, pending (the payment is not final yet), unverified (the receipt exists but is
+not Completed, e.g. failed or reversed), not_found, error (transient), invalid_row. Re-run with
+--retry-errors to verify error and pending rows again.
+
+Usage:
+    python reconcile.py payments.csv --output results.jsonl
+    python reconcile.py payments.csv --output results.jsonl --concurrency cbe=16,telebirr=6
+    python reconcile.py payments.csv --output results.jsonl --retry-errors
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+# Before any project import: services and utils read their settings from the environment when imported.
+load_dotenv()
+
+from services.boa_service import BOAService
+from services.browser_pool import browser_pool
+from services.browser_supervisor import browser_supervisor
+from services.cbe_service import CBEService
+from services.payment_service import VerificationEngine
+from services.telebirr_service import TelebirrService
+from utils.deadline import deadline_scope
+from utils.gemini_client import close_client as close_gemini_client
+from utils.log import configure_logging
+from utils.shared_cache import NEGATIVE_STATUSES, UNCACHEABLE_STATUSES, is_pending_status
+from utils.transaction_ids import (
+    PROVIDER_BOA, PROVIDER_CBE, PROVIDER_TELEBIRR, TransactionIdError, validate_account_number, validate_transaction_id
+)
+
+# Scrapes share one Chromium; CBE is an HTTP fetch plus Gemini and tolerates more parallelism.
+DEFAULT_CONCURRENCY = {PROVIDER_TELEBIRR: 4, PROVIDER_BOA: 4, PROVIDER_CBE: 8}
+COLUMN_ALIASES = {
+    "provider": ("provider",),
+    "transaction_id": ("transaction_id", "transaction id", "reference"),
+    "account": ("account", "account_number", "sender_account"),
+    "expected_amount": ("expected_amount", "amount"),
+    "expected_receiver": ("expected_receiver", "receiver", "receiver_name"),
+}
+OUTCOME_MATCH = "match"
+OUTCOME_PENDING = "pending"
+OUTCOME_UNVERIFIED = "unverified"
+OUTCOME_ERROR = "error"
+# Outcomes that may change on a later run; --retry-errors verifies these rows again.
+RETRYABLE_OUTCOMES = frozenset({OUTCOME_ERROR, OUTCOME_PENDING})
+COMPLETED_STATUS = "Completed"
+AMOUNT_TOLERANCE = 0.01
+# Appended results are flushed this often; a crash re-verifies at most this much work.
+FLUSH_INTERVAL_SECONDS = 1.0
+
+_NAME_NOISE_RE = re.compile(r"[^0-9a-z]+")
+
+
+def _parse_amount(raw: Any) -> Optional[float]:
+    if raw is None:
+        return None
+    if isinstance(raw, (int, float)):
+        return float(raw)
+    cleaned = re.sub(r"[^\d.\-]", "", str(raw))
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+
+def _normalize_name(name: Optional[str]) -> str:
+    return " ".join(_NAME_NOISE_RE.sub(" ", (name or "").casefold()).split())
+
+
+def receiver_matches(expected: str, actual: Optional[str]) -> bool:
+    """Receipts truncate and reformat names, so either normalized name may contain the other."""
+    expected_name, actual_name = _normalize_name(expected), _normalize_name(actual)
+    if not expected_name:
+        return True
+    return bool(actual_name) and (expected_name in actual_name or actual_name in expected_name)
+
+
+def classify(row: Dict[str, Any], status: Optional[str], amount: Optional[float], receiver: Optional[str]) -> str:
+    if not status or status in UNCACHEABLE_STATUSES:
+        return OUTCOME_ERROR
+    if status in NEGATIVE_STATUSES:
+        return "not_found"
+    # Only a completed receipt can match; amount and receiver agreeing on anything else proves nothing.
+    if status != COMPLETED_STATUS:
+        return OUTCOME_PENDING if is_pending_status(status) else OUTCOME_UNVERIFIED
+    expected_amount = row["expected_amount"]
+    if expected_amount is not None and (amount is None or abs(amount - expected_amount) > AMOUNT_TOLERANCE):
+        return "amount_mismatch"
+    if not receiver_matches(row["expected_receiver"], receiver):
+        return "receiver_mismatch"
+    return OUTCOME_MATCH
+
+
+class CompletedRows:
+    """Row numbers already verified: a contiguous watermark plus the sparse set above it."""
+
+    def __init__(self):
+        self.watermark = 0
+        self.above: Set[int] = set()
+
+    def add(self, row_number: int) -> None:
+        if row_number <= self.watermark:
+            return
+        self.above.add(row_number)
+        while self.watermark + 1 in self.above:
+            self.watermark += 1
+            self.above.discard(self.watermark)
+
+    def __contains__(self, row_number: int) -> bool:
+        return row_number <= self.watermark or row_number in self.above
+
+    def __len__(self) -> int:
+        return self.watermark + len(self.above)
+
+
+def load_checkpoint(path: str, retry_errors: bool) -> CompletedRows:
+    """Reads the results log of an earlier run. A torn last line from a crash is ignored."""
+    completed = CompletedRows()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if retry_errors and entry.get("outcome") in RETRYABLE_OUTCOMES:
+                continue
+            completed.add(entry["row"])
+    return completed
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.DictReader(csv_file)
+        columns = {(name or "").strip().lower(): name for name in reader.fieldnames or []}
+        mapping = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            mapping[field] = next((columns[alias] for alias in aliases if alias in columns), None)
+        for required in ("provider", "transaction_id", "expected_amount"):
+            if mapping[required] is None:
+                raise SystemExit(f"{path}: missing required column '{required}'.")
+        for row_number, raw in enumerate(reader, start=1):
+            yield row_number, {field: (raw.get(column) or "").strip() if column else "" for field, column in mapping.items()}
+
+
+def prepare_row(raw: Dict[str, str]) -> Dict[str, Any]:
+    """Validates a CSV row locally; raises ValueError with a reason for rows that cannot be verified."""
+    provider = raw["provider"].lower()
+    if provider not in DEFAULT_CONCURRENCY:
+        raise ValueError(f"Unknown provider '{raw['provider']}'.")
+    try:
+        transaction_id = validate_transaction_id(provider, raw["transaction_id"])
+        # Telebirr receipts are looked up by ID alone; any account given is informational.
+        account = validate_account_number(provider, raw["account"]) if raw["account"] and provider != PROVIDER_TELEBIRR else None
+    except TransactionIdError as e:
+        raise ValueError(e.message)
+    if provider in (PROVIDER_BOA, PROVIDER_CBE) and not account:
+        raise ValueError("Account number is required for BOA and CBE.")
+    return {
+        "provider": provider,
+        "transaction_id": transaction_id,
+        "account": account,
+        "expected_amount": _parse_amount(raw["expected_amount"]),
+        "expected_receiver": raw["expected_receiver"],
+    }
+
+
+class Reconciler:
+    def __init__(self, output_path: str, concurrency: Dict[str, int], row_timeout: float, progress_interval: float):
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.row_timeout = row_timeout
+        self.progress_interval = progress_interval
+        # A private engine: rows are verified against the banks directly, never from the shared cache.
+        self.engine = VerificationEngine()
+        for service in (TelebirrService(), BOAService(), CBEService()):
+            self.engine.register(service)
+        self.outcomes: Counter = Counter()
+        self.in_flight: Counter = Counter()
+        self.skipped = 0
+        self.processed = 0
+        self.started_at = time.perf_counter()
+        self._recent: deque = deque()
+        self._log = None
+        self._last_flush = time.perf_counter()
+
+    async def _fetch(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self.engine.get(row["provider"]).verify_payment(row["transaction_id"], row["account"])
+        details = result.verified_data.model_dump() if result.verified_data else {}
+        return {**details, "status": result.status, "debug_info": result.debug_info}
+
+    async def _verify(self, row_number: int, row: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            with deadline_scope(self.row_timeout):
+                details = await self._fetch(row)
+        except Exception as e:
+            details = {"status": None, "debug_info": f"{type(e).__name__}: {e}"}
+        amount = _parse_amount(details.get("amount"))
+        outcome = classify(row, details.get("status"), amount, details.get("receiver_name"))
+        return {
+            "row": row_number, **row, "outcome": outcome, "status": details.get("status"),
+            "actual_amount": amount, "actual_receiver": details.get("receiver_name"),
+            "debug_info": details.get("debug_info") or None,
+        }
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        self._log.write(json.dumps(entry, default=str) + "\n")
+        self.outcomes[entry["outcome"]] += 1
+        self.processed += 1
+        now = time.perf_counter()
+        self._recent.append(now)
+        if now - self._last_flush >= FLUSH_INTERVAL_SECONDS:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._last_flush = now
+
+    async def _worker(self, provider: str, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            row_number, row = item
+            self.in_flight[provider] += 1
+            try:
+                self._record(await self._verify(row_number, row))
+            finally:
+                self.in_flight[provider] -= 1
+
+    def progress_line(self) -> str:
+        now = time.perf_counter()
+        while self._recent and now - self._recent[0] > 10.0:
+            self._recent.popleft()
+        overall_rate = self.processed / max(now - self.started_at, 1e-9)
+        outcomes = " ".join(f"{name} {count}" for name, count in sorted(self.outcomes.items()))
+        in_flight = " ".join(f"{p} {self.in_flight[p]}/{limit}" for p, limit in self.concurrency.items())
+        return (
+            f"processed {self.processed:,} (skipped {self.skipped:,}) | "
+            f"{overall_rate:.1f} rows/s, last 10s {len(self._recent) / max(min(10.0, now - self.started_at), 1e-9):.1f} | "
+            f"{outcomes or '-'} | in flight {in_flight}"
+        )
+
+    async def _report_progress(self) -> None:
+        interactive = sys.stderr.isatty()
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            line = self.progress_line()
+            sys.stderr.write(f"\r\033[K{line}" if interactive else f"{line}\n")
+            sys.stderr.flush()
+
+    async def run(self, input_path: str, completed: CompletedRows) -> None:
+        queues = {provider: asyncio.Queue(maxsize=limit * 2) for provider, limit in self.concurrency.items()}
+        workers = [
+            asyncio.create_task(self._worker(provider, queues[provider]))
+            for provider, limit in self.concurrency.items() for _ in range(limit)
+        ]
+        reporter = asyncio.create_task(self._report_progress())
+        self._log = open(self.output_path, "a", encoding="utf-8")
+        try:
+            for row_number, raw in read_rows(input_path):
+                if row_number in completed:
+                    self.skipped += 1
+                    continue
+                try:
+                    row = prepare_row(raw)
+                except ValueError as e:
+                    self._record({"row": row_number, **raw, "outcome": "invalid_row", "debug_info": str(e)})
+                    continue
+                # Blocks while that provider's workers are saturated, so memory stays flat.
+                await queues[row["provider"]].put((row_number, row))
+            for provider, limit in self.concurrency.items():
+                for _ in range(limit):
+                    await queues[provider].put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._log.close()
+            sys.stderr.write(f"\n{self.progress_line()}\n")
+
+    async def close(self) -> None:
+        await browser_supervisor.stop()
+        await browser_pool.close()
+        await self.engine.get(PROVIDER_CBE).close()
+        await close_gemini_client()
+
+
+def write_mismatch_report(log_path: str, report_path: str) -> int:
+    """Writes rows whose latest outcome is not a match, in row order. Returns how many."""
+    latest: Dict[int, Dict[str, Any]] = {}
+    with open(log_path, encoding="utf-8") as log:
+        for line in log:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("outcome") == OUTCOME_MATCH:
+                latest.pop(entry["row"], None)
+            else:
+                latest[entry["row"]] = entry
+    fields = [
+        "row", "provider", "transaction_id", "account", "outcome", "status",
+        "expected_amount", "actual_amount", "expected_receiver", "actual_receiver", "debug_info"
+    ]
+    with open(report_path, "w", newline="", encoding="utf-8") as report:
+        writer = csv.DictWriter(report, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for row_number in sorted(latest):
+            writer.writerow(latest[row_number])
+    return len(latest)
+
+
+def parse_concurrency(value: str) -> Dict[str, int]:
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    for pair in filter(None, (part.strip() for part in value.split(","))):
+        provider, _, limit = pair.partition("=")
+        provider = provider.strip().lower()
+        if provider not in concurrency or not limit.strip().isdigit() or int(limit) < 1:
+            raise argparse.ArgumentTypeError(f"Expected provider=N with provider in {', '.join(DEFAULT_CONCURRENCY)}, got '{pair}'.")
+        concurrency[provider] = int(limit)
+    return concurrency
+
+
+async def _main(args) -> int:
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    completed = load_checkpoint(args.output, args.retry_errors)
+    if len(completed):
+        print(f"Resuming: {len(completed):,} rows already in {args.output}", file=sys.stderr)
+
+    reconciler = Reconciler(args.output, args.concurrency, args.row_timeout, args.progress_interval)
+    browser_supervisor.start(browser_pool)
+    try:
+        await reconciler.run(args.input, completed)
+    finally:
+        await reconciler.close()
+
+    report_path = args.mismatches or f"{os.path.splitext(args.output)[0]}-mismatches.csv"
+    mismatches = write_mismatch_report(args.output, report_path)
+    print(f"{mismatches:,} rows need attention; see {report_path}", file=sys.stderr)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Verify a CSV of expected payments against the providers.")
+    parser.add_argument("input", help="CSV of expected payments.")
+    parser.add_argument("--output", required=True, help="Results log (JSONL); also the resume checkpoint.")
+    parser.add_argument("--mismatches", help="Mismatch report CSV (default: <output>-mismatches.csv).")
+    parser.add_argument("--concurrency", type=parse_concurrency, default=dict(DEFAULT_CONCURRENCY),
+                        help="Per-provider limits, e.g. telebirr=4,boa=4,cbe=8.")
+    parser.add_argument("--row-timeout", type=float, default=120.0, help="Seconds allowed per verification.")
+    parser.add_argument("--retry-errors", action="store_true", help="Re-verify rows whose last outcome was a transient error or pending.")
+    parser.add_argument("--restart", action="store_true", help="Discard the existing results log and start over.")
+    parser.add_argument("--progress-interval", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    # Same JSON log lines as the API; progress lines go to stderr, logs to stdout.
+    configure_logging()
+    try:
+        return asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; re-run with --output {args.output} to resume.", file=sys.stderr)
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,118 +1,114 @@
 # services/boa_service.py
 
 import asyncio
+import logging
 import re
 from datetime import datetime
-from playwright.async_api import async_playwright, Error, TimeoutError
-from bs4 import BeautifulSoup 
+from typing import Optional
 import sys 
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-from models import VerificationResult, VerifiedDataDetails
+from models import PaymentProviderName
+from services.payment_service import ScrapedPaymentService
+from services.scrape_profiles import BOA_SCRAPE_PROFILE, BOA_SLIP_BASE_URL
+from utils import progress
 
-class BOAService:
-    def __init__(self):
-        self.base_url = "https://cs.bankofabyssinia.com/slip/"
-
-    async def verify_payment(self, transaction_id: str, sender_account_last_5_digits: str) -> dict:
-        full_trx_param = f"{transaction_id}{sender_account_last_5_digits}"
-        receipt_url = f"{self.base_url}?trx={full_trx_param}"
-        
-        sender_name = None
-        sender_bank_name = "Bank of Abyssinia"
-        receiver_name = None 
-        receiver_bank_name = None 
-        transaction_status = "Completed"
-        payment_date_iso = None
-        final_amount_float = 0.0
-        extracted_transaction_id = transaction_id
-
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context()
-            page = await context.new_page()
+logger = logging.getLogger(__name__)
+
+BOA_FOUND_SELECTOR = 'table.my-5'
+# Error states seen on the slip page: an alert/danger block or a "not found"/"invalid" notice.
+BOA_ERROR_SELECTOR = '.alert-danger, .text-danger, :text-matches("(transaction|record|slip).{0,20}not found|invalid (transaction|reference)", "i")'
+
+def _parse_boa_receipt_html(html_content: str, transaction_id: str) -> dict:
+    """
+    Parses the HTML of a Bank of Abyssinia slip page into a dictionary of extracted details.
+    Kept separate from the Playwright fetch so it can be timed on recorded pages.
+    """
+    sender_name = None
+    sender_bank_name = "Bank of Abyssinia"
+    receiver_name = None 
+    receiver_bank_name = None 
+    transaction_status = "Completed"
+    payment_date_iso = None
+    final_amount_float = 0.0
+    extracted_transaction_id = transaction_id
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, 'html.parser')
 
+    def get_value_by_label_bs4(soup_obj, label_text):
+        label_td = soup_obj.find('td', string=lambda text: text and text.strip() == label_text)
+        if label_td and label_td.find_next_sibling('td'):
+            return label_td.find_next_sibling('td').get_text(strip=True)
+        return None
+    
+    main_table = soup.find('table', class_='my-5')
+
+    if main_table:
+        sender_name = get_value_by_label_bs4(main_table, "Source Account Name")
+        receiver_name = get_value_by_label_bs4(main_table, "Receiver's Name")
+
+        amount_str = get_value_by_label_bs4(main_table, "Transferred amount")
+        if amount_str:
+            cleaned_amount_str = re.sub(r'[^\d.]', '', amount_str)
             try:
-                await page.goto(receipt_url, wait_until="domcontentloaded", timeout=60000) 
-                await page.wait_for_selector('h1.text-center:has-text("Receipt")', timeout=30000)
-                await page.wait_for_selector('table.my-5', timeout=30000)
-                
-                html_content = await page.content()
-                soup = BeautifulSoup(html_content, 'html.parser')
-
-                def get_value_by_label_bs4(soup_obj, label_text):
-                    label_td = soup_obj.find('td', string=lambda text: text and text.strip() == label_text)
-                    if label_td and label_td.find_next_sibling('td'):
-                        return label_td.find_next_sibling('td').get_text(strip=True)
-                    return None
+                final_amount_float = float(cleaned_amount_str)
+            except ValueError:
+                pass
+
+        date_str = get_value_by_label_bs4(main_table, "Transaction Date")
+        if date_str:
+            try:
+                day, month, year_short = date_str.split(' ')[0].split('/')
+                hour, minute = date_str.split(' ')[1].split(':')
+                full_year = f"20{year_short}"
                 
-                main_table = soup.find('table', class_='my-5')
-
-                if main_table:
-                    sender_name = get_value_by_label_bs4(main_table, "Source Account Name")
-                    receiver_name = get_value_by_label_bs4(main_table, "Receiver's Name")
-
-                    amount_str = get_value_by_label_bs4(main_table, "Transferred amount")
-                    if amount_str:
-                        cleaned_amount_str = re.sub(r'[^\d.]', '', amount_str)
-                        try:
-                            final_amount_float = float(cleaned_amount_str)
-                        except ValueError:
-                            pass
-
-                    date_str = get_value_by_label_bs4(main_table, "Transaction Date")
-                    if date_str:
-                        try:
-                            day, month, year_short = date_str.split(' ')[0].split('/')
-                            hour, minute = date_str.split(' ')[1].split(':')
-                            full_year = f"20{year_short}"
-                            
-                            dt_obj = datetime(int(full_year), int(month), int(day), int(hour), int(minute))
-                            payment_date_iso = dt_obj.isoformat()
-                        except ValueError:
-                            pass
-
-                    extracted_transaction_id = get_value_by_label_bs4(main_table, "Transaction Reference")
-                    if not extracted_transaction_id:
-                        extracted_transaction_id = transaction_id
-
-                else:
-                    transaction_status = "Failed"
-
-                return {
-                    "sender_name": sender_name,
-                    "sender_bank_name": sender_bank_name, 
-                    "receiver_name": receiver_name,
-                    "receiver_bank_name": receiver_bank_name, 
-                    "status": transaction_status,
-                    "date": payment_date_iso,
-                    "amount": final_amount_float,
-                    "transaction_id": extracted_transaction_id
-                }
-
-            except TimeoutError as e:
-                return {
-                    "sender_name": None, "sender_bank_name": "Bank of Abyssinia", 
-                    "receiver_name": None, "receiver_bank_name": None, 
-                    "status": "Network/Load Timeout", "date": None, "amount": 0.0,
-                    "debug_info": str(e), "transaction_id": transaction_id
-                }
-            except Error as e:
-                return {
-                    "sender_name": None, "sender_bank_name": "Bank of Abyssinia", 
-                    "receiver_name": None, "receiver_bank_name": None, 
-                    "status": "Playwright Error", "date": None, "amount": 0.0,
-                    "debug_info": str(e), "transaction_id": transaction_id
-                }
-            except Exception as e:
-                return {
-                    "sender_name": None, "sender_bank_name": "Bank of Abyssinia", 
-                    "receiver_name": None, "receiver_bank_name": None, 
-                    "status": "Failed", "date": None, "amount": 0.0,
-                    "debug_info": str(e), "transaction_id": transaction_id
-                }
-            finally:
-                await browser.close()
-            
+                dt_obj = datetime(int(full_year), int(month), int(day), int(hour), int(minute))
+                payment_date_iso = dt_obj.isoformat()
+            except ValueError:
+                pass
+
+        extracted_transaction_id = get_value_by_label_bs4(main_table, "Transaction Reference")
+        if not extracted_transaction_id:
+            extracted_transaction_id = transaction_id
+
+    else:
+        transaction_status = "Failed"
+
+    return {
+        "sender_name": sender_name,
+        "sender_bank_name": sender_bank_name, 
+        "receiver_name": receiver_name,
+        "receiver_bank_name": receiver_bank_name, 
+        "status": transaction_status,
+        "date": payment_date_iso,
+        "amount": final_amount_float,
+        "transaction_id": extracted_transaction_id
+    }
+
+class BOAService(ScrapedPaymentService):
+    provider_name = PaymentProviderName.BOA
+    account_digits = 5
+    bank_name = "Bank of Abyssinia"
+    scrape_profile = BOA_SCRAPE_PROFILE
+    found_selector = BOA_FOUND_SELECTOR
+    not_found_selector = BOA_ERROR_SELECTOR
+    not_found_debug_info = "Bank of Abyssinia slip page reported an error instead of a receipt."
+    completed_message = "Bank of Abyssinia verification completed."
+    failed_message = "Bank of Abyssinia verification failed."
+
+    def __init__(self):
+        self.base_url = BOA_SLIP_BASE_URL
+
+    def receipt_url(self, transaction_id: str, account_suffix: Optional[str]) -> str:
+        # The slip link takes the reference followed by the last 5 digits of the sender's account.
+        return f"{self.base_url}?trx={transaction_id}{account_suffix}"
+
+    async def parse(self, raw: str, transaction_id: str) -> dict:
+        extracted = _parse_boa_receipt_html(raw, transaction_id)
+        progress.report_partial(extracted)
+        progress.report("parsed", provider="boa")
+        return extracted
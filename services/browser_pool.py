@@ -0,0 +1,245 @@
+# services/browser_pool.py
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from services.scrape_profiles import ScrapeProfile, ScrapeStats, ProfileRouter
+from services.browser_supervisor import browser_marker
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def race_selectors(page, selectors: Dict[str, str], timeout_ms: float, provider: str, started_at: float = None) -> str:
+    """
+    Waits for several selectors at once and returns the name of whichever appears first,
+    e.g. {"found": ..., "not_found": ...}. A selector that times out does not end the race
+    while others are still pending; if all of them fail, the last error is re-raised.
+    Resolution time is recorded per outcome so invalid IDs and timeouts can be told apart.
+    """
+    started_at = started_at if started_at is not None else time.perf_counter()
+    tasks = {
+        asyncio.ensure_future(page.wait_for_selector(selector, timeout=timeout_ms)): name
+        for name, selector in selectors.items()
+    }
+    pending = set(tasks)
+    last_error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    outcome = tasks[task]
+                    elapsed_ms = (time.perf_counter() - started_at) * 1000
+                    metrics.increment("scrape_outcomes", provider=provider, outcome=outcome)
+                    metrics.observe("scrape_resolve_ms", elapsed_ms, provider=provider, outcome=outcome)
+                    return outcome
+                last_error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+    metrics.increment("scrape_outcomes", provider=provider, outcome="timeout")
+    metrics.observe("scrape_resolve_ms", elapsed_ms, provider=provider, outcome="timeout")
+    raise last_error
+
+
+class ScrapeSession:
+    """A page opened for one verification, together with its request accounting."""
+
+    def __init__(self, page, stats: ScrapeStats, profile: ScrapeProfile):
+        self.page = page
+        self.stats = stats
+        self.profile = profile
+
+
+class _BrowserGeneration:
+    """One launched Chromium and the pages currently open in it."""
+
+    def __init__(self, number: int, browser, marker: str):
+        self.number = number
+        self.browser = browser
+        self.marker = marker
+        self.launched_at = time.monotonic()
+        self.contexts: Dict[str, object] = {}
+        self.open_pages: Dict[object, float] = {}
+        self.retired_at: Optional[float] = None
+
+    @property
+    def age_seconds(self) -> float:
+        return time.monotonic() - self.launched_at
+
+
+class BrowserPool:
+    """
+    Shares one headless Chromium between all scrapes instead of launching a browser per
+    verification. Each scrape profile gets its own long-lived context, and every
+    verification gets a fresh page in that context.
+
+    Every launch is a new generation tagged with a marker switch on the Chromium command line,
+    so the supervisor can find its processes. recycle() retires the current generation: new
+    pages go to a fresh browser and the old one is closed once its open pages finish.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._current: Optional[_BrowserGeneration] = None
+        self._retiring: List[_BrowserGeneration] = []
+        self._generation_counter = 0
+        self._routers: Dict[str, ProfileRouter] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def current_generation(self) -> Optional[_BrowserGeneration]:
+        return self._current
+
+    @property
+    def latest_generation_number(self) -> int:
+        return self._generation_counter
+
+    @property
+    def retiring_generations(self) -> List[_BrowserGeneration]:
+        return list(self._retiring)
+
+    async def _ensure_browser(self) -> _BrowserGeneration:
+        current = self._current
+        if current is not None and current.browser.is_connected():
+            return current
+        async with self._lock:
+            current = self._current
+            if current is not None and current.browser.is_connected():
+                return current
+            if current is not None:
+                # Crashed or killed underneath us; nothing left to drain.
+                self._current = None
+                await self._close_generation(current)
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+                self._playwright = await async_playwright().start()
+            self._generation_counter += 1
+            marker = browser_marker(self._generation_counter)
+            browser = await self._playwright.chromium.launch(headless=True, args=[marker])
+            self._current = _BrowserGeneration(self._generation_counter, browser, marker)
+            metrics.increment("browser_launches")
+            return self._current
+
+    async def _get_context(self, generation: _BrowserGeneration, profile: ScrapeProfile):
+        context = generation.contexts.get(profile.name)
+        if context is None:
+            context = await generation.browser.new_context()
+            generation.contexts[profile.name] = context
+        return context
+
+    def _get_router(self, profile: ScrapeProfile) -> ProfileRouter:
+        router = self._routers.get(profile.name)
+        if router is None or router.profile is not profile:
+            router = self._routers[profile.name] = ProfileRouter(profile)
+        return router
+
+    @asynccontextmanager
+    async def page(self, profile: ScrapeProfile):
+        generation = await self._ensure_browser()
+        context = await self._get_context(generation, profile)
+        router = self._get_router(profile)
+        page = await context.new_page()
+        generation.open_pages[page] = time.monotonic()
+        stats = None
+        try:
+            stats = await router.attach(page)
+            yield ScrapeSession(page, stats, profile)
+        finally:
+            generation.open_pages.pop(page, None)
+            try:
+                await page.close()
+            except Exception as e:
+                logger.warning("Error closing %s page: %s", profile.name, e)
+            if stats is not None:
+                router.report(stats)
+            if generation.retired_at is not None and not generation.open_pages:
+                await self._finish_retirement(generation)
+
+    async def warm_up(self, profiles: List[ScrapeProfile]) -> None:
+        """
+        Launches the browser and opens one throwaway page per profile, so the first real
+        verification does not pay for process startup, context creation or the first renderer.
+        """
+        for profile in profiles:
+            async with self.page(profile) as scrape:
+                await scrape.page.set_content("<html><body></body></html>")
+
+    async def recycle(self, reason: str) -> None:
+        """Retires the current browser; the next page() call launches a fresh one."""
+        async with self._lock:
+            generation = self._current
+            if generation is None:
+                return
+            self._current = None
+            generation.retired_at = time.monotonic()
+            self._retiring.append(generation)
+        metrics.increment("browser_recycles", reason=reason)
+        logger.info("Recycling browser generation %s (%s).", generation.number, reason)
+        if not generation.open_pages:
+            await self._finish_retirement(generation)
+
+    async def close_stale_pages(self, max_page_age_seconds: float, drain_timeout_seconds: float) -> int:
+        """
+        Closes pages that outlived any sane scrape (their request was cancelled or hung) and
+        force-closes retired browsers that never drained. Returns the number of pages closed.
+        """
+        now = time.monotonic()
+        closed = 0
+        generations = ([self._current] if self._current else []) + list(self._retiring)
+        for generation in generations:
+            for page, opened_at in list(generation.open_pages.items()):
+                if now - opened_at < max_page_age_seconds:
+                    continue
+                generation.open_pages.pop(page, None)
+                try:
+                    await page.close()
+                except Exception:
+                    logger.debug("Error closing stale page.", exc_info=True)
+                closed += 1
+            retired_for = now - generation.retired_at if generation.retired_at is not None else 0
+            if generation.retired_at is not None and (not generation.open_pages or retired_for > drain_timeout_seconds):
+                await self._finish_retirement(generation)
+        if closed:
+            metrics.increment("browser_stale_pages_closed", closed)
+        return closed
+
+    async def _finish_retirement(self, generation: _BrowserGeneration) -> None:
+        if generation in self._retiring:
+            self._retiring.remove(generation)
+            await self._close_generation(generation)
+
+    async def _close_generation(self, generation: _BrowserGeneration) -> None:
+        for context in list(generation.contexts.values()):
+            try:
+                await context.close()
+            except Exception:
+                logger.debug("Error closing browser context of generation %s.", generation.number, exc_info=True)
+        generation.contexts.clear()
+        generation.open_pages.clear()
+        try:
+            await generation.browser.close()
+        except Exception:
+            logger.warning("Error closing browser generation %s.", generation.number, exc_info=True)
+
+    async def close(self):
+        async with self._lock:
+            generations = ([self._current] if self._current else []) + self._retiring
+            self._current = None
+            self._retiring = []
+            for generation in generations:
+                await self._close_generation(generation)
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+
+browser_pool = BrowserPool()
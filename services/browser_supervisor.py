@@ -0,0 +1,289 @@
+# services/browser_supervisor.py
+
+import asyncio
+import ctypes
+import logging
+import os
+import signal
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Chromium ignores switches it does not know, so this tag rides along on the browser's
+# command line and lets us find our processes in /proc, including ones orphaned by a crash.
+MARKER_SWITCH = "--tx-verifier-owner"
+
+SUPERVISOR_INTERVAL_SECONDS = float(os.environ.get("BROWSER_SUPERVISOR_INTERVAL_SECONDS", "15"))
+BROWSER_MAX_RSS_MB = float(os.environ.get("BROWSER_MAX_RSS_MB", "1024"))
+BROWSER_MAX_AGE_SECONDS = float(os.environ.get("BROWSER_MAX_AGE_SECONDS", str(6 * 3600)))
+BROWSER_MAX_PAGE_AGE_SECONDS = float(os.environ.get("BROWSER_MAX_PAGE_AGE_SECONDS", "180"))
+BROWSER_DRAIN_TIMEOUT_SECONDS = float(os.environ.get("BROWSER_DRAIN_TIMEOUT_SECONDS", "120"))
+BROWSER_MAX_ZOMBIES = int(os.environ.get("BROWSER_MAX_ZOMBIES", "20"))
+
+PROC_ROOT = "/proc"
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_CHROMIUM_COMMANDS = ("chrome", "headless_shell", "chromium")
+_PR_SET_CHILD_SUBREAPER = 36
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return f.read().decode("utf-8", "replace")
+    except OSError:
+        return None
+
+
+def _process_start_ticks(pid: int) -> Optional[int]:
+    stat = _read(f"{PROC_ROOT}/{pid}/stat")
+    if not stat:
+        return None
+    return int(stat[stat.rfind(")") + 2:].split()[19])
+
+
+def _owner_token(pid: int) -> str:
+    # The start time disambiguates a recycled PID from the worker that launched the browser.
+    return f"{pid}.{_process_start_ticks(pid) or 0}"
+
+
+def browser_marker(generation: int) -> str:
+    return f"{MARKER_SWITCH}={_owner_token(os.getpid())}-{generation}"
+
+
+def parse_marker(cmdline: str) -> Optional[tuple]:
+    """Returns (owner token, generation) from a marked Chromium command line."""
+    for arg in cmdline.split("\0"):
+        if arg.startswith(MARKER_SWITCH + "="):
+            owner, _, generation = arg.split("=", 1)[1].rpartition("-")
+            if owner and generation.isdigit():
+                return owner, int(generation)
+    return None
+
+
+@dataclass
+class ProcessInfo:
+    pid: int
+    ppid: int
+    state: str
+    command: str
+    rss_bytes: int
+    cmdline: str = ""
+
+
+@dataclass
+class BrowserTree:
+    """A marked Chromium browser process and all of its descendants."""
+    root_pid: int
+    owner: str
+    generation: int
+    pids: List[int] = field(default_factory=list)
+    rss_bytes: int = 0
+    zombies: int = 0
+
+    @property
+    def child_count(self) -> int:
+        return len(self.pids) - 1
+
+
+def read_process(pid: int) -> Optional[ProcessInfo]:
+    stat = _read(f"{PROC_ROOT}/{pid}/stat")
+    if not stat:
+        return None
+    # The command is wrapped in parentheses and may itself contain spaces or ')'.
+    command = stat[stat.find("(") + 1:stat.rfind(")")]
+    fields = stat[stat.rfind(")") + 2:].split()
+    statm = _read(f"{PROC_ROOT}/{pid}/statm")
+    rss_pages = int(statm.split()[1]) if statm else 0
+    return ProcessInfo(
+        pid=pid,
+        ppid=int(fields[1]),
+        state=fields[0],
+        command=command,
+        rss_bytes=rss_pages * _PAGE_SIZE,
+        cmdline=_read(f"{PROC_ROOT}/{pid}/cmdline") or "",
+    )
+
+
+def scan_processes() -> Dict[int, ProcessInfo]:
+    processes = {}
+    try:
+        entries = os.listdir(PROC_ROOT)
+    except OSError:
+        return processes
+    for entry in entries:
+        if entry.isdigit():
+            info = read_process(int(entry))
+            if info is not None:
+                processes[info.pid] = info
+    return processes
+
+
+def find_browser_trees(processes: Dict[int, ProcessInfo]) -> List[BrowserTree]:
+    children: Dict[int, List[int]] = {}
+    for info in processes.values():
+        children.setdefault(info.ppid, []).append(info.pid)
+
+    trees = []
+    for info in processes.values():
+        marker = parse_marker(info.cmdline)
+        # Renderers inherit most switches; only the process whose parent is unmarked is the browser root.
+        if marker is None or parse_marker(processes[info.ppid].cmdline if info.ppid in processes else ""):
+            continue
+        tree = BrowserTree(root_pid=info.pid, owner=marker[0], generation=marker[1])
+        stack = [info.pid]
+        while stack:
+            pid = stack.pop()
+            member = processes.get(pid)
+            if member is None:
+                continue
+            tree.pids.append(pid)
+            tree.rss_bytes += member.rss_bytes
+            tree.zombies += member.state == "Z"
+            stack.extend(children.get(pid, ()))
+        trees.append(tree)
+    return trees
+
+
+def _owner_alive(owner: str) -> bool:
+    pid, _, _ = owner.partition(".")
+    return pid.isdigit() and _owner_token(int(pid)) == owner
+
+
+def kill_tree(tree: BrowserTree) -> int:
+    killed = 0
+    for pid in reversed(tree.pids):
+        try:
+            os.kill(pid, signal.SIGKILL)
+            killed += 1
+        except (ProcessLookupError, PermissionError):
+            pass
+    return killed
+
+
+def become_subreaper() -> bool:
+    """
+    Makes orphaned descendants (Chromium helpers whose browser died) re-parent to this worker
+    instead of PID 1, so reap_zombie_children can collect them. Linux only.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(_PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def reap_zombie_children(processes: Dict[int, ProcessInfo]) -> int:
+    """
+    Reaps Chromium zombies re-parented to this process. Other children, like the Playwright
+    driver, are left to the waiters asyncio registered for them.
+    """
+    reaped = 0
+    my_pid = os.getpid()
+    for info in processes.values():
+        if info.ppid != my_pid or info.state != "Z" or not info.command.startswith(_CHROMIUM_COMMANDS):
+            continue
+        try:
+            if os.waitpid(info.pid, os.WNOHANG)[0] == info.pid:
+                reaped += 1
+        except ChildProcessError:
+            pass
+    return reaped
+
+
+class BrowserSupervisor:
+    """
+    Periodically samples the Chromium processes the browser pool launched: total RSS, child
+    and zombie counts, and age. Recycles the browser past BROWSER_MAX_RSS_MB or
+    BROWSER_MAX_AGE_SECONDS, closes pages whose request hung or was cancelled, kills marked
+    browsers nobody owns any more, and reaps zombies.
+    """
+
+    def __init__(self, interval_seconds: float = SUPERVISOR_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._pool = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, pool) -> None:
+        self._pool = pool
+        if not become_subreaper():
+            logger.warning("Could not become child subreaper; orphaned Chromium helpers will go to PID 1.")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.check_once()
+            except Exception:
+                metrics.increment("browser_supervisor_errors")
+                logger.exception("Browser supervisor check failed")
+
+    async def check_once(self) -> None:
+        pool = self._pool
+        started_at = time.perf_counter()
+        await pool.close_stale_pages(BROWSER_MAX_PAGE_AGE_SECONDS, BROWSER_DRAIN_TIMEOUT_SECONDS)
+
+        processes = await asyncio.to_thread(scan_processes)
+        trees = find_browser_trees(processes)
+        my_owner = _owner_token(os.getpid())
+        current = pool.current_generation
+        live_generations = {g.number for g in pool.retiring_generations}
+        if current is not None:
+            live_generations.add(current.number)
+        # A browser that is still launching is marked before the pool records it.
+        launching = pool.latest_generation_number
+
+        orphans_killed = 0
+        for tree in trees:
+            if tree.owner == my_owner:
+                if tree.generation in live_generations or tree.generation >= launching:
+                    continue
+                # A generation we already closed (or lost track of) but whose processes survived.
+            elif _owner_alive(tree.owner):
+                continue  # Another live worker's browser.
+            orphans_killed += kill_tree(tree)
+        if orphans_killed:
+            metrics.increment("browser_orphans_killed", orphans_killed)
+            logger.info("Killed %s orphaned Chromium processes.", orphans_killed)
+
+        reaped = reap_zombie_children(processes)
+        if reaped:
+            metrics.increment("browser_zombies_reaped", reaped)
+
+        own_trees = [tree for tree in trees if tree.owner == my_owner and tree.generation in live_generations]
+        metrics.set_gauge("browser_rss_bytes", sum(tree.rss_bytes for tree in own_trees))
+        metrics.set_gauge("browser_processes", sum(len(tree.pids) for tree in own_trees))
+        metrics.set_gauge("browser_zombies", sum(tree.zombies for tree in own_trees))
+        metrics.set_gauge("browser_generations_retiring", len(pool.retiring_generations))
+        metrics.set_gauge("browser_open_pages", len(current.open_pages) if current else 0)
+        metrics.set_gauge("browser_age_seconds", current.age_seconds if current else 0)
+
+        if current is not None:
+            current_tree = next((t for t in own_trees if t.generation == current.number), None)
+            if current_tree is not None:
+                metrics.set_gauge("browser_current_children", current_tree.child_count)
+                if current_tree.rss_bytes > BROWSER_MAX_RSS_MB * 1024 * 1024:
+                    await pool.recycle("rss")
+                elif current_tree.zombies > BROWSER_MAX_ZOMBIES:
+                    # Chromium is not reaping its own helpers; killing it hands them to us.
+                    await pool.recycle("zombies")
+                elif current.age_seconds > BROWSER_MAX_AGE_SECONDS:
+                    await pool.recycle("age")
+            elif current.age_seconds > BROWSER_MAX_AGE_SECONDS:
+                await pool.recycle("age")
+
+        metrics.observe("browser_supervisor_check_ms", (time.perf_counter() - started_at) * 1000)
+
+
+browser_supervisor = BrowserSupervisor()
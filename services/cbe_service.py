@@ -1,73 +1,103 @@
 # services/cbe_service.py
 
+import asyncio
 import httpx
+import logging
+import os
 import re
 from datetime import datetime
-from typing import Optional, Dict, Any
-import fitz
-import base64
-import os
+from typing import Optional, Dict, Any, List
+
+from models import PaymentProviderName
+from services.payment_service import PaymentService, ReceiptUnavailable
+from utils import deadline, progress
+from utils.deadline import DeadlineExceeded
+from utils.gemini_client import prepare_image_for_gemini, CBE_RECEIPT_SCHEMA
+from utils.model_router import model_router, GeminiRateLimited
+
+logger = logging.getLogger(__name__)
+
+# Overridable so load tests can point at a local stand-in (benchmarks/fake_upstreams.py).
+CBE_RECEIPT_BASE_URL = os.environ.get("CBE_RECEIPT_BASE_URL", "https://apps.cbe.com.et:100/")
+
+CBE_RECEIPT_PROMPT = """
+Analyze this image, which is a page from a Commercial Bank of Ethiopia (CBE) transaction receipt PDF.
+Extract the transaction details below. Use null for any field that is not on this page.
+
+- transaction_id: VAT Receipt No or Reference No. (e.g. FT25188TN19J)
+- sender_name: Payer Name
+- receiver_name: Receiver Name (Credited Party name)
+- amount: Transferred Amount as a number, without currency
+- date: Payment Date & Time as ISO 8601 (e.g. 2025-07-06T10:08:00)
+- status: Transaction Status
+"""
+
+def _normalize_gemini_date(raw_date_str: str) -> str:
+    try:
+        dt_obj = None
+        if re.match(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', raw_date_str):
+            dt_obj = datetime.fromisoformat(raw_date_str)
+        elif re.match(r'\d{1,2}/\d{1,2}/\d{4},\s*\d{1,2}:\d{2}:\d{2}\s*(?:AM|PM)', raw_date_str):
+            dt_obj = datetime.strptime(raw_date_str, '%m/%d/%Y, %I:%M:%S %p')
+        elif re.match(r'\d{2}-\d{2}-\d{4}\s*\d{2}:\d{2}:\d{2}', raw_date_str):
+            dt_obj = datetime.strptime(raw_date_str, '%d-%m-%Y %H:%M:%S')
+        return dt_obj.isoformat() if dt_obj else raw_date_str
+    except ValueError:
+        return raw_date_str
+
+class CBEService(PaymentService):
+    provider_name = PaymentProviderName.CBE
+    account_digits = 8
+    bank_name = "Commercial Bank of Ethiopia"
+    error_status = "PDF_PARSE_FAILED"
+    deadline_status = "DEADLINE_EXCEEDED"
+    failure_statuses = frozenset({"PDF_FETCH_FAILED", "INVALID_INPUT_OR_PDF_FORMAT", "PDF_PARSE_FAILED", "DEADLINE_EXCEEDED"})
+    completed_message = "CBE PDF parsing completed."
+    failed_message = "CBE PDF parsing failed."
 
-from models import VerificationResult, VerifiedDataDetails
-
-class CBEService:
     def __init__(self):
-        self.base_url = "https://apps.cbe.com.et:100/"
-        self.gemini_api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key="
-        self.gemini_api_key = os.environ.get("GEMINI_API_KEY", "") 
-
-    async def _extract_from_image_with_gemini(self, image_base64: str) -> Optional[Dict[str, Any]]:
-        prompt = """
-        Analyze this image, which is a page from a Commercial Bank of Ethiopia (CBE) transaction receipt PDF.
-        Extract the following transaction details. Provide each detail on a new line, labeled clearly.
-        
-        Fields to extract:
-        - Transaction ID (VAT Receipt No or Reference No.):
-        - Payer Name:
-        - Receiver Name (Credited Party name):
-        - Transferred Amount:
-        - Payment Date & Time:
-        - Transaction Status:
-
-        Example output format:
-        Transaction ID: FT25188TN19J
-        Payer Name: EHITEMUSIE NEBIYU MENGISTIE
-        Receiver Name: ABDULSHEKUR SULTAN AHIMED
-        Transferred Amount: 100.00 ETB
-        Payment Date & Time: 06/07/2025, 10:08:00 AM
-        Transaction Status: Completed
-        """
-
-        payload = {
-            "contents": [
-                {
-                    "role": "user",
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inlineData": {
-                                "mimeType": "image/png",
-                                "data": image_base64
-                            }
-                        }
-                    ]
-                }
-            ],
-            "generationConfig": {
-                "temperature": 0.1
-            }
-        }
+        self.base_url = CBE_RECEIPT_BASE_URL
+        self.gemini_tiers = ["strong"]
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Keeps TLS sessions to the CBE receipt host alive between verifications."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                verify=False,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+            )
+        return self._client
+
+    async def warm_up(self) -> None:
+        """Opens a connection to the receipt host so the first verification skips DNS and TLS setup."""
+        try:
+            await self.get_client().head(self.base_url, timeout=10.0)
+        except httpx.HTTPError:
+            pass
+
+    async def close(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def _extract_from_image_with_gemini(self, image_bytes: bytes) -> Optional[Dict[str, Any]]:
+        # Decoding and re-encoding is CPU-bound; keep it off the event loop.
+        image_base64, mime_type = await asyncio.to_thread(prepare_image_for_gemini, image_bytes)
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.gemini_api_url}{self.gemini_api_key}",
-                    json=payload,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=90.0
-                )
-                response.raise_for_status()
-                result = response.json()
+            # Full receipt extraction goes straight to the strong tier; the fast tier is for ID-only OCR.
+            result = await model_router.generate_json(
+                self.gemini_tiers,
+                CBE_RECEIPT_PROMPT,
+                image_base64,
+                mime_type,
+                CBE_RECEIPT_SCHEMA,
+                operation="gemini_cbe_page"
+            )
+            if result is None:
+                return None
 
             extracted_details = {
                 "transaction_id": None,
@@ -78,159 +108,114 @@ class CBEService:
                 "status": None
             }
 
-            if result and result.get('candidates') and len(result['candidates']) > 0 and \
-               result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts') and \
-               len(result['candidates'][0]['content']['parts']) > 0:
-                
-                raw_gemini_text = result['candidates'][0]['content']['parts'][0]['text']
-                
-                id_match = re.search(r'Transaction ID.*?:?\s*([A-Z0-9]{10,})', raw_gemini_text, re.IGNORECASE)
-                if id_match:
-                    extracted_details["transaction_id"] = id_match.group(1).strip()
-                
-                sender_match = re.search(r'Payer Name.*?:?\s*(.+)', raw_gemini_text, re.IGNORECASE)
-                if sender_match:
-                    extracted_details["sender_name"] = sender_match.group(1).strip()
-                
-                receiver_match = re.search(r'Receiver Name.*?:?\s*(.+)', raw_gemini_text, re.IGNORECASE)
-                if receiver_match:
-                    extracted_details["receiver_name"] = receiver_match.group(1).strip()
-                
-                amount_match = re.search(r'Transferred Amount.*?:?\s*([\d\.,]+)\s*(?:ETB|Birr)?', raw_gemini_text, re.IGNORECASE)
-                if amount_match:
-                    try:
-                        extracted_details["amount"] = float(amount_match.group(1).replace(',', ''))
-                    except ValueError:
-                        pass
-                
-                date_match = re.search(r'Payment Date & Time.*?:?\s*(.+)', raw_gemini_text, re.IGNORECASE)
-                if date_match:
-                    raw_date_str = date_match.group(1).strip()
-                    try:
-                        dt_obj = None
-                        if re.match(r'\d{1,2}/\d{1,2}/\d{4},\s*\d{1,2}:\d{2}:\d{2}\s*(?:AM|PM)', raw_date_str):
-                            dt_obj = datetime.strptime(raw_date_str, '%m/%d/%Y, %I:%M:%S %p')
-                        elif re.match(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', raw_date_str):
-                            dt_obj = datetime.fromisoformat(raw_date_str)
-                        elif re.match(r'\d{2}-\d{2}-\d{4}\s*\d{2}:\d{2}:\d{2}', raw_date_str):
-                            dt_obj = datetime.strptime(raw_date_str, '%d-%m-%Y %H:%M:%S')
-                        
-                        if dt_obj:
-                            extracted_details["date"] = dt_obj.isoformat()
-                        else:
-                            extracted_details["date"] = raw_date_str
-                    except ValueError:
-                        extracted_details["date"] = raw_date_str
-
-                status_match = re.search(r'Transaction Status.*?:?\s*(Completed|Failed|Pending|Successful)', raw_gemini_text, re.IGNORECASE)
-                if status_match:
-                    extracted_details["status"] = status_match.group(1).strip()
-                
-                return extracted_details
-            else:
-                return None
-
+            transaction_id = result.get("transaction_id")
+            if isinstance(transaction_id, str) and transaction_id.strip():
+                extracted_details["transaction_id"] = "".join(transaction_id.split()).upper()
+
+            for key in ("sender_name", "receiver_name", "status"):
+                value = result.get(key)
+                if isinstance(value, str) and value.strip():
+                    extracted_details[key] = value.strip()
+
+            amount = result.get("amount")
+            if amount is not None:
+                try:
+                    extracted_details["amount"] = float(str(amount).replace(',', ''))
+                except ValueError:
+                    pass
+
+            date = result.get("date")
+            if isinstance(date, str) and date.strip():
+                extracted_details["date"] = _normalize_gemini_date(date.strip())
+
+            return extracted_details
+
+        except DeadlineExceeded:
+            raise
+        except httpx.TimeoutException as e:
+            if deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded while waiting for Gemini.") from e
+            logger.warning("Gemini timed out reading a CBE receipt page: %s", e)
+            return None
+        except GeminiRateLimited as e:
+            logger.warning("Gemini rate-limited while reading a CBE receipt page: %s", e)
+            return None
         except httpx.HTTPStatusError as e:
+            logger.warning("Gemini returned HTTP %s for a CBE receipt page", e.response.status_code)
             return None
         except Exception as e:
+            logger.exception("Unexpected error reading a CBE receipt page with Gemini")
             return None
 
 
-    async def verify_payment(self, transaction_id: str, account_number: str) -> dict:
-        extracted_data = {
-            "transaction_id": transaction_id,
-            "sender_name": None,
-            "sender_bank_name": "Commercial Bank of Ethiopia",
-            "receiver_name": None,
-            "receiver_bank_name": None,
-            "status": "UNKNOWN",
-            "date": None,
-            "amount": 0.0,
-            "debug_info": ""
-        }
+    def _render_pdf_pages(self, pdf_bytes: bytes) -> List[bytes]:
+        """Renders every page of a receipt PDF at 2x in grayscale and returns the pages as PNG bytes."""
+        import fitz  # PyMuPDF is only needed by workers that serve CBE.
 
+        pages = []
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         try:
-            if len(account_number) < 8:
-                raise ValueError("Account number must have at least 8 digits to construct the PDF link.")
-            
-            last_8_digits_of_account = account_number[-8:]
-            pdf_url = f"{self.base_url}?id={transaction_id}{last_8_digits_of_account}"
-            
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.get(
-                    pdf_url, 
-                    follow_redirects=True, 
-                    timeout=120.0
-                )
-                response.raise_for_status()
-
-                if 'application/pdf' not in response.headers.get('Content-Type', ''):
-                    raise ValueError(f"Expected PDF, but received content type: {response.headers.get('Content-Type')}")
-
-                pdf_bytes = response.content
-
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            all_extracted_details = {}
-
             for page_num in range(len(doc)):
                 page = doc.load_page(page_num)
                 
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                img_bytes = pix.pil_tobytes(format="PNG")
-                image_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                
-                page_data = await self._extract_from_image_with_gemini(image_base64)
-                
-                if page_data:
-                    for key, value in page_data.items():
-                        if value is not None and all_extracted_details.get(key) is None:
-                            all_extracted_details[key] = value
-                    
-                    if 'date' in all_extracted_details and all_extracted_details['date']:
-                        try:
-                            dt_obj = None
-                            if re.match(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', all_extracted_details['date']):
-                                dt_obj = datetime.fromisoformat(all_extracted_details['date'])
-                            elif re.match(r'\d{1,2}/\d{1,2}/\d{4}, \d{1,2}:\d{2}:\d{2} (?:AM|PM)', all_extracted_details['date']):
-                                dt_obj = datetime.strptime(all_extracted_details['date'], '%m/%d/%Y, %I:%M:%S %p')
-                            elif re.match(r'\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2}', all_extracted_details['date']):
-                                dt_obj = datetime.strptime(all_extracted_details['date'], '%d-%m-%Y %H:%M:%S')
-                            
-                            if dt_obj:
-                                all_extracted_details['date'] = dt_obj.isoformat()
-                            else:
-                                all_extracted_details['date'] = all_extracted_details['date']
-                        except ValueError:
-                            all_extracted_details['date'] = all_extracted_details['date']
-            
+                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY)
+                pages.append(pix.tobytes("png"))
+        finally:
             doc.close()
+        return pages
 
-            extracted_data["transaction_id"] = all_extracted_details.get("transaction_id", transaction_id)
-            extracted_data["sender_name"] = all_extracted_details.get("sender_name")
-            extracted_data["receiver_name"] = all_extracted_details.get("receiver_name")
-            extracted_data["amount"] = all_extracted_details.get("amount", 0.0)
-            extracted_data["date"] = all_extracted_details.get("date")
-            extracted_data["status"] = all_extracted_details.get("status", "UNKNOWN")
-
-            if extracted_data["status"] == "Completed":
-                extracted_data["message"] = "CBE PDF parsed successfully using Gemini."
-            elif all_extracted_details: 
-                extracted_data["status"] = "Partial Data Extracted"
-                extracted_data["message"] = "CBE PDF parsed, partial data extracted from Gemini."
-            else:
-                extracted_data["status"] = "PDF_PARSE_FAILED"
-                current_debug_info = extracted_data.get("debug_info", "")
-                extracted_data["debug_info"] = current_debug_info + " No data extracted from Gemini."
+    async def fetch(self, transaction_id: str, account_suffix: Optional[str]) -> bytes:
+        if not account_suffix or len(account_suffix) < 8:
+            raise ReceiptUnavailable(
+                "INVALID_INPUT_OR_PDF_FORMAT",
+                "Error in input or PDF content type: Account number must have at least 8 digits to construct the PDF link."
+            )
+        pdf_url = f"{self.base_url}?id={transaction_id}{account_suffix}"
 
+        progress.report("fetching", provider="cbe")
+        try:
+            response = await self.get_client().get(pdf_url, timeout=deadline.clamp_timeout(120.0))
+            response.raise_for_status()
+        except httpx.TimeoutException as e:
+            raise ReceiptUnavailable("DEADLINE_EXCEEDED" if deadline.expired() else "PDF_FETCH_FAILED", f"Timed out fetching PDF: {e}")
         except httpx.HTTPStatusError as e:
-            extracted_data["status"] = "PDF_FETCH_FAILED"
-            extracted_data["debug_info"] = f"HTTP error fetching PDF: {e.response.status_code} - {e.response.text}"
-        except ValueError as e:
-            extracted_data["status"] = "INVALID_INPUT_OR_PDF_FORMAT"
-            extracted_data["debug_info"] = f"Error in input or PDF content type: {e}"
-        except Exception as e:
-            extracted_data["status"] = "PDF_PARSE_FAILED"
-            current_debug_info = extracted_data.get("debug_info", "")
-            extracted_data["debug_info"] = f"{current_debug_info} General error parsing PDF: {e}"
-            
-        return extracted_data
+            raise ReceiptUnavailable("PDF_FETCH_FAILED", f"HTTP error fetching PDF: {e.response.status_code} - {e.response.text}")
+
+        if 'application/pdf' not in response.headers.get('Content-Type', ''):
+            raise ReceiptUnavailable(
+                "INVALID_INPUT_OR_PDF_FORMAT",
+                f"Error in input or PDF content type: Expected PDF, but received content type: {response.headers.get('Content-Type')}"
+            )
+        return response.content
+
+    async def parse(self, raw: bytes, transaction_id: str) -> dict:
+        all_extracted_details = {}
+
+        # Rasterizing is CPU-bound; off the event loop so other requests keep being served meanwhile.
+        page_images = await asyncio.to_thread(self._render_pdf_pages, raw)
+        progress.report("pdf_downloaded", provider="cbe", pages=len(page_images))
+
+        for page_number, page_image_bytes in enumerate(page_images, start=1):
+            page_data = await self._extract_from_image_with_gemini(page_image_bytes)
+
+            if page_data:
+                for key, value in page_data.items():
+                    if value is not None and all_extracted_details.get(key) is None:
+                        all_extracted_details[key] = value
+            progress.report_partial(all_extracted_details)
+            progress.report("parsed_page", provider="cbe", page=page_number, pages=len(page_images))
+
+        if not all_extracted_details:
+            raise ReceiptUnavailable("PDF_PARSE_FAILED", "No data extracted from Gemini.")
+
+        status = all_extracted_details.get("status", "UNKNOWN")
+        return {
+            "transaction_id": all_extracted_details.get("transaction_id", transaction_id),
+            "sender_name": all_extracted_details.get("sender_name"),
+            "sender_bank_name": self.bank_name,
+            "receiver_name": all_extracted_details.get("receiver_name"),
+            "receiver_bank_name": None,
+            "status": "Completed" if status == "Completed" else "Partial Data Extracted",
+            "date": all_extracted_details.get("date"),
+            "amount": all_extracted_details.get("amount", 0.0),
+        }
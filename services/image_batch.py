@@ -0,0 +1,276 @@
+# services/image_batch.py
+
+import asyncio
+import logging
+import os
+import posixpath
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, UploadFile
+
+from utils.admission import admission_controller
+from utils.image_processor import PreparedReceipt, extract_text_id_from_prepared_image, extract_text_ids_packed, prepare_receipt
+from utils.metrics import metrics
+from utils.uploads import BATCH_MAX_UPLOAD_BYTES, MAX_UPLOAD_BYTES, Buffer, open_buffer, open_upload
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "50"))
+# Decoded size of all images in one request, zip contents and plain files together, against
+# archives that inflate far beyond their upload size.
+BATCH_MAX_UNPACKED_BYTES = int(os.environ.get("BATCH_MAX_UNPACKED_BYTES", str(200 * 1024 * 1024)))
+BATCH_PREPROCESS_WORKERS = int(os.environ.get("BATCH_PREPROCESS_WORKERS", str(min(8, os.cpu_count() or 2))))
+# Receipts whose QR code gave no reference are sent to Gemini this many per request.
+BATCH_OCR_IMAGES_PER_REQUEST = int(os.environ.get("BATCH_OCR_IMAGES_PER_REQUEST", "6"))
+BATCH_VERIFY_CONCURRENCY = int(os.environ.get("BATCH_VERIFY_CONCURRENCY", "4"))
+
+_ZIP_MAGIC = b"PK\x03\x04"
+
+# (transaction ID, account number from the QR code or None, read from a QR code) -> result
+Verifier = Callable[[str, Optional[str], bool], Awaitable[Any]]
+ErrorDescriber = Callable[[Exception], Optional[tuple]]
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _preprocess_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BATCH_PREPROCESS_WORKERS, thread_name_prefix="image-batch")
+    return _executor
+
+
+@dataclass
+class BatchImage:
+    index: int
+    filename: str
+    data: Buffer
+
+
+def _error_line(index: int, filename: str, status_code: int, message: str, debug_info: Optional[str] = None, source: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "filename": filename,
+        "source": source,
+        "status_code": status_code,
+        "error": {"transaction_id": "N/A", "status": "Failed", "message": message, "debug_info": debug_info},
+    }
+
+
+class _UnpackedLimitExceeded(Exception):
+    pass
+
+
+def _unpacked_limit_error() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail={
+            "transaction_id": "N/A",
+            "status": "Failed",
+            "message": f"The images in a batch may total at most {BATCH_MAX_UNPACKED_BYTES // (1024 * 1024)} MB once unpacked.",
+            "debug_info": "Counting plain files and the decoded contents of every zip archive."
+        }
+    )
+
+
+def _read_zip(buffer: Buffer, archive_name: str, budget: int) -> Tuple[List[Tuple[str, bytes]], List[Tuple[str, str]]]:
+    """
+    Returns the archive's files as (name, bytes), and (name, reason) for the ones skipped.
+    Raises _UnpackedLimitExceeded once the kept files add up to more than budget bytes.
+    """
+    members, skipped = [], []
+    unpacked = 0
+    with zipfile.ZipFile(open_buffer(buffer)) as archive:
+        for info in archive.infolist():
+            name = f"{archive_name}/{info.filename}"
+            base = posixpath.basename(info.filename)
+            if info.is_dir() or not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            with archive.open(info) as member:
+                # file_size comes from the archive itself; read one byte past the limit rather than trust it.
+                data = member.read(MAX_UPLOAD_BYTES + 1)
+            if len(data) > MAX_UPLOAD_BYTES:
+                skipped.append((name, f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."))
+                continue
+            unpacked += len(data)
+            if unpacked > budget:
+                raise _UnpackedLimitExceeded()
+            members.append((name, data))
+    return members, skipped
+
+
+async def collect_images(stack: AsyncExitStack, uploads: List[UploadFile]) -> Tuple[List[BatchImage], List[Dict[str, Any]]]:
+    """
+    Opens every upload (kept open until stack closes) and unpacks zips. Returns the images, and
+    error lines for files that could not be read. Raises 400 when the batch holds more than
+    BATCH_MAX_IMAGES images, and 413 when they add up to more than BATCH_MAX_UNPACKED_BYTES.
+    """
+    images: List[BatchImage] = []
+    rejected: List[Dict[str, Any]] = []
+    # One running total over the whole request, so many small archives cannot add up to a bomb.
+    unpacked = 0
+
+    def next_index() -> int:
+        return len(images) + len(rejected)
+
+    for number, upload in enumerate(uploads, start=1):
+        filename = upload.filename or f"file-{number}"
+        try:
+            buffer = await stack.enter_async_context(open_upload(upload, limit=BATCH_MAX_UPLOAD_BYTES))
+        except HTTPException as e:
+            rejected.append({"index": next_index(), "filename": filename, "source": None, "status_code": e.status_code, "error": e.detail})
+            continue
+
+        if bytes(buffer[:4]) != _ZIP_MAGIC:
+            unpacked += len(buffer)
+            if unpacked > BATCH_MAX_UNPACKED_BYTES:
+                raise _unpacked_limit_error()
+            images.append(BatchImage(next_index(), filename, buffer))
+        else:
+            try:
+                members, skipped = await asyncio.to_thread(_read_zip, buffer, filename, BATCH_MAX_UNPACKED_BYTES - unpacked)
+            except _UnpackedLimitExceeded:
+                raise _unpacked_limit_error()
+            except (zipfile.BadZipFile, ValueError, OSError) as e:
+                rejected.append(_error_line(next_index(), filename, 400, "Could not read the zip archive.", str(e)))
+                continue
+            for name, reason in skipped:
+                rejected.append(_error_line(next_index(), name, 413, reason))
+            for name, data in members:
+                unpacked += len(data)
+                images.append(BatchImage(next_index(), name, data))
+
+        if len(images) > BATCH_MAX_IMAGES:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "transaction_id": "N/A",
+                    "status": "Failed",
+                    "message": f"A batch may contain at most {BATCH_MAX_IMAGES} images.",
+                    "debug_info": f"Received more than {BATCH_MAX_IMAGES} images, counting zip contents."
+                }
+            )
+
+    metrics.observe("batch_images_per_request", len(images))
+    return images, rejected
+
+
+async def stream_batch(
+    images: List[BatchImage],
+    rejected: List[Dict[str, Any]],
+    verify: Verifier,
+    describe_error: ErrorDescriber,
+    traffic_class: str
+) -> AsyncIterator[bytes]:
+    """
+    Verifies a batch of receipt images and yields one NDJSON line per image as soon as it is
+    done, in completion order; `index` ties a line to its file.
+
+    Every image is decoded once on a thread pool, and QR detection runs on all of them. A
+    receipt with a QR reference goes to verification at once. The rest are read by Gemini
+    BATCH_OCR_IMAGES_PER_REQUEST per request, and any image the packed call could not read
+    confidently is retried on its own, with the usual escalation and local fallback.
+    """
+    lines: asyncio.Queue = asyncio.Queue()
+    verify_slots = asyncio.Semaphore(BATCH_VERIFY_CONCURRENCY)
+    workers = set()
+
+    def spawn(coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        workers.add(task)
+        task.add_done_callback(workers.discard)
+
+    def failure_line(image: BatchImage, source: Optional[str], e: Exception) -> Dict[str, Any]:
+        if isinstance(e, HTTPException):
+            return {"index": image.index, "filename": image.filename, "source": source, "status_code": e.status_code, "error": e.detail}
+        described = describe_error(e)
+        if described is None:
+            logger.error("Batch verification of %s failed", image.filename, exc_info=e)
+            return _error_line(image.index, image.filename, 500, "Verification failed unexpectedly.", str(e), source)
+        return {"index": image.index, "filename": image.filename, "source": source, "status_code": described[0], "error": described[1]}
+
+    async def finish(image: BatchImage, source: str, transaction_id: Optional[str], account_number: Optional[str]) -> None:
+        metrics.increment("batch_images", source=source)
+        if not transaction_id:
+            lines.put_nowait(_error_line(
+                image.index, image.filename, 400, "No transaction ID found in this image using QR or Gemini OCR.",
+                "Ensure the image contains a visible transaction ID or a scannable QR code.", source
+            ))
+            return
+        try:
+            async with verify_slots:
+                outcome = await verify(transaction_id, account_number, source == "qr")
+            lines.put_nowait({"index": image.index, "filename": image.filename, "source": source, "status_code": 200, "result": outcome.model_dump()})
+        except Exception as e:
+            lines.put_nowait(failure_line(image, source, e))
+
+    async def read_one(image: BatchImage, prepared: PreparedReceipt) -> None:
+        try:
+            async with admission_controller.admit("ocr", traffic_class):
+                extracted = await extract_text_id_from_prepared_image(image.data, prepared.image_base64, prepared.mime_type)
+        except Exception as e:
+            lines.put_nowait(failure_line(image, "ocr", e))
+            return
+        await finish(image, "ocr", (extracted or {}).get("transaction_id"), None)
+
+    async def read_packed(pack: List[Tuple[BatchImage, PreparedReceipt]]) -> None:
+        try:
+            async with admission_controller.admit("ocr", traffic_class):
+                found = await extract_text_ids_packed([(prepared.image_base64, prepared.mime_type) for _, prepared in pack])
+        except Exception as e:
+            for image, _ in pack:
+                lines.put_nowait(failure_line(image, "ocr", e))
+            return
+        await asyncio.gather(*(
+            finish(image, "ocr_packed", transaction_id, None) if transaction_id else read_one(image, prepared)
+            for (image, prepared), transaction_id in zip(pack, found)
+        ))
+
+    async def prepare(image: BatchImage) -> Tuple[BatchImage, Optional[PreparedReceipt], Optional[Exception]]:
+        try:
+            return image, await asyncio.get_running_loop().run_in_executor(_preprocess_executor(), prepare_receipt, image.data), None
+        except Exception as e:
+            return image, None, e
+
+    async def run() -> None:
+        pending_ocr: List[Tuple[BatchImage, PreparedReceipt]] = []
+        for ready in asyncio.as_completed([prepare(image) for image in images]):
+            image, prepared, error = await ready
+            if prepared is None or not prepared.decodable:
+                metrics.increment("batch_images", source="unreadable")
+                lines.put_nowait(_error_line(
+                    image.index, image.filename, 400, "Could not decode this file as an image.", str(error) if error else None
+                ))
+            elif prepared.transaction_id:
+                spawn(finish(image, "qr", prepared.transaction_id, prepared.account_number))
+            else:
+                pending_ocr.append((image, prepared))
+                if len(pending_ocr) >= BATCH_OCR_IMAGES_PER_REQUEST:
+                    spawn(read_packed(pending_ocr))
+                    pending_ocr = []
+        if pending_ocr:
+            spawn(read_packed(pending_ocr))
+        await asyncio.gather(*list(workers))
+
+    for line in rejected:
+        yield orjson.dumps(line) + b"\n"
+
+    runner = asyncio.ensure_future(run())
+    runner.add_done_callback(lambda _: lines.put_nowait(None))
+    try:
+        while True:
+            line = await lines.get()
+            if line is None:
+                break
+            yield orjson.dumps(line) + b"\n"
+        if not runner.cancelled() and runner.exception() is not None:
+            logger.error("Batch verification failed", exc_info=runner.exception())
+    finally:
+        # The client went away, or we are done: nothing left should keep running.
+        for task in (runner, *workers):
+            task.cancel()
@@ -1,28 +1,316 @@
 # services/payment_service.py
+
+import logging
+import time
 from abc import ABC, abstractmethod
-from models import TransactionDetails, VerificationResult, PaymentProviderName
+from typing import Any, Dict, FrozenSet, Optional
+
+import orjson
+
+from models import AccountRequiredResult, PaymentProviderName, VerificationResult, VerifiedDataDetails
+from utils import deadline, log, progress
+from utils.admission import admission_controller
+from utils.deadline import DeadlineExceeded
+from utils.hedging import hedged
+from utils.metrics import metrics
+from utils.shared_cache import shared_cache, ttl_for_status, verification_key
+
+logger = logging.getLogger(__name__)
+
+# Receipt fields every provider's parse stage fills in (missing ones default to None / 0.0).
+DETAIL_FIELDS = tuple(VerifiedDataDetails.model_fields)
+
+# Scrape outcomes a hedged second attempt may still beat.
+TRANSIENT_SCRAPE_STATUSES = frozenset({"Network/Load Timeout", "Playwright Error", "Failed"})
+
+
+class ReceiptUnavailable(Exception):
+    """
+    Raised by a fetch or parse stage when the provider gave no usable receipt: not found,
+    timed out, wrong content. Carries the status the verification reports.
+    """
+
+    def __init__(self, status: str, debug_info: Optional[str] = None):
+        super().__init__(debug_info or status)
+        self.status = status
+        self.debug_info = debug_info
+
 
 class PaymentService(ABC):
     """
     Abstract base class for all payment verification services.
-    Defines the common interface that all concrete payment services must implement.
+
+    A provider declares three stages and verify_payment() runs them the same way for every bank:
+      fetch(transaction_id, account_suffix) -> raw receipt (HTML, PDF bytes, ...)
+      parse(raw, transaction_id)            -> dict of receipt fields (DETAIL_FIELDS, transaction_id)
+      normalize(fields, transaction_id)     -> VerificationResult
+    Either of the first two raises ReceiptUnavailable when there is no receipt to read. Each
+    stage is timed into `provider_stage_ms`.
     """
 
+    # Trailing account digits the receipt link is built from; None when no account is needed.
+    account_digits: Optional[int] = None
+    # Reported as sender_bank_name when the receipt cannot say otherwise.
+    bank_name: Optional[str] = None
+    # Status for an unexpected error in a stage, and for running out of the request's time budget.
+    error_status = "Failed"
+    deadline_status = "Deadline Exceeded"
+    # Statuses meaning no receipt was verified; everything else gets completed_message.
+    failure_statuses: FrozenSet[str] = frozenset()
+    # Race a second fetch against a slow one (see utils/hedging.py); a result with one of
+    # transient_statuses only wins if no other attempt is left.
+    hedge_fetch = False
+    transient_statuses: FrozenSet[str] = frozenset()
+    completed_message = "Verification completed."
+    failed_message = "Verification failed."
+    # Messages for specific statuses, overriding the two above.
+    status_messages: Dict[str, str] = {}
+
     @property
     @abstractmethod
     def provider_name(self) -> PaymentProviderName:
         """Returns the name of the payment provider this service handles."""
-        pass
+
+    @property
+    def label(self) -> str:
+        return self.bank_name or self.provider_name.value.title()
 
     @abstractmethod
-    async def verify_payment(self, transaction_details: TransactionDetails) -> VerificationResult:
-        """
-        Abstract method to verify a payment transaction.
+    async def fetch(self, transaction_id: str, account_suffix: Optional[str]) -> Any:
+        """Downloads the raw receipt."""
+
+    @abstractmethod
+    async def parse(self, raw: Any, transaction_id: str) -> Dict[str, Any]:
+        """Extracts the receipt fields from what fetch() returned."""
+
+    def normalize(self, fields: Dict[str, Any], transaction_id: str) -> VerificationResult:
+        status = fields.get("status") or self.error_status
+        if status in self.status_messages:
+            message = self.status_messages[status]
+        else:
+            message = self.failed_message if status in self.failure_statuses else self.completed_message
+        return VerificationResult(
+            transaction_id=fields.get("transaction_id") or transaction_id,
+            status=status,
+            message=message,
+            verified_data=VerifiedDataDetails(**{
+                **{key: fields.get(key) for key in DETAIL_FIELDS},
+                "amount": fields.get("amount") or 0.0,
+            }),
+            debug_info=fields.get("debug_info")
+        )
+
+    def account_suffix(self, account: Optional[str]) -> Optional[str]:
+        if self.account_digits is None or not account:
+            return None
+        return account[-self.account_digits:]
+
+    def unavailable_fields(self, transaction_id: str, status: str, debug_info: Optional[str]) -> Dict[str, Any]:
+        return {"transaction_id": transaction_id, "sender_bank_name": self.bank_name, "status": status, "debug_info": debug_info}
+
+    def account_required_result(
+        self, transaction_id: str, session_token: Optional[str] = None, session_expires_in: Optional[int] = None
+    ) -> AccountRequiredResult:
+        """Returned by the image endpoints when the receipt names a transaction but no account."""
+        message = f"{self.label} transaction ID ({transaction_id}) extracted. Please provide the sender's full account number to complete verification."
+        if session_token:
+            message += " Send it with session_token to /verify_image_session; the image does not need to be uploaded again."
+        return AccountRequiredResult(
+            transaction_id=transaction_id,
+            status="Account_Number_Required",
+            message=message,
+            verified_data=VerifiedDataDetails(),
+            debug_info=f"Missing sender account for {self.label} verification.",
+            session_token=session_token,
+            session_expires_in=session_expires_in
+        )
+
+    async def _timed(self, stage: str, awaitable):
+        started_at = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            metrics.observe(
+                "provider_stage_ms", (time.perf_counter() - started_at) * 1000,
+                provider=self.provider_name.value, stage=stage
+            )
+
+    async def _guarded(self, stage: str, awaitable, transaction_id: str):
+        """Runs a stage; any failure becomes a ReceiptUnavailable instance (returned, not raised)."""
+        try:
+            return await self._timed(stage, awaitable)
+        except ReceiptUnavailable as e:
+            return e
+        except DeadlineExceeded as e:
+            return ReceiptUnavailable(self.deadline_status, str(e))
+        except Exception as e:
+            logger.exception("%s %s of %s failed", self.label, stage, transaction_id)
+            return ReceiptUnavailable(self.error_status, str(e))
+
+    async def verify_payment(self, transaction_id: str, account: Optional[str] = None) -> VerificationResult:
+        """Runs fetch, parse and normalize for one receipt, without caching or admission."""
+        account_suffix = self.account_suffix(account)
+
+        def attempt():
+            return self._guarded("fetch", self.fetch(transaction_id, account_suffix), transaction_id)
+
+        if self.hedge_fetch:
+            raw = await hedged(
+                f"{self.provider_name.value}_fetch", attempt,
+                is_transient_failure=lambda outcome: isinstance(outcome, ReceiptUnavailable) and outcome.status in self.transient_statuses
+            )
+        else:
+            raw = await attempt()
+
+        fields = raw if isinstance(raw, ReceiptUnavailable) else await self._guarded("parse", self.parse(raw, transaction_id), transaction_id)
+        if isinstance(fields, ReceiptUnavailable):
+            fields = self.unavailable_fields(transaction_id, fields.status, fields.debug_info)
+        return self.normalize(fields, transaction_id)
+
+
+class ScrapedPaymentService(PaymentService):
+    """
+    A provider whose receipt is a web page rendered in the shared browser pool. Subclasses give
+    the URL, the scrape profile and two selectors: one that appears on a receipt and one on the
+    provider's "not found" page.
+    """
+
+    hedge_fetch = True
+    transient_statuses = TRANSIENT_SCRAPE_STATUSES
+    failure_statuses = TRANSIENT_SCRAPE_STATUSES | {"Invalid Transaction ID", "Deadline Exceeded"}
+    scrape_profile = None
+    found_selector = ""
+    not_found_selector = ""
+    not_found_debug_info: Optional[str] = None
 
-        Args:
-            transaction_details (TransactionDetails): The details of the transaction to verify.
+    @abstractmethod
+    def receipt_url(self, transaction_id: str, account_suffix: Optional[str]) -> str:
+        """URL of the public receipt page."""
+
+    async def fetch(self, transaction_id: str, account_suffix: Optional[str]) -> str:
+        # Imported here so workers that never scrape do not load Playwright at startup.
+        from playwright.async_api import Error, TimeoutError
+
+        from services.browser_pool import browser_pool, race_selectors
+
+        provider = self.provider_name.value
+        receipt_url = self.receipt_url(transaction_id, account_suffix)
+        logger.debug("Attempting to extract data from: %s", receipt_url)
+
+        async with browser_pool.page(self.scrape_profile) as scrape:
+            page = scrape.page
+            try:
+                started_at = time.perf_counter()
+                progress.report("fetching", provider=provider)
+                await page.goto(receipt_url, wait_until=scrape.profile.goto_wait_until, timeout=deadline.clamp_timeout_ms(scrape.profile.goto_timeout_ms))
+
+                outcome = await race_selectors(
+                    page,
+                    {"found": self.found_selector, "not_found": self.not_found_selector},
+                    timeout_ms=deadline.clamp_timeout_ms(scrape.profile.selector_timeout_ms),
+                    provider=scrape.profile.name,
+                    started_at=started_at
+                )
+                if outcome == "not_found":
+                    logger.debug("%s reported no receipt for %s", self.label, transaction_id)
+                    raise ReceiptUnavailable("Invalid Transaction ID", self.not_found_debug_info)
+
+                logger.debug("Page loaded for %s. Fetching HTML content...", transaction_id)
+                progress.report("page_loaded", provider=provider)
+                return await page.content()
+
+            except (TimeoutError, DeadlineExceeded) as e:
+                logger.warning("%s receipt %s did not load in time: %s", self.label, transaction_id, e)
+                expired = deadline.expired() or isinstance(e, DeadlineExceeded)
+                raise ReceiptUnavailable("Deadline Exceeded" if expired else "Network/Load Timeout", str(e))
+            except Error as e:
+                logger.warning("Playwright error scraping %s receipt %s: %s", self.label, transaction_id, e)
+                raise ReceiptUnavailable("Playwright Error", str(e))
+
+
+class VerificationOutcome:
+    """
+    A VerificationResult and its JSON encoding. A fresh verification starts from the model and
+    is encoded once by pydantic's serializer; a cache hit starts from the stored bytes and is
+    never re-validated. Whichever form is missing is built on first use.
+    """
+
+    __slots__ = ("_model", "_body", "_data")
+
+    def __init__(self, model: Optional[VerificationResult] = None, body: Optional[bytes] = None):
+        self._model = model
+        self._body = body
+        self._data = None
+
+    @classmethod
+    def from_json(cls, body: bytes) -> "VerificationOutcome":
+        return cls(body=body)
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = self._model.__pydantic_serializer__.to_json(self._model)
+        return self._body
 
-        Returns:
-            VerificationResult: The result of the verification, including status and data.
+    @property
+    def model(self) -> VerificationResult:
+        if self._model is None:
+            self._model = VerificationResult.model_validate_json(self._body)
+        return self._model
+
+    @property
+    def status(self) -> Optional[str]:
+        return self._model.status if self._model is not None else self.model_dump()["status"]
+
+    def model_dump(self, mode: str = "json") -> Dict[str, Any]:
+        # Same shape as VerificationResult.model_dump(mode="json"), which is what the stream and
+        # POS channels send; decoding the bytes is cheaper than validating a model first.
+        if self._data is None:
+            self._data = orjson.loads(self.body)
+        return self._data
+
+
+class VerificationEngine:
+    """
+    The registered providers, and the one path every verification takes through them: the
+    host-wide result cache with single-flight, then the provider's admission slot, then the
+    provider's stages. Endpoints, the POS channel and new banks all go through verify().
+    """
+
+    def __init__(self):
+        self.services: Dict[str, PaymentService] = {}
+
+    def register(self, service: PaymentService) -> PaymentService:
+        self.services[service.provider_name.value] = service
+        return service
+
+    def get(self, provider: str) -> PaymentService:
+        return self.services[provider]
+
+    async def verify(
+        self, provider: str, transaction_id: str, account: Optional[str], traffic_class: str, cheap: bool = False
+    ) -> VerificationOutcome:
+        """
+        Serves the cached result when another request (in any worker) already verified this
+        receipt, and otherwise runs the provider once across workers. Only that one upstream
+        fetch takes an admission slot; cache hits and waiters never do.
         """
-        pass
\ No newline at end of file
+        service = self.get(provider)
+
+        async def admitted_fetch():
+            async with admission_controller.admit(provider, traffic_class, cheap=cheap):
+                return VerificationOutcome(await service.verify_payment(transaction_id, account))
+
+        log.annotate(provider=provider, transaction_id=transaction_id)
+        outcome = await shared_cache.single_flight(
+            verification_key(provider, transaction_id, service.account_suffix(account)),
+            admitted_fetch,
+            lambda outcome: ttl_for_status(outcome.status),
+            encode=lambda outcome: outcome.body,
+            decode=VerificationOutcome.from_json
+        )
+        log.annotate(outcome=outcome.status)
+        return outcome
+
+
+verification_engine = VerificationEngine()
@@ -0,0 +1,204 @@
+# services/pos_channel.py
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from utils.deadline import deadline_scope, parse_request_budget
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "terminal-id:token" pairs, comma-separated. With none configured every connection is refused.
+POS_TERMINAL_TOKENS = {
+    terminal_id.strip(): token.strip()
+    for terminal_id, _, token in (
+        pair.partition(":") for pair in os.environ.get("POS_TERMINAL_TOKENS", "").split(",") if ":" in pair
+    )
+    if terminal_id.strip() and token.strip()
+}
+# A terminal pipelines a few sales at a time; anything beyond this is answered with 429 right away.
+POS_MAX_IN_FLIGHT = int(os.environ.get("POS_MAX_IN_FLIGHT", "16"))
+POS_MAX_MESSAGE_BYTES = int(os.environ.get("POS_MAX_MESSAGE_BYTES", "4096"))
+
+# WebSocket close codes: 1008 policy violation (bad token), 4000 replaced by a newer connection.
+CLOSE_UNAUTHORIZED = 1008
+CLOSE_SUPERSEDED = 4000
+
+# provider -> (message, traffic class) -> VerificationResult. Supplied by main.py so the channel
+# runs the exact code path of the REST endpoints.
+Handler = Callable[[Dict[str, Any], str], Awaitable[Any]]
+ErrorDescriber = Callable[[Exception], Optional[tuple]]
+
+
+def authenticate_terminal(token: Optional[str]) -> Optional[str]:
+    """Returns the terminal ID a token belongs to, or None."""
+    if not token:
+        return None
+    for terminal_id, expected in POS_TERMINAL_TOKENS.items():
+        if hmac.compare_digest(token.encode(), expected.encode()):
+            return terminal_id
+    return None
+
+
+def bearer_token(websocket: WebSocket) -> Optional[str]:
+    """Token from `Authorization: Bearer ...`, falling back to the `token` query parameter."""
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[len("bearer "):].strip()
+    return websocket.query_params.get("token")
+
+
+class PosChannel:
+    """
+    One long-lived connection from a POS terminal. Each incoming message is a verification
+    request carrying a client-chosen `id`; it runs as its own task, so responses go back in
+    completion order (a cache hit overtakes a scrape that is still loading) tagged with the
+    same `id`.
+
+    Request:  {"id": "sale-42", "provider": "cbe", "transaction_id": "FT...", "account": "1000...", "timeout_ms": 20000}
+    Response: {"id": "sale-42", "type": "result", "status_code": 200, "result": {VerificationResult}}
+              {"id": "sale-42", "type": "error", "status_code": 4xx/5xx, "detail": ...}
+    {"type": "ping"} is answered with {"type": "pong"}.
+    """
+
+    def __init__(self, websocket: WebSocket, terminal_id: str, traffic_class: str, handlers: Dict[str, Handler], describe_error: ErrorDescriber):
+        self.websocket = websocket
+        self.terminal_id = terminal_id
+        self.traffic_class = traffic_class
+        self.handlers = handlers
+        self.describe_error = describe_error
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()
+        self.closed = False
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        if self.closed:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(json.dumps(message, default=str))
+            except (WebSocketDisconnect, RuntimeError):
+                self.closed = True
+
+    async def send_error(self, correlation_id: Any, status_code: int, detail: Any) -> None:
+        await self.send({"id": correlation_id, "type": "error", "status_code": status_code, "detail": detail})
+
+    async def run(self) -> None:
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                metrics.increment("pos_messages", direction="in")
+                await self._dispatch(text)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.closed = True
+            for task in self.in_flight.values():
+                task.cancel()
+
+    async def close(self, code: int) -> None:
+        self.closed = True
+        try:
+            await self.websocket.close(code=code)
+        except RuntimeError:
+            pass
+
+    async def _dispatch(self, text: str) -> None:
+        if len(text) > POS_MAX_MESSAGE_BYTES:
+            await self.send_error(None, 413, f"Message exceeds {POS_MAX_MESSAGE_BYTES} bytes.")
+            return
+        try:
+            message = json.loads(text)
+        except ValueError:
+            await self.send_error(None, 400, "Message is not valid JSON.")
+            return
+        if not isinstance(message, dict):
+            await self.send_error(None, 400, "Message must be a JSON object.")
+            return
+        if message.get("type") == "ping":
+            await self.send({"type": "pong"})
+            return
+
+        correlation_id = message.get("id")
+        if not isinstance(correlation_id, (str, int)) or isinstance(correlation_id, bool):
+            await self.send_error(None, 400, "Every verification needs a string or integer `id`.")
+            return
+        if correlation_id in self.in_flight:
+            await self.send_error(correlation_id, 409, "A verification with this id is already in progress.")
+            return
+        handler = self.handlers.get(str(message.get("provider", "")).lower())
+        if handler is None:
+            await self.send_error(correlation_id, 400, f"Unknown provider. Use one of: {', '.join(sorted(self.handlers))}.")
+            return
+        if len(self.in_flight) >= POS_MAX_IN_FLIGHT:
+            metrics.increment("pos_rejected", reason="too_many_in_flight")
+            await self.send_error(correlation_id, 429, f"At most {POS_MAX_IN_FLIGHT} verifications may be in flight per terminal.")
+            return
+        try:
+            budget_seconds = parse_request_budget(None, str(message["timeout_ms"]) if message.get("timeout_ms") is not None else None)
+        except ValueError as e:
+            await self.send_error(correlation_id, 400, f"Invalid timeout_ms: {e}")
+            return
+
+        task = asyncio.create_task(self._verify(correlation_id, handler, message, budget_seconds))
+        self.in_flight[correlation_id] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(correlation_id, None))
+
+    async def _verify(self, correlation_id, handler: Handler, message: Dict[str, Any], budget_seconds: Optional[float]) -> None:
+        started_at = time.perf_counter()
+        provider = str(message.get("provider")).lower()
+        try:
+            with deadline_scope(budget_seconds):
+                result = await handler(message, self.traffic_class)
+        except ValidationError as e:
+            await self.send_error(correlation_id, 422, [
+                {"field": ".".join(map(str, error["loc"])) or "unknown", "message": error["msg"], "type": error["type"]}
+                for error in e.errors()
+            ])
+            outcome = "invalid"
+        except HTTPException as e:
+            await self.send_error(correlation_id, e.status_code, e.detail)
+            outcome = "error"
+        except Exception as e:
+            described = self.describe_error(e)
+            if described is None:
+                logger.exception("POS verification %s from %s failed", correlation_id, self.terminal_id)
+                described = (500, {"transaction_id": "N/A", "status": "Failed", "message": "Verification failed unexpectedly.", "debug_info": str(e)})
+            await self.send_error(correlation_id, *described)
+            outcome = "error"
+        else:
+            await self.send({"id": correlation_id, "type": "result", "status_code": 200, "result": result.model_dump(mode="json")})
+            outcome = "ok"
+        metrics.increment("pos_messages", direction="out")
+        metrics.observe("pos_response_ms", (time.perf_counter() - started_at) * 1000, provider=provider, outcome=outcome)
+
+
+class PosChannelRegistry:
+    """Keeps one channel per terminal: a reconnecting terminal replaces its stale connection."""
+
+    def __init__(self):
+        self.channels: Dict[str, PosChannel] = {}
+
+    async def attach(self, channel: PosChannel) -> None:
+        previous = self.channels.get(channel.terminal_id)
+        self.channels[channel.terminal_id] = channel
+        metrics.set_gauge("pos_connections", len(self.channels))
+        if previous is not None:
+            metrics.increment("pos_connections_superseded")
+            await previous.close(CLOSE_SUPERSEDED)
+
+    def detach(self, channel: PosChannel) -> None:
+        if self.channels.get(channel.terminal_id) is channel:
+            del self.channels[channel.terminal_id]
+        metrics.set_gauge("pos_connections", len(self.channels))
+
+
+pos_channels = PosChannelRegistry()
@@ -0,0 +1,227 @@
+# services/scrape_profiles.py
+
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rough transfer sizes used to estimate savings for blocked requests before we have
+# observed a response of that type on the receipt pages.
+DEFAULT_RESOURCE_SIZE_ESTIMATES = {
+    "image": 40_000,
+    "media": 200_000,
+    "font": 60_000,
+    "stylesheet": 30_000,
+    "script": 50_000,
+}
+FALLBACK_RESOURCE_SIZE_ESTIMATE = 10_000
+
+# Receipt sites. Overridable so load tests can point the scrapers at local stand-ins
+# (benchmarks/fake_upstreams.py); an overridden host counts as first party.
+TELEBIRR_RECEIPT_BASE_URL = os.environ.get("TELEBIRR_RECEIPT_BASE_URL", "https://transactioninfo.ethiotelecom.et/receipt/")
+BOA_SLIP_BASE_URL = os.environ.get("BOA_SLIP_BASE_URL", "https://cs.bankofabyssinia.com/slip/")
+
+
+@dataclass(frozen=True)
+class ScrapeProfile:
+    """
+    Per-provider Playwright settings: which requests a receipt page may make, which
+    static assets are cached across pages, and how long each wait may take. Requests to other
+    hosts are blocked unless their type is in third_party_resource_types.
+    """
+    name: str
+    first_party_hosts: Tuple[str, ...]
+    blocked_resource_types: FrozenSet[str] = frozenset({"image", "media", "font"})
+    third_party_resource_types: FrozenSet[str] = frozenset()
+    cached_resource_types: FrozenSet[str] = frozenset({"script", "stylesheet"})
+    goto_wait_until: str = "domcontentloaded"
+    goto_timeout_ms: int = 60000
+    selector_timeout_ms: int = 30000
+    asset_cache_max_bytes: int = 20 * 1024 * 1024
+
+    def is_first_party(self, url: str) -> bool:
+        host = (urlparse(url).hostname or "").lower()
+        return any(host == allowed or host.endswith(f".{allowed}") for allowed in self.first_party_hosts)
+
+    def allows(self, resource_type: str, url: str) -> bool:
+        if resource_type == "document":
+            return True
+        if resource_type in self.blocked_resource_types:
+            return False
+        return resource_type in self.third_party_resource_types or self.is_first_party(url)
+
+
+TELEBIRR_SCRAPE_PROFILE = ScrapeProfile(
+    name="telebirr",
+    first_party_hosts=("transactioninfo.ethiotelecom.et", urlparse(TELEBIRR_RECEIPT_BASE_URL).hostname),
+    # The receipt is server-rendered; styling is irrelevant to the selectors and parser.
+    blocked_resource_types=frozenset({"image", "media", "font", "stylesheet"}),
+    cached_resource_types=frozenset({"script"}),
+)
+
+BOA_SCRAPE_PROFILE = ScrapeProfile(
+    name="boa",
+    # The whole bank domain: the client-rendered slip may load its data from a sibling API host.
+    first_party_hosts=("bankofabyssinia.com", urlparse(BOA_SLIP_BASE_URL).hostname),
+    # The slip is rendered client-side by scripts that include CDN-hosted libraries, so scripts
+    # load from any host; they are cached across pages.
+    blocked_resource_types=frozenset({"image", "media", "font", "stylesheet"}),
+    third_party_resource_types=frozenset({"script"}),
+    cached_resource_types=frozenset({"script"}),
+)
+
+
+class AssetCache:
+    """Size-bounded LRU of static asset responses shared by every page of one profile."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[int, Dict[str, str], bytes]]" = OrderedDict()
+        self._size = 0
+
+    def get(self, url: str) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, status: int, headers: Dict[str, str], body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop(url, None)
+        if previous is not None:
+            self._size -= len(previous[2])
+        self._entries[url] = (status, headers, body)
+        self._size += len(body)
+        while self._size > self.max_bytes and self._entries:
+            _, (_, _, evicted_body) = self._entries.popitem(last=False)
+            self._size -= len(evicted_body)
+
+
+@dataclass
+class ScrapeStats:
+    """Request accounting for a single verification's page."""
+    requests_total: int = 0
+    requests_blocked: int = 0
+    requests_from_cache: int = 0
+    bytes_downloaded: int = 0
+    bytes_from_cache: int = 0
+    bytes_blocked_estimate: int = 0
+    blocked_by_type: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def requests_saved(self) -> int:
+        return self.requests_blocked + self.requests_from_cache
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_from_cache + self.bytes_blocked_estimate
+
+    def as_dict(self) -> dict:
+        return {
+            "requests_total": self.requests_total,
+            "requests_blocked": self.requests_blocked,
+            "requests_from_cache": self.requests_from_cache,
+            "requests_saved": self.requests_saved,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_from_cache": self.bytes_from_cache,
+            "bytes_blocked_estimate": self.bytes_blocked_estimate,
+            "bytes_saved": self.bytes_saved,
+            "blocked_by_type": dict(self.blocked_by_type),
+        }
+
+
+class ProfileRouter:
+    """
+    Applies a ScrapeProfile to pages through page.route. One router exists per profile
+    so the asset cache and observed size estimates are shared across verifications.
+    """
+
+    def __init__(self, profile: ScrapeProfile):
+        self.profile = profile
+        self.asset_cache = AssetCache(profile.asset_cache_max_bytes)
+        self._observed_sizes: Dict[str, Tuple[int, int]] = {}
+
+    def _estimate_size(self, resource_type: str) -> int:
+        observed = self._observed_sizes.get(resource_type)
+        if observed and observed[1]:
+            return observed[0] // observed[1]
+        return DEFAULT_RESOURCE_SIZE_ESTIMATES.get(resource_type, FALLBACK_RESOURCE_SIZE_ESTIMATE)
+
+    def _record_size(self, resource_type: str, size: int) -> None:
+        total, count = self._observed_sizes.get(resource_type, (0, 0))
+        self._observed_sizes[resource_type] = (total + size, count + 1)
+
+    @staticmethod
+    async def _fall_back(route) -> None:
+        """Continues the request unintercepted, or aborts it when that fails too (e.g. the page closed)."""
+        try:
+            await route.continue_()
+        except Exception:
+            try:
+                await route.abort("failed")
+            except Exception:
+                pass
+
+    async def attach(self, page) -> ScrapeStats:
+        stats = ScrapeStats()
+
+        async def handle(route, request):
+            stats.requests_total += 1
+            resource_type = request.resource_type
+            url = request.url
+
+            if not self.profile.allows(resource_type, url):
+                stats.requests_blocked += 1
+                stats.bytes_blocked_estimate += self._estimate_size(resource_type)
+                stats.blocked_by_type[resource_type] = stats.blocked_by_type.get(resource_type, 0) + 1
+                await route.abort("blockedbyclient")
+                return
+
+            cacheable = request.method == "GET" and resource_type in self.profile.cached_resource_types
+            if cacheable:
+                cached = self.asset_cache.get(url)
+                if cached is not None:
+                    status_code, headers, body = cached
+                    stats.requests_from_cache += 1
+                    stats.bytes_from_cache += len(body)
+                    await route.fulfill(status=status_code, headers=headers, body=body)
+                    return
+
+            try:
+                response = await route.fetch()
+                body = await response.body()
+            except Exception as e:
+                # Let the browser make the request itself; a handler that raises leaves the request hanging.
+                logger.debug("Scrape profile '%s' could not fetch %s: %s", self.profile.name, url, e)
+                metrics.increment("scrape_route_fetch_errors", provider=self.profile.name)
+                await self._fall_back(route)
+                return
+            stats.bytes_downloaded += len(body)
+            self._record_size(resource_type, len(body))
+            if cacheable and response.status == 200:
+                self.asset_cache.put(url, response.status, response.headers, body)
+            await route.fulfill(response=response, body=body)
+
+        await page.route("**/*", handle)
+        return stats
+
+    def report(self, stats: ScrapeStats) -> None:
+        provider = self.profile.name
+        metrics.increment("scrape_requests_total", stats.requests_total, provider=provider)
+        metrics.increment("scrape_requests_blocked", stats.requests_blocked, provider=provider)
+        metrics.increment("scrape_requests_from_cache", stats.requests_from_cache, provider=provider)
+        metrics.increment("scrape_bytes_downloaded", stats.bytes_downloaded, provider=provider)
+        metrics.increment("scrape_bytes_saved", stats.bytes_saved, provider=provider)
+        metrics.observe("scrape_bytes_saved_per_verification", stats.bytes_saved, provider=provider)
+        metrics.observe("scrape_requests_saved_per_verification", stats.requests_saved, provider=provider)
+        logger.debug(
+            "Scrape profile '%s' saved %s of %s requests (~%s bytes; %s bytes downloaded).",
+            provider, stats.requests_saved, stats.requests_total, stats.bytes_saved, stats.bytes_downloaded
+        )
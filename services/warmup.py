@@ -0,0 +1,117 @@
+# services/warmup.py
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Providers this worker should be warm for. Workers dedicated to one provider can list just that
+# one and skip loading everything else.
+WARMUP_PROVIDERS = frozenset(
+    name.strip().lower()
+    for name in os.environ.get("WARMUP_PROVIDERS", "telebirr,boa,cbe,ocr").split(",")
+    if name.strip()
+)
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "10"))
+
+
+class WarmUpStep:
+    def __init__(self, name: str, run: Callable[[], Awaitable[None]], required: bool):
+        self.name = name
+        self.run = run
+        self.required = required
+        self.status = "pending"
+        self.duration_ms: Optional[float] = None
+
+
+class Readiness:
+    """
+    Runs the warm-up steps registered at startup and reports whether the worker can serve at
+    steady-state latency. Required steps (browser launch, heavy imports) gate readiness and are
+    retried until they succeed; optional ones (pre-opening upstream connections) never do,
+    because an unreachable upstream is not a reason to take this worker out of rotation.
+    """
+
+    def __init__(self):
+        self.steps: List[WarmUpStep] = []
+        self.started_at = time.perf_counter()
+        self.ready_after_ms: Optional[float] = None
+        self.shutting_down = False
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, run: Callable[[], Awaitable[None]], required: bool = True) -> None:
+        self.steps.append(WarmUpStep(name, run, required))
+
+    @property
+    def ready(self) -> bool:
+        if self.shutting_down:
+            return False
+        return all(step.status == "ok" for step in self.steps if step.required)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_until_ready())
+
+    async def stop(self) -> None:
+        self.shutting_down = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run_step(self, step: WarmUpStep) -> None:
+        started_at = time.perf_counter()
+        try:
+            await step.run()
+            step.status = "ok"
+        except Exception as e:
+            step.status = f"failed: {e}"
+            metrics.increment("warmup_failures", step=step.name)
+            logger.warning("Warm-up step '%s' failed: %s", step.name, e)
+        step.duration_ms = (time.perf_counter() - started_at) * 1000
+        metrics.observe("warmup_step_ms", step.duration_ms, step=step.name)
+
+    async def _run_until_ready(self) -> None:
+        pending = list(self.steps)
+        while pending:
+            await asyncio.gather(*(self._run_step(step) for step in pending))
+            pending = [step for step in pending if step.required and step.status != "ok"]
+            if pending:
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+        self.ready_after_ms = (time.perf_counter() - self.started_at) * 1000
+        metrics.set_gauge("warmup_ready_after_ms", self.ready_after_ms)
+        logger.info("Worker ready after %.0f ms.", self.ready_after_ms)
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "ready": self.ready,
+            "ready_after_ms": self.ready_after_ms,
+            "steps": {
+                step.name: {"status": step.status, "required": step.required, "duration_ms": step.duration_ms}
+                for step in self.steps
+            },
+        }
+
+
+def warm_parsers() -> None:
+    """Imports BeautifulSoup and compiles the parsers' regexes by running them on an empty page."""
+    from services.boa_service import _parse_boa_receipt_html
+    from services.cbe_service import _normalize_gemini_date
+    from services.telebirr_service import _parse_telebirr_receipt_html
+
+    empty_page = "<html><body><table></table></body></html>"
+    if "telebirr" in WARMUP_PROVIDERS:
+        _parse_telebirr_receipt_html(empty_page, "WARMUP0000")
+    if "boa" in WARMUP_PROVIDERS:
+        _parse_boa_receipt_html(empty_page, "FT00000WARM0")
+    if "cbe" in WARMUP_PROVIDERS:
+        for sample in ("2025-07-06T10:08:00", "7/6/2025, 10:08:00 AM", "06-07-2025 10:08:00"):
+            _normalize_gemini_date(sample)
+
+
+readiness = Readiness()
@@ -0,0 +1,598 @@
+# services/watcher.py
+
+import asyncio
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+import orjson
+
+from services.payment_service import VerificationOutcome, verification_engine
+from utils.admission import TRAFFIC_BATCH, AdmissionRejected
+from utils.deadline import DeadlineExceeded, deadline_scope
+from utils.metrics import metrics
+from utils.progress import KEEPALIVE_SECONDS, format_event
+from utils.retry import RetryPolicy, call_with_retry
+from utils.shared_cache import (
+    PENDING_TTL_SECONDS, SHARED_CACHE_ENABLED, SHARED_CACHE_PATH, UNCACHEABLE_STATUSES, is_pending_status, verification_key
+)
+
+logger = logging.getLogger(__name__)
+
+# The first recheck waits until the pending result has left the shared cache, so it reaches the
+# provider; later ones back off geometrically up to the cap.
+WATCH_INITIAL_DELAY_SECONDS = float(os.environ.get("WATCH_INITIAL_DELAY_SECONDS", str(PENDING_TTL_SECONDS)))
+WATCH_MAX_DELAY_SECONDS = float(os.environ.get("WATCH_MAX_DELAY_SECONDS", "300"))
+WATCH_BACKOFF_FACTOR = float(os.environ.get("WATCH_BACKOFF_FACTOR", "2"))
+# A transaction still pending after this long is given up on, and subscribers are told so.
+WATCH_MAX_AGE_SECONDS = float(os.environ.get("WATCH_MAX_AGE_SECONDS", "3600"))
+# Finished watches are kept this long so late pollers and subscribers still get the result.
+WATCH_RETENTION_SECONDS = float(os.environ.get("WATCH_RETENTION_SECONDS", "600"))
+WATCH_MAX_ACTIVE = int(os.environ.get("WATCH_MAX_ACTIVE", "2000"))
+# Rechecks falling due within this window of each other are started together, and at most
+# WATCH_BATCH_SIZE run at once.
+WATCH_BATCH_WINDOW_SECONDS = float(os.environ.get("WATCH_BATCH_WINDOW_SECONDS", "2"))
+WATCH_BATCH_SIZE = int(os.environ.get("WATCH_BATCH_SIZE", "16"))
+WATCH_CHECK_BUDGET_SECONDS = float(os.environ.get("WATCH_CHECK_BUDGET_SECONDS", "120"))
+# When set, webhook bodies are signed: `X-Watch-Signature: sha256=<hex HMAC-SHA256 of the body>`.
+WATCH_WEBHOOK_SECRET = os.environ.get("WATCH_WEBHOOK_SECRET", "")
+# Comma-separated hosts callback URLs may point at; these are trusted whatever they resolve to.
+# When empty, any host is accepted as long as it resolves only to public addresses.
+WATCH_CALLBACK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.environ.get("WATCH_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+WEBHOOK_RETRY_POLICY = RetryPolicy(max_attempts=4, base_delay=2.0, max_delay=30.0)
+WEBHOOK_TIMEOUT_SECONDS = 10.0
+SWEEP_INTERVAL_SECONDS = 30.0
+# Workers answering for a watch another worker owns re-read it this often for its event stream.
+REMOTE_POLL_SECONDS = 1.0
+# The owning worker refreshes its watches every sweep; one silent for this long has lost its owner.
+OWNER_STALE_SECONDS = 3 * SWEEP_INTERVAL_SECONDS
+
+STATE_WATCHING = "watching"
+STATE_SETTLED = "settled"
+STATE_EXPIRED = "expired"
+
+# SSE / webhook event sent when a watch finishes in each state.
+FINAL_EVENTS = {STATE_SETTLED: "result", STATE_EXPIRED: "expired"}
+
+
+class WatchCapacityReached(Exception):
+    """Raised when WATCH_MAX_ACTIVE transactions are already being watched."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many transactions are being watched.")
+        self.retry_after = retry_after
+
+
+class CallbackNotAllowed(ValueError):
+    """Raised for a callback URL the server must not POST to."""
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_callback_url(callback_url: str) -> None:
+    """
+    Raises CallbackNotAllowed unless callback_url is http(s) and its host is either listed in
+    WATCH_CALLBACK_ALLOWED_HOSTS or, with no list configured, resolves only to public
+    addresses. Checked at registration and again before each delivery, since DNS can change
+    in between.
+    """
+    parts = urlsplit(callback_url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackNotAllowed("callback_url must be an http or https URL.")
+    host = parts.hostname.lower()
+    if WATCH_CALLBACK_ALLOWED_HOSTS:
+        if host not in WATCH_CALLBACK_ALLOWED_HOSTS:
+            raise CallbackNotAllowed(f"callback_url host {host} is not in WATCH_CALLBACK_ALLOWED_HOSTS.")
+        return
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, parts.port or (443 if parts.scheme == "https" else 80))
+    except OSError as e:
+        raise CallbackNotAllowed(f"callback_url host {host} does not resolve: {e}")
+    if not addresses or not all(_is_public_address(address[4][0]) for address in addresses):
+        raise CallbackNotAllowed(f"callback_url host {host} resolves to a private, loopback or link-local address.")
+
+
+def is_settled(status: Optional[str]) -> bool:
+    """A result worth notifying about: not pending, and not a failure to reach the provider."""
+    return bool(status) and not is_pending_status(status) and status not in UNCACHEABLE_STATUSES
+
+
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watches (
+    watch_id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    state TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    callbacks TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS watches_active_key ON watches (key) WHERE state = 'watching';
+"""
+
+
+class WatchStore:
+    """
+    Watches in the shared cache's SQLite file, so every worker on the host can answer for any
+    watch and a receipt is only ever watched by one of them. The owning worker rechecks it and
+    writes its snapshot after each check; the others only read. Callback URLs registered on
+    another worker are added to the row and taken by the owner when the watch finishes.
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, enabled: bool = SHARED_CACHE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._thread_local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._thread_local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_STORE_SCHEMA)
+            self._thread_local.connection = connection
+        return connection
+
+    def _transaction(self, work):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(connection)
+            connection.execute("COMMIT")
+            return result
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row(row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        state, snapshot, updated_at = row
+        snapshot = orjson.loads(snapshot)
+        if state == STATE_WATCHING and updated_at < time.time() - OWNER_STALE_SECONDS:
+            # The worker that owned it is gone; nobody is rechecking it any more.
+            snapshot["state"] = STATE_EXPIRED
+        return _present(snapshot)
+
+    def claim_sync(self, watch_id: str, key: str, owner: str, snapshot: bytes) -> Optional[Dict[str, Any]]:
+        """Records a new watch, or returns the snapshot of the live one already watching key."""
+        def work(connection):
+            now = time.time()
+            row = connection.execute(
+                "SELECT state, snapshot, updated_at FROM watches WHERE key = ? AND state = ?", (key, STATE_WATCHING)
+            ).fetchone()
+            if row is not None:
+                if row[2] >= now - OWNER_STALE_SECONDS:
+                    return self._row(row)
+                connection.execute(
+                    "UPDATE watches SET state = ?, expires_at = ? WHERE key = ? AND state = ?",
+                    (STATE_EXPIRED, now + WATCH_RETENTION_SECONDS, key, STATE_WATCHING)
+                )
+            connection.execute(
+                "INSERT INTO watches (watch_id, key, owner, state, snapshot, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (watch_id, key, owner, STATE_WATCHING, snapshot, now)
+            )
+            return None
+
+        return self._transaction(work)
+
+    def save_sync(self, watch_id: str, state: str, snapshot: bytes) -> List[str]:
+        """Writes the owner's latest snapshot; when the watch finishes, returns its stored callbacks."""
+        def work(connection):
+            now = time.time()
+            expires_at = now + WATCH_RETENTION_SECONDS if state != STATE_WATCHING else None
+            connection.execute(
+                "UPDATE watches SET state = ?, snapshot = ?, updated_at = ?, expires_at = ? WHERE watch_id = ?",
+                (state, snapshot, now, expires_at, watch_id)
+            )
+            if state == STATE_WATCHING:
+                return []
+            row = connection.execute("SELECT callbacks FROM watches WHERE watch_id = ?", (watch_id,)).fetchone()
+            return orjson.loads(row[0]) if row else []
+
+        return self._transaction(work)
+
+    def add_callback_sync(self, watch_id: str, callback_url: str) -> Optional[Dict[str, Any]]:
+        """
+        Adds a callback to a watch owned elsewhere. Returns the snapshot if the watch has already
+        finished, in which case the caller delivers it itself.
+        """
+        def work(connection):
+            row = connection.execute(
+                "SELECT state, snapshot, updated_at, callbacks FROM watches WHERE watch_id = ?", (watch_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            snapshot = self._row(row[:3])
+            if snapshot["state"] != STATE_WATCHING:
+                return snapshot
+            callbacks = orjson.loads(row[3])
+            if callback_url not in callbacks:
+                connection.execute(
+                    "UPDATE watches SET callbacks = ? WHERE watch_id = ?", (orjson.dumps(callbacks + [callback_url]), watch_id)
+                )
+            return None
+
+        return self._transaction(work)
+
+    def load_sync(self, watch_id: str) -> Optional[Dict[str, Any]]:
+        return self._row(self._connection().execute(
+            "SELECT state, snapshot, updated_at FROM watches WHERE watch_id = ?", (watch_id,)
+        ).fetchone())
+
+    def sweep_sync(self, owner: str) -> None:
+        """Marks the owner's watches as alive and drops finished watches past their retention."""
+        now = time.time()
+        connection = self._connection()
+        connection.execute("UPDATE watches SET updated_at = ? WHERE owner = ? AND state = ?", (now, owner, STATE_WATCHING))
+        connection.execute("DELETE FROM watches WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+
+def _present(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """A stored snapshot as Watch.snapshot() would give it now."""
+    snapshot = dict(stored)
+    next_check_at = snapshot.pop("next_check_at", None)
+    snapshot["next_check_in"] = (
+        round(max(0.0, next_check_at - time.time()), 1) if snapshot["state"] == STATE_WATCHING and next_check_at else None
+    )
+    return snapshot
+
+
+class Watch:
+    """One watched receipt, shared by every client that registered the same transaction."""
+
+    def __init__(self, provider: str, transaction_id: str, account: Optional[str], key: str):
+        self.watch_id = uuid.uuid4().hex
+        self.provider = provider
+        self.transaction_id = transaction_id
+        self.account = account
+        self.key = key
+        self.state = STATE_WATCHING
+        self.created_at = time.monotonic()
+        # The first check runs straight away; it is usually answered by the shared cache.
+        self.due_at = self.created_at
+        self.delay = WATCH_INITIAL_DELAY_SECONDS
+        self.checks = 0
+        self.finished_at: Optional[float] = None
+        self.outcome: Optional[VerificationOutcome] = None
+        self.callbacks: Set[str] = set()
+        self.listeners: Set[asyncio.Queue] = set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        watching = self.state == STATE_WATCHING
+        return {
+            "watch_id": self.watch_id,
+            "provider": self.provider,
+            "transaction_id": self.transaction_id,
+            "state": self.state,
+            "checks": self.checks,
+            "next_check_in": round(max(0.0, self.due_at - time.monotonic()), 1) if watching else None,
+            "result": self.outcome.model_dump() if self.outcome is not None else None,
+        }
+
+    def stored(self) -> bytes:
+        """The snapshot as written to the WatchStore, with a wall-clock time for the next check."""
+        snapshot = self.snapshot()
+        snapshot.pop("next_check_in")
+        snapshot["next_check_at"] = time.time() + max(0.0, self.due_at - time.monotonic())
+        return orjson.dumps(snapshot)
+
+
+class TransactionWatcher:
+    """
+    Rechecks pending receipts in the background until they settle, so clients wait on one
+    subscription instead of polling the verify endpoints.
+
+    Registrations for the same receipt share one Watch. Due rechecks are batched and go through
+    verification_engine as batch traffic, so they use the shared cache and single-flight like
+    any request and yield provider slots to interactive ones. When a watch settles or expires,
+    SSE subscribers get a final event and each callback URL gets one POST.
+
+    Each watch is rechecked by the worker that created it and mirrored in the WatchStore, so a
+    poll, event stream or registration landing on any other worker of the host finds it there.
+    With the shared cache disabled, watches are only known to the worker that created them
+    and the service must run a single worker.
+    """
+
+    def __init__(self, store: Optional[WatchStore] = None):
+        self.store = store or WatchStore()
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.watches: Dict[str, Watch] = {}
+        self._by_key: Dict[str, Watch] = {}
+        self._due: List[tuple] = []
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._checks: Set[asyncio.Task] = set()
+        self._deliveries: Set[asyncio.Task] = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._last_sweep = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = [task for task in (self._task, *self._checks, *self._deliveries) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+
+    def active_count(self) -> int:
+        return sum(1 for watch in self.watches.values() if watch.state == STATE_WATCHING)
+
+    async def _stored(self, operation: str, call, *args):
+        """Runs a WatchStore call in a thread; None when the store is off or failing."""
+        if not self.store.enabled:
+            return None
+        try:
+            return await asyncio.to_thread(call, *args)
+        except sqlite3.Error as e:
+            metrics.increment("watch_store_errors", operation=operation)
+            logger.warning("Watch store %s failed: %s", operation, e)
+            return None
+
+    async def snapshot(self, watch_id: str) -> Optional[Dict[str, Any]]:
+        """The watch's current state, whichever worker of the host owns it."""
+        watch = self.watches.get(watch_id)
+        if watch is not None:
+            return watch.snapshot()
+        return await self._stored("load", self.store.load_sync, watch_id)
+
+    async def register(self, provider: str, transaction_id: str, account: Optional[str], callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Returns the snapshot of the watch for this receipt, creating the watch if nobody on the
+        host is watching it yet.
+        """
+        key = verification_key(provider, transaction_id, verification_engine.get(provider).account_suffix(account))
+        watch = self._by_key.get(key)
+        if watch is None:
+            if self.active_count() >= WATCH_MAX_ACTIVE:
+                metrics.increment("watches_rejected")
+                raise WatchCapacityReached(int(WATCH_INITIAL_DELAY_SECONDS))
+            watch = Watch(provider, transaction_id, account, key)
+            existing = await self._stored("claim", self.store.claim_sync, watch.watch_id, key, self.owner, watch.stored())
+            if existing is not None:
+                metrics.increment("watches_registered", outcome="joined_other_worker")
+                if callback_url:
+                    await self._add_remote_callback(existing, callback_url)
+                return existing
+            self.watches[watch.watch_id] = watch
+            self._by_key[key] = watch
+            self._schedule(watch)
+            metrics.increment("watches_registered", outcome="new")
+            metrics.set_gauge("watches_active", self.active_count())
+        else:
+            metrics.increment("watches_registered", outcome="joined")
+
+        if callback_url:
+            watch.callbacks.add(callback_url)
+            if watch.state != STATE_WATCHING:
+                self._notify_webhook(watch.watch_id, watch.snapshot(), callback_url)
+        return watch.snapshot()
+
+    async def _add_remote_callback(self, snapshot: Dict[str, Any], callback_url: str) -> None:
+        finished = await self._stored("add_callback", self.store.add_callback_sync, snapshot["watch_id"], callback_url)
+        if finished is not None:
+            self._notify_webhook(finished["watch_id"], finished, callback_url)
+
+    async def events(self, watch_id: str, snapshot: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Server-Sent Events for one watch: `status` after each recheck, then `result` or
+        `expired`. snapshot is the watch's state when the stream was requested.
+        """
+        watch = self.watches.get(watch_id)
+        if watch is None:
+            async for event in self._remote_events(watch_id, snapshot):
+                yield event
+            return
+        if watch.state != STATE_WATCHING:
+            yield format_event(FINAL_EVENTS[watch.state], watch.snapshot())
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        watch.listeners.add(queue)
+        try:
+            yield format_event("status", watch.snapshot())
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event, data)
+                if event != "status":
+                    return
+        finally:
+            watch.listeners.discard(queue)
+
+    async def _remote_events(self, watch_id: str, snapshot: Dict[str, Any]) -> AsyncIterator[str]:
+        """events() for a watch owned by another worker, followed through the WatchStore."""
+        if snapshot["state"] != STATE_WATCHING:
+            yield format_event(FINAL_EVENTS[snapshot["state"]], snapshot)
+            return
+        yield format_event("status", snapshot)
+        checks = snapshot["checks"]
+        last_sent = time.monotonic()
+        while True:
+            await asyncio.sleep(REMOTE_POLL_SECONDS)
+            current = await self._stored("load", self.store.load_sync, watch_id)
+            if current is None:
+                # Pruned, or the store became unreadable: report what we last knew as final.
+                yield format_event("expired", {**snapshot, "state": STATE_EXPIRED, "next_check_in": None})
+                return
+            snapshot = current
+            if snapshot["state"] != STATE_WATCHING:
+                yield format_event(FINAL_EVENTS[snapshot["state"]], snapshot)
+                return
+            if snapshot["checks"] != checks:
+                checks = snapshot["checks"]
+                last_sent = time.monotonic()
+                yield format_event("status", snapshot)
+            elif time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+
+    def _schedule(self, watch: Watch) -> None:
+        heapq.heappush(self._due, (watch.due_at, next(self._sequence), watch.watch_id))
+        self._wake.set()
+
+    def _pop_due(self, until: float, limit: int) -> List[Watch]:
+        batch = []
+        while self._due and self._due[0][0] <= until and len(batch) < limit:
+            _, _, watch_id = heapq.heappop(self._due)
+            watch = self.watches.get(watch_id)
+            if watch is not None and watch.state == STATE_WATCHING:
+                batch.append(watch)
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now - self._last_sweep >= SWEEP_INTERVAL_SECONDS:
+                self._sweep(now)
+                await self._stored("sweep", self.store.sweep_sync, self.owner)
+            batch = self._pop_due(now + WATCH_BATCH_WINDOW_SECONDS, WATCH_BATCH_SIZE - len(self._checks))
+            if batch:
+                metrics.observe("watch_batch_size", len(batch))
+                for watch in batch:
+                    task = asyncio.create_task(self._check(watch))
+                    self._checks.add(task)
+                    task.add_done_callback(self._check_done)
+                continue
+
+            self._wake.clear()
+            timeout = SWEEP_INTERVAL_SECONDS
+            if self._due and len(self._checks) < WATCH_BATCH_SIZE:
+                timeout = min(timeout, max(0.0, self._due[0][0] - now))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _check_done(self, task: asyncio.Task) -> None:
+        self._checks.discard(task)
+        # A slot is free for the next due recheck.
+        self._wake.set()
+
+    async def _check(self, watch: Watch) -> None:
+        watch.checks += 1
+        retry_after = 0.0
+        outcome = None
+        try:
+            with deadline_scope(WATCH_CHECK_BUDGET_SECONDS):
+                outcome = await verification_engine.verify(watch.provider, watch.transaction_id, watch.account, TRAFFIC_BATCH)
+        except AdmissionRejected as e:
+            retry_after = e.retry_after
+        except DeadlineExceeded:
+            pass
+        except Exception:
+            logger.exception("Recheck of %s %s failed", watch.provider, watch.transaction_id)
+
+        status = outcome.status if outcome is not None else None
+        if is_settled(status):
+            watch.outcome = outcome
+            metrics.increment("watch_checks", outcome="settled")
+            await self._finish(watch, STATE_SETTLED)
+            return
+
+        if is_pending_status(status):
+            watch.outcome = outcome
+        metrics.increment("watch_checks", outcome="pending" if is_pending_status(status) else "error")
+        now = time.monotonic()
+        if now - watch.created_at >= WATCH_MAX_AGE_SECONDS:
+            await self._finish(watch, STATE_EXPIRED)
+            return
+
+        # Jittered so watches registered together do not stay in lockstep.
+        watch.due_at = now + max(retry_after, watch.delay * random.uniform(0.8, 1.2))
+        watch.delay = min(WATCH_MAX_DELAY_SECONDS, watch.delay * WATCH_BACKOFF_FACTOR)
+        self._publish(watch, "status")
+        self._schedule(watch)
+        await self._stored("save", self.store.save_sync, watch.watch_id, watch.state, watch.stored())
+
+    async def _finish(self, watch: Watch, state: str) -> None:
+        watch.state = state
+        watch.finished_at = time.monotonic()
+        if state == STATE_EXPIRED:
+            # A new registration should start watching again rather than get this answer.
+            self._by_key.pop(watch.key, None)
+        metrics.increment("watches_finished", state=state)
+        metrics.set_gauge("watches_active", self.active_count())
+        self._publish(watch, FINAL_EVENTS[state])
+        # Callbacks registered through other workers are handed over with the final write.
+        stored_callbacks = await self._stored("save", self.store.save_sync, watch.watch_id, state, watch.stored())
+        snapshot = watch.snapshot()
+        for callback_url in watch.callbacks.union(stored_callbacks or ()):
+            self._notify_webhook(watch.watch_id, snapshot, callback_url)
+
+    def _publish(self, watch: Watch, event: str) -> None:
+        if watch.listeners:
+            snapshot = watch.snapshot()
+            for queue in watch.listeners:
+                queue.put_nowait((event, snapshot))
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        for watch in list(self.watches.values()):
+            if watch.finished_at is not None and now - watch.finished_at >= WATCH_RETENTION_SECONDS:
+                del self.watches[watch.watch_id]
+                if self._by_key.get(watch.key) is watch:
+                    del self._by_key[watch.key]
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            # Never follow redirects: a public callback could otherwise bounce the POST to an internal address.
+            self._client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS, follow_redirects=False)
+        return self._client
+
+    def _notify_webhook(self, watch_id: str, snapshot: Dict[str, Any], callback_url: str) -> None:
+        body = orjson.dumps({"event": FINAL_EVENTS[snapshot["state"]], **snapshot})
+        task = asyncio.create_task(self._deliver(callback_url, body, watch_id))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, callback_url: str, body: bytes, watch_id: str) -> None:
+        headers = {"Content-Type": "application/json"}
+        if WATCH_WEBHOOK_SECRET:
+            signature = hmac.new(WATCH_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Watch-Signature"] = f"sha256={signature}"
+
+        async def post():
+            response = await self._http().post(callback_url, content=body, headers=headers)
+            response.raise_for_status()
+
+        try:
+            await check_callback_url(callback_url)
+            await call_with_retry("watch_webhook", post, WEBHOOK_RETRY_POLICY)
+            metrics.increment("watch_webhooks", outcome="delivered")
+        except Exception as e:
+            metrics.increment("watch_webhooks", outcome="failed")
+            logger.warning("Webhook for watch %s to %s failed: %s", watch_id, callback_url, e)
+
+
+transaction_watcher = TransactionWatcher()
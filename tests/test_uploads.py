@@ -0,0 +1,59 @@
+# tests/test_uploads.py
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from utils.uploads import MULTIPART_OVERHEAD_BYTES, UploadSizeLimitMiddleware
+
+LIMIT_BYTES = 1024 * 1024
+BOUNDARY = "receipt-boundary"
+
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=LIMIT_BYTES + MULTIPART_OVERHEAD_BYTES)
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    return TestClient(app)
+
+
+def _multipart(file_size: int) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="receipt.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode() + b"\0" * file_size + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def _chunks(body: bytes, size: int = 64 * 1024):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def _post(client: TestClient, content):
+    return client.post("/upload", content=content, headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+
+
+def test_oversized_upload_with_content_length_is_rejected_with_413():
+    response = _post(_client(), _multipart(2 * LIMIT_BYTES))
+
+    assert response.status_code == 413
+    assert response.json()["detail"]["status"] == "Failed"
+
+
+def test_oversized_chunked_upload_is_rejected_with_413():
+    # A generator body is sent with Transfer-Encoding: chunked and no Content-Length.
+    response = _post(_client(), _chunks(_multipart(2 * LIMIT_BYTES)))
+
+    assert response.status_code == 413
+    assert response.json()["detail"]["message"] == "Uploaded file is too large. The limit is 1 MB."
+
+
+def test_chunked_upload_within_the_limit_is_accepted():
+    response = _post(_client(), _chunks(_multipart(LIMIT_BYTES // 2)))
+
+    assert response.status_code == 200
+    assert response.json() == {"size": LIMIT_BYTES // 2}
@@ -0,0 +1,227 @@
+# utils/admission.py
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from utils import deadline, progress
+from utils.metrics import metrics
+
+TRAFFIC_INTERACTIVE = "interactive"
+TRAFFIC_BATCH = "batch"
+TRAFFIC_CLASSES = (TRAFFIC_INTERACTIVE, TRAFFIC_BATCH)
+
+# Work pools guarded by admission control. Browser scrapes and Gemini calls are what run out first.
+DEFAULT_CAPACITIES = {
+    "telebirr": int(os.environ.get("ADMISSION_CAPACITY_TELEBIRR", "4")),
+    "boa": int(os.environ.get("ADMISSION_CAPACITY_BOA", "4")),
+    "cbe": int(os.environ.get("ADMISSION_CAPACITY_CBE", "6")),
+    "ocr": int(os.environ.get("ADMISSION_CAPACITY_OCR", "12")),
+}
+# Typical service time used for Retry-After before any request has finished.
+DEFAULT_SERVICE_SECONDS = {"telebirr": 8.0, "boa": 8.0, "cbe": 20.0, "ocr": 4.0}
+
+QUEUE_LIMIT = int(os.environ.get("ADMISSION_QUEUE_LIMIT", "16"))
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_QUEUE_WAIT_SECONDS", "15"))
+# Batch traffic may never occupy more than this share of a pool, so interactive checks always find a slot.
+BATCH_SHARE = float(os.environ.get("ADMISSION_BATCH_SHARE", "0.75"))
+EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """The pool for this request is saturated; the client should retry after retry_after seconds."""
+
+    def __init__(self, provider: str, retry_after: int, reason: str):
+        super().__init__(f"{provider} capacity saturated: {reason}")
+        self.provider = provider
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("priority", "sequence", "traffic_class", "future", "cancelled")
+
+    def __init__(self, priority: int, sequence: int, traffic_class: str, future: asyncio.Future):
+        self.priority = priority
+        self.sequence = sequence
+        self.traffic_class = traffic_class
+        self.future = future
+        self.cancelled = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class _PoolState:
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.batch_limit = max(1, int(self.capacity * BATCH_SHARE))
+        self.in_flight = 0
+        self.in_flight_batch = 0
+        self.waiters: List[_Waiter] = []
+        self.queued = 0
+        self.ewma_service_seconds = DEFAULT_SERVICE_SECONDS.get(name, 5.0)
+
+    def can_start(self, traffic_class: str) -> bool:
+        if self.in_flight >= self.capacity:
+            return False
+        return traffic_class != TRAFFIC_BATCH or self.in_flight_batch < self.batch_limit
+
+    def start(self, traffic_class: str) -> None:
+        self.in_flight += 1
+        if traffic_class == TRAFFIC_BATCH:
+            self.in_flight_batch += 1
+
+
+def _priority(traffic_class: str, cheap: bool) -> int:
+    # Interactive before batch; within a class, cheap requests (cache hits, QR-decodable images) first.
+    return (0 if traffic_class == TRAFFIC_INTERACTIVE else 2) + (0 if cheap else 1)
+
+
+class AdmissionController:
+    """
+    Bounds in-flight work per pool. Requests that cannot start immediately wait in a small
+    priority queue; when the queue is full or the wait would be too long, they are rejected
+    with a Retry-After computed from the pool's observed service time and backlog.
+    """
+
+    def __init__(self, capacities: Dict[str, int], queue_limit: int = QUEUE_LIMIT):
+        self.queue_limit = queue_limit
+        self._pools = {name: _PoolState(name, capacity) for name, capacity in capacities.items()}
+        self._sequence = itertools.count()
+
+    def _pool(self, name: str) -> _PoolState:
+        pool = self._pools.get(name)
+        if pool is None:
+            pool = self._pools[name] = _PoolState(name, DEFAULT_CAPACITIES.get(name, 4))
+        return pool
+
+    def retry_after_seconds(self, pool: _PoolState) -> int:
+        backlog = pool.queued + pool.in_flight + 1
+        return max(1, math.ceil(pool.ewma_service_seconds * backlog / pool.capacity))
+
+    def _reject(self, pool: _PoolState, traffic_class: str, reason: str) -> AdmissionRejected:
+        metrics.increment("admission_rejected", pool=pool.name, traffic_class=traffic_class, reason=reason)
+        return AdmissionRejected(pool.name, self.retry_after_seconds(pool), reason)
+
+    def _publish(self, pool: _PoolState) -> None:
+        metrics.set_gauge("admission_in_flight", pool.in_flight, pool=pool.name)
+        metrics.set_gauge("admission_queued", pool.queued, pool=pool.name)
+
+    def _wake(self, pool: _PoolState) -> None:
+        while pool.waiters:
+            head = pool.waiters[0]
+            if head.cancelled or head.future.done():
+                heapq.heappop(pool.waiters)
+                continue
+            if not pool.can_start(head.traffic_class):
+                break
+            heapq.heappop(pool.waiters)
+            pool.queued -= 1
+            pool.start(head.traffic_class)
+            head.future.set_result(True)
+        self._publish(pool)
+
+    def _evict_lower_priority(self, pool: _PoolState, priority: int) -> bool:
+        """Makes room for a more urgent request by rejecting the least urgent queued one."""
+        live = [waiter for waiter in pool.waiters if not waiter.cancelled and not waiter.future.done()]
+        if not live:
+            return False
+        victim = max(live)
+        if victim.priority <= priority:
+            return False
+        victim.cancelled = True
+        pool.queued -= 1
+        victim.future.set_exception(self._reject(pool, victim.traffic_class, "preempted"))
+        return True
+
+    async def _enqueue(self, pool: _PoolState, traffic_class: str, priority: int) -> None:
+        if pool.queued >= self.queue_limit and not self._evict_lower_priority(pool, priority):
+            raise self._reject(pool, traffic_class, "queue_full")
+
+        max_wait = MAX_QUEUE_WAIT_SECONDS
+        time_left = deadline.remaining()
+        if time_left is not None:
+            max_wait = min(max_wait, time_left - deadline.RESPONSE_RESERVE_SECONDS)
+        if max_wait <= 0:
+            raise self._reject(pool, traffic_class, "no_time_to_queue")
+
+        waiter = _Waiter(priority, next(self._sequence), traffic_class, asyncio.get_running_loop().create_future())
+        heapq.heappush(pool.waiters, waiter)
+        pool.queued += 1
+        self._publish(pool)
+
+        queued_at = time.perf_counter()
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=max_wait)
+        except asyncio.CancelledError:
+            # The request went away while queued (client disconnect, hedge loser, deadline).
+            self._abandon(pool, waiter)
+            raise
+        metrics.observe("admission_queue_wait_ms", (time.perf_counter() - queued_at) * 1000, pool=pool.name, traffic_class=traffic_class)
+        if not done:
+            waiter.cancelled = True
+            pool.queued -= 1
+            waiter.future.cancel()
+            self._publish(pool)
+            raise self._reject(pool, traffic_class, "queue_timeout")
+        # Raises AdmissionRejected if this waiter was preempted by a more urgent request.
+        waiter.future.result()
+
+    def _abandon(self, pool: _PoolState, waiter: _Waiter) -> None:
+        """Takes a cancelled request out of the queue, giving back the slot if it was already granted."""
+        if not waiter.future.done():
+            waiter.cancelled = True
+            pool.queued -= 1
+            waiter.future.cancel()
+            self._publish(pool)
+        elif waiter.future.exception() is None:
+            # _wake granted the slot just before the cancellation landed; nobody will use it.
+            self._release(pool, waiter.traffic_class)
+        else:
+            # Preempted: _evict_lower_priority already took it off the queue count.
+            self._publish(pool)
+
+    def _release(self, pool: _PoolState, traffic_class: str) -> None:
+        pool.in_flight -= 1
+        if traffic_class == TRAFFIC_BATCH:
+            pool.in_flight_batch -= 1
+        self._wake(pool)
+
+    @asynccontextmanager
+    async def admit(self, pool_name: str, traffic_class: str = TRAFFIC_INTERACTIVE, cheap: bool = False):
+        pool = self._pool(pool_name)
+        traffic_class = traffic_class if traffic_class in TRAFFIC_CLASSES else TRAFFIC_INTERACTIVE
+        priority = _priority(traffic_class, cheap)
+
+        has_urgent_waiters = any(not w.cancelled and w.priority <= priority for w in pool.waiters)
+        if pool.can_start(traffic_class) and not has_urgent_waiters:
+            pool.start(traffic_class)
+            self._publish(pool)
+        else:
+            progress.report("queued", pool=pool.name, position=pool.queued + 1)
+            await self._enqueue(pool, traffic_class, priority)
+            progress.report("admitted", pool=pool.name)
+
+        metrics.increment("admission_admitted", pool=pool.name, traffic_class=traffic_class, cheap="yes" if cheap else "no")
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started_at
+            pool.ewma_service_seconds = (1 - EWMA_ALPHA) * pool.ewma_service_seconds + EWMA_ALPHA * elapsed
+            self._release(pool, traffic_class)
+
+
+def normalize_traffic_class(value: Optional[str]) -> str:
+    value = (value or "").strip().lower()
+    return value if value in TRAFFIC_CLASSES else TRAFFIC_INTERACTIVE
+
+
+admission_controller = AdmissionController(DEFAULT_CAPACITIES)
@@ -0,0 +1,333 @@
+# utils/capture.py
+
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import orjson
+
+from utils import log
+from utils.metrics import metrics
+from utils.transaction_ids import classify_transaction_id, normalize_transaction_id
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: with a path set, each HTTP request appends one JSON line describing it to that file,
+# for benchmarks/replay.py. Workers append to the same file.
+TRAFFIC_CAPTURE_PATH = os.environ.get("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", "1"))
+# Keys the fingerprints. Set it when running more than one worker, so the same receipt gets the
+# same fingerprint in every worker; otherwise each process uses its own random key.
+TRAFFIC_CAPTURE_SALT = os.environ.get("TRAFFIC_CAPTURE_SALT", "")
+CAPTURE_QUEUE_SIZE = 10_000
+
+# When unset or sampling nothing, the middleware is not installed at all.
+CAPTURE_ENABLED = bool(TRAFFIC_CAPTURE_PATH) and TRAFFIC_CAPTURE_SAMPLE_RATE > 0
+
+CAPTURED_HEADERS = ("x-traffic-class", "x-request-timeout-ms")
+CAPTURED_QUERY = ("timeout_ms",)
+SKIPPED_PATH_PREFIXES = ("/debug/",)
+# Request bodies and form values past these sizes are recorded by size only.
+MAX_JSON_BYTES = 64 * 1024
+MAX_FORM_VALUE_BYTES = 1024
+# Small JSON responses to POSTs are read for the identifiers the server hands out, so a replay can map a
+# follow-up request (GET /watches/{id}, /verify_image_session) onto the identifier it was issued.
+MAX_RESPONSE_BYTES = 16 * 1024
+ISSUED_FIELDS = ("watch_id", "session_token")
+
+# How each request field is recorded. Anything not listed is reduced to a fingerprint.
+ID_FIELDS = frozenset({"transaction_id"})
+ACCOUNT_FIELDS = frozenset({"sender_account", "account_number", "sender_account_input", "account_number_input"})
+PLAIN_FIELDS = frozenset({"provider", "prefetch"})
+
+_salt = TRAFFIC_CAPTURE_SALT.encode() if TRAFFIC_CAPTURE_SALT else secrets.token_bytes(32)
+
+
+def fingerprint(value: Any) -> str:
+    """Stable within one capture (same salt), useless for recovering the value."""
+    raw = value if isinstance(value, bytes) else str(value).encode()
+    return hmac.new(_salt, raw, hashlib.sha256).hexdigest()[:16]
+
+
+def describe_transaction_id(raw: Any) -> Dict[str, Any]:
+    transaction_id = normalize_transaction_id(raw) if isinstance(raw, str) else ""
+    # Which providers' grammar it satisfies: empty for IDs local validation rejects.
+    return {"fp": fingerprint(transaction_id), "length": len(transaction_id), "formats": classify_transaction_id(transaction_id)}
+
+
+def describe_account(raw: Any) -> Optional[Dict[str, Any]]:
+    if raw in (None, ""):
+        return None
+    digits = "".join(c for c in str(raw) if c.isdigit())
+    return {"fp": fingerprint(digits), "digits": len(digits), "length": len(str(raw))}
+
+
+def anonymize_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    described = {}
+    for key, value in data.items():
+        if key in ID_FIELDS:
+            described[key] = describe_transaction_id(value)
+        elif key in ACCOUNT_FIELDS:
+            described[key] = describe_account(value)
+        elif key in PLAIN_FIELDS and (value is None or isinstance(value, bool) or (isinstance(value, str) and len(value) <= 32)):
+            described[key] = value
+        else:
+            described[key] = {"fp": fingerprint(orjson.dumps(value) if not isinstance(value, str) else value)}
+    return described
+
+
+def _file_format(head: bytes) -> str:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG"):
+        return "png"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return "other"
+
+
+class _MultipartRecorder:
+    """
+    Streams a multipart body through python-multipart's parser as it is received: files are
+    recorded as size, format and a fingerprint of their content; form fields as anonymized
+    values. Nothing is buffered beyond one small form value.
+    """
+
+    def __init__(self, boundary: bytes):
+        from python_multipart.multipart import MultipartParser
+
+        self.files: List[Dict[str, Any]] = []
+        self.form: Dict[str, Any] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._part: Optional[Dict[str, Any]] = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._append_header("_header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._append_header("_header_value", data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _append_header(self, name: str, data: bytes) -> None:
+        setattr(self, name, getattr(self, name) + data)
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        from python_multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            self._part = {
+                "field": name, "content_type": self._headers.get(b"content-type", b"").decode("latin-1"),
+                "size": 0, "head": b"", "hash": hmac.new(_salt, digestmod=hashlib.sha256)
+            }
+        else:
+            self._part = {"field": name, "value": bytearray(), "size": 0}
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        part = self._part
+        chunk = data[start:end]
+        part["size"] += len(chunk)
+        if "hash" in part:
+            part["hash"].update(chunk)
+            if len(part["head"]) < 16:
+                part["head"] += chunk[:16]
+        elif part["size"] <= MAX_FORM_VALUE_BYTES:
+            part["value"] += chunk
+
+    def _on_part_end(self) -> None:
+        part, self._part = self._part, None
+        if part is None:
+            return
+        if "hash" in part:
+            self.files.append({
+                "field": part["field"], "content_type": part["content_type"], "format": _file_format(part["head"]),
+                "size": part["size"], "fp": part["hash"].hexdigest()[:16],
+            })
+        elif part["size"] <= MAX_FORM_VALUE_BYTES:
+            self.form.update(anonymize_fields({part["field"]: bytes(part["value"]).decode("utf-8", "replace")}))
+        else:
+            self.form[part["field"]] = {"size": part["size"]}
+
+    def write(self, chunk: bytes) -> None:
+        self._parser.write(chunk)
+
+
+class CaptureWriter:
+    """Appends records to the capture file from a background thread, one write per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("traffic_capture_dropped")
+
+    def _run(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                try:
+                    os.write(fd, orjson.dumps(record) + b"\n")
+                except OSError as e:
+                    metrics.increment("traffic_capture_dropped")
+                    logger.warning("Could not write traffic capture record: %s", e)
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+capture_writer = CaptureWriter(TRAFFIC_CAPTURE_PATH)
+
+
+class TrafficCaptureMiddleware:
+    """
+    Records each HTTP request's shape for replay: method, route, the traffic-class and timeout
+    headers, body size, anonymized fields and file fingerprints, then status, duration and the
+    verification outcome. Receipt IDs and account numbers are kept only as salted fingerprints
+    plus their format, so a trace reproduces repeats and invalid IDs without holding customer
+    data. Bodies are inspected as they stream through; nothing is buffered.
+
+    Only installed when CAPTURE_ENABLED.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope.get("path", "").startswith(SKIPPED_PATH_PREFIXES)
+            or (TRAFFIC_CAPTURE_SAMPLE_RATE < 1 and random.random() >= TRAFFIC_CAPTURE_SAMPLE_RATE)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        record: Dict[str, Any] = {"ts": round(time.time(), 3), "method": scope.get("method"), "path": scope.get("path")}
+        headers = dict(scope.get("headers") or [])
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        record["headers"] = {name: headers[name.encode()].decode("latin-1") for name in CAPTURED_HEADERS if name.encode() in headers}
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        record["query"] = {name: query[name] for name in CAPTURED_QUERY if name in query}
+
+        multipart = None
+        if content_type.startswith("multipart/"):
+            from python_multipart.multipart import parse_options_header
+
+            boundary = parse_options_header(content_type)[1].get(b"boundary")
+            multipart = _MultipartRecorder(boundary) if boundary else None
+        json_body = bytearray() if content_type.startswith("application/json") else None
+        body_bytes = 0
+
+        async def recording_receive():
+            nonlocal body_bytes, json_body, multipart
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_bytes += len(chunk)
+                if json_body is not None:
+                    json_body = json_body + chunk if body_bytes <= MAX_JSON_BYTES else None
+                if multipart is not None and chunk:
+                    try:
+                        multipart.write(chunk)
+                    except Exception:
+                        # A malformed body is the application's to reject; stop describing it.
+                        multipart = None
+            return message
+
+        status_code = 500
+        response_type = ""
+        # Only requests that create something (POST) are read for issued identifiers.
+        response_body: Optional[bytearray] = bytearray() if scope.get("method") == "POST" else None
+
+        async def recording_send(message):
+            nonlocal status_code, response_type, response_body
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_type = dict(message.get("headers") or []).get(b"content-type", b"").decode("latin-1")
+            elif message["type"] == "http.response.body" and response_body is not None:
+                response_body += message.get("body", b"")
+                if len(response_body) > MAX_RESPONSE_BYTES or not response_type.startswith("application/json"):
+                    response_body = None
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            route = scope.get("route")
+            record["route"] = getattr(route, "path", None)
+            if scope.get("path_params"):
+                record["path_params"] = {name: fingerprint(value) for name, value in scope["path_params"].items()}
+            record["content_type"] = content_type.split(";")[0] or None
+            record["body_bytes"] = body_bytes
+            if json_body:
+                try:
+                    data = orjson.loads(json_body)
+                    record["json"] = anonymize_fields(data) if isinstance(data, dict) else {"fp": fingerprint(bytes(json_body))}
+                except orjson.JSONDecodeError:
+                    record["json"] = None
+            if multipart is not None:
+                record["files"] = multipart.files
+                record["form"] = multipart.form
+            record["status"] = status_code
+            record["duration_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+            fields = log.summary_fields()
+            record["provider"] = fields.get("provider")
+            record["outcome"] = fields.get("outcome")
+            if response_body:
+                issued = self._issued(response_body)
+                if issued:
+                    record["issued"] = issued
+            capture_writer.submit(record)
+
+    @staticmethod
+    def _issued(body: bytes) -> Dict[str, str]:
+        try:
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {name: fingerprint(data[name]) for name in ISSUED_FIELDS if isinstance(data.get(name), str)}
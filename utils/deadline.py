@@ -0,0 +1,81 @@
+# utils/deadline.py
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Absolute time.monotonic() value by which the current request must be answered, if any.
+_request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# Requests may ask for a tighter budget than the hard-coded stage timeouts, never a looser one.
+MAX_REQUEST_BUDGET_SECONDS = 600.0
+# Leave a little time to build and send the response once the last stage gives up.
+RESPONSE_RESERVE_SECONDS = 0.25
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage is about to start but the request budget is already spent."""
+
+
+def parse_request_budget(header_value: Optional[str], query_value: Optional[str]) -> Optional[float]:
+    """
+    Reads the client's budget in milliseconds from the X-Request-Timeout-Ms header or the
+    timeout_ms query parameter. Returns seconds, or None when the client did not set one.
+    Raises ValueError for values that are not positive numbers.
+    """
+    raw_value = header_value if header_value not in (None, "") else query_value
+    if raw_value in (None, ""):
+        return None
+    budget_ms = float(raw_value)
+    if budget_ms <= 0:
+        raise ValueError("Request timeout must be a positive number of milliseconds.")
+    return min(budget_ms / 1000.0, MAX_REQUEST_BUDGET_SECONDS)
+
+
+@contextmanager
+def deadline_scope(budget_seconds: Optional[float]):
+    """Sets the deadline for everything awaited inside the block. A nested scope can only shorten it."""
+    if budget_seconds is None:
+        yield
+        return
+    new_deadline = time.monotonic() + budget_seconds
+    current = _request_deadline.get()
+    if current is not None:
+        new_deadline = min(current, new_deadline)
+    token = _request_deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None when no deadline is set."""
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def clamp_timeout(default_seconds: float) -> float:
+    """
+    Trims a stage's own timeout to what is left of the request budget. Raises DeadlineExceeded
+    when there is no useful time left, so callers fail fast instead of starting doomed work.
+    """
+    left = remaining()
+    if left is None:
+        return default_seconds
+    left -= RESPONSE_RESERVE_SECONDS
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded before the next stage could start.")
+    return min(default_seconds, left)
+
+
+def clamp_timeout_ms(default_ms: float) -> float:
+    return clamp_timeout(default_ms / 1000.0) * 1000.0
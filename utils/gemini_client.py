@@ -0,0 +1,285 @@
+# utils/gemini_client.py
+
+import base64
+import io
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncContextManager, Callable, Dict, Optional, Sequence, Tuple
+
+import httpx
+
+from utils import deadline
+from utils.hedging import hedged
+from utils.metrics import metrics
+from utils.retry import GEMINI_RETRY_POLICY, RetryPolicy, call_with_retry
+from utils.uploads import Buffer, open_buffer
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# Receipts stay legible well below phone-camera resolution; anything larger only costs upload time and tokens.
+MAX_IMAGE_SIDE = int(os.environ.get("GEMINI_MAX_IMAGE_SIDE", "1600"))
+JPEG_QUALITY = int(os.environ.get("GEMINI_JPEG_QUALITY", "80"))
+
+TRANSACTION_ID_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "transaction_id": {
+            "type": "STRING",
+            "nullable": True,
+            "description": "The transaction ID / reference number, uppercase, without spaces. Null if not visible."
+        },
+        "confidence": {
+            "type": "NUMBER",
+            "description": "0 to 1: how certain every character of transaction_id is read correctly."
+        }
+    },
+    "required": ["transaction_id", "confidence"]
+}
+
+# Several receipts in one request: one entry per image, `image` being its 1-based position.
+PACKED_TRANSACTION_IDS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "receipts": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "image": {"type": "INTEGER", "description": "1-based number of the image, as labelled in the prompt."},
+                    **TRANSACTION_ID_SCHEMA["properties"]
+                },
+                "required": ["image", "transaction_id", "confidence"]
+            }
+        }
+    },
+    "required": ["receipts"]
+}
+
+CBE_RECEIPT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "transaction_id": {"type": "STRING", "nullable": True, "description": "VAT Receipt No or Reference No., e.g. FT25188TN19J."},
+        "sender_name": {"type": "STRING", "nullable": True, "description": "Payer name."},
+        "receiver_name": {"type": "STRING", "nullable": True, "description": "Receiver / credited party name."},
+        "amount": {"type": "NUMBER", "nullable": True, "description": "Transferred amount in ETB, without currency or separators."},
+        "date": {"type": "STRING", "nullable": True, "description": "Payment date and time as ISO 8601, e.g. 2025-07-06T10:08:00."},
+        "status": {"type": "STRING", "nullable": True, "enum": ["Completed", "Failed", "Pending", "Successful"]}
+    },
+    "required": ["transaction_id", "sender_name", "receiver_name", "amount", "date", "status"]
+}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Pooled client shared by every Gemini call so connections and TLS sessions are reused."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=GEMINI_API_BASE,
+            headers={'Content-Type': 'application/json'},
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def warm_up() -> None:
+    """Opens a pooled connection to the Gemini API so the first OCR call skips DNS and TLS setup."""
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+    if not api_key:
+        return
+    try:
+        await get_client().get("/models", params={"key": api_key, "pageSize": 1}, timeout=10.0)
+    except httpx.HTTPError:
+        pass
+
+
+def prepare_image_for_gemini(image: Buffer, max_side: int = MAX_IMAGE_SIDE) -> Tuple[str, str]:
+    """
+    Shrinks a receipt image before upload: converts to grayscale, crops uniform margins,
+    downscales so the longest side is at most max_side and re-encodes as JPEG or PNG.
+    Returns (base64 data, mime type); only this downscaled copy is ever base64-encoded.
+    Falls back to the original bytes if they cannot be decoded.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with open_buffer(image) as stream, Image.open(stream) as source:
+            # JPEG can decode at 1/2, 1/4 or 1/8 scale; skip the full-resolution bitmap when possible.
+            longest = max(source.size)
+            if longest > max_side:
+                source.draft("L", (source.width * max_side // longest, source.height * max_side // longest))
+            gray = ImageOps.exif_transpose(source).convert("L")
+    except Exception as e:
+        logger.warning("Could not decode image for Gemini, sending it unchanged: %s", e)
+        return base64.b64encode(image).decode('utf-8'), "image/png"
+
+    # Crop to the bounding box of anything noticeably darker than the page background.
+    content_box = ImageOps.invert(ImageOps.autocontrast(gray)).point(lambda value: 255 if value > 24 else 0).getbbox()
+    if content_box:
+        left, top, right, bottom = content_box
+        margin = 12
+        gray = gray.crop((
+            max(0, left - margin), max(0, top - margin),
+            min(gray.width, right + margin), min(gray.height, bottom + margin)
+        ))
+
+    if max(gray.size) > max_side:
+        gray.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    # Photos compress far better as JPEG, flat rendered pages as PNG; keep whichever is smaller.
+    jpeg_buffer = io.BytesIO()
+    gray.save(jpeg_buffer, format="JPEG", quality=JPEG_QUALITY)
+    png_buffer = io.BytesIO()
+    gray.save(png_buffer, format="PNG")
+    if png_buffer.tell() < jpeg_buffer.tell():
+        return base64.b64encode(png_buffer.getbuffer()).decode('utf-8'), "image/png"
+    return base64.b64encode(jpeg_buffer.getbuffer()).decode('utf-8'), "image/jpeg"
+
+
+def prepare_array_for_gemini(gray, max_side: int = MAX_IMAGE_SIDE) -> Tuple[str, str]:
+    """
+    prepare_image_for_gemini() for an image already decoded to an 8-bit grayscale array, so a
+    caller that decoded it for QR detection does not decode it again. Same crop, downscale and
+    JPEG-or-PNG choice, done with NumPy and OpenCV.
+    """
+    import cv2
+    import numpy as np
+
+    low, high = int(gray.min()), int(gray.max())
+    if high > low:
+        # Pixels noticeably darker than the page once contrast is stretched (the PIL path's autocontrast + invert > 24).
+        dark = gray < low + (high - low) * (231 / 255)
+        rows = np.flatnonzero(dark.any(axis=1))
+        cols = np.flatnonzero(dark.any(axis=0))
+        if rows.size and cols.size:
+            margin = 12
+            gray = gray[max(0, rows[0] - margin):rows[-1] + 1 + margin, max(0, cols[0] - margin):cols[-1] + 1 + margin]
+
+    longest = max(gray.shape)
+    if longest > max_side:
+        scale = max_side / longest
+        gray = cv2.resize(gray, (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+    _, jpeg = cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    _, png = cv2.imencode(".png", gray)
+    if png.size < jpeg.size:
+        return base64.b64encode(png).decode("utf-8"), "image/png"
+    return base64.b64encode(jpeg).decode("utf-8"), "image/jpeg"
+
+
+def _record_usage(operation: str, model: str, result: Dict[str, Any], elapsed_ms: float, request_bytes: int) -> None:
+    usage = result.get("usageMetadata") or {}
+    prompt_tokens = usage.get("promptTokenCount", 0)
+    response_tokens = usage.get("candidatesTokenCount", 0)
+    metrics.increment("gemini_calls", operation=operation, model=model)
+    metrics.increment("gemini_prompt_tokens", prompt_tokens, operation=operation, model=model)
+    metrics.increment("gemini_response_tokens", response_tokens, operation=operation, model=model)
+    metrics.observe("gemini_call_ms", elapsed_ms, operation=operation, model=model)
+    metrics.observe("gemini_request_bytes", request_bytes, operation=operation, model=model)
+    metrics.observe("gemini_prompt_tokens_per_call", prompt_tokens, operation=operation, model=model)
+
+
+async def generate_json(
+    prompt: str,
+    image_base64: str,
+    mime_type: str,
+    response_schema: Dict[str, Any],
+    operation: str,
+    model: str = DEFAULT_MODEL,
+    timeout: float = 90.0,
+    retry_policy: RetryPolicy = GEMINI_RETRY_POLICY
+) -> Optional[Dict[str, Any]]:
+    """
+    Sends one prompt + image to Gemini in JSON mode with a response schema and returns the
+    decoded object, or None when the reply is empty or not valid JSON. Retryable statuses are
+    retried per retry_policy; the final HTTP error is raised.
+    """
+    return await generate_json_for_images(
+        prompt, [(image_base64, mime_type)], response_schema, operation,
+        model=model, timeout=timeout, retry_policy=retry_policy
+    )
+
+
+async def generate_json_for_images(
+    prompt: str,
+    images: Sequence[Tuple[str, str]],
+    response_schema: Dict[str, Any],
+    operation: str,
+    model: str = DEFAULT_MODEL,
+    timeout: float = 90.0,
+    retry_policy: RetryPolicy = GEMINI_RETRY_POLICY,
+    attempt_slot: Optional[Callable[[], AsyncContextManager]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    generate_json() for one or more (base64 data, mime type) images in a single request. With
+    more than one, each image is preceded by an "Image N:" label the prompt can refer to.
+    Every HTTP attempt, retries and hedges included, runs inside attempt_slot() when given, so
+    a caller's quota and concurrency limits see each request actually sent.
+    """
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+    if not api_key:
+        return None
+
+    parts = [{"text": prompt}]
+    for number, (image_base64, mime_type) in enumerate(images, start=1):
+        if len(images) > 1:
+            parts.append({"text": f"Image {number}:"})
+        parts.append({"inlineData": {"mimeType": mime_type, "data": image_base64}})
+    metrics.observe("gemini_images_per_call", len(images), operation=operation, model=model)
+
+    payload = {
+        "contents": [
+            {
+                "role": "user",
+                "parts": parts
+            }
+        ],
+        "generationConfig": {
+            "temperature": 0.1,
+            "responseMimeType": "application/json",
+            "responseSchema": response_schema
+        }
+    }
+    body = json.dumps(payload).encode('utf-8')
+
+    async def send():
+        started_at = time.perf_counter()
+        response = await get_client().post(
+            f"/models/{model}:generateContent",
+            params={"key": api_key},
+            content=body,
+            timeout=deadline.clamp_timeout(timeout)
+        )
+        response.raise_for_status()
+        result = response.json()
+        _record_usage(operation, model, result, (time.perf_counter() - started_at) * 1000, len(body))
+        return result
+
+    async def post_to_gemini():
+        if attempt_slot is None:
+            return await send()
+        async with attempt_slot():
+            return await send()
+
+    result = await call_with_retry(operation, lambda: hedged(operation, post_to_gemini), retry_policy)
+
+    try:
+        text = result['candidates'][0]['content']['parts'][0]['text']
+        parsed = json.loads(text)
+    except (KeyError, IndexError, TypeError, ValueError):
+        metrics.increment("gemini_unparsable_responses", operation=operation, model=model)
+        return None
+    return parsed if isinstance(parsed, dict) else None
@@ -0,0 +1,98 @@
+# utils/hedging.py
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from utils import deadline
+from utils.metrics import metrics
+
+T = TypeVar("T")
+
+# Hedging is opt-in: a second attempt doubles upstream load for the slowest few percent of calls.
+HEDGING_ENABLED = os.environ.get("HEDGE_SLOW_REQUESTS", "").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# Do not hedge until enough latencies have been observed for the percentile to mean something.
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+
+
+def _record_attempt(operation: str, started_at: float) -> None:
+    metrics.observe("upstream_attempt_ms", (time.perf_counter() - started_at) * 1000, operation=operation)
+
+
+async def _timed_attempt(operation: str, attempt_factory: Callable[[], Awaitable[T]]) -> T:
+    # Attempts cancelled because the other one won are not recorded; their duration is not a latency.
+    started_at = time.perf_counter()
+    try:
+        result = await attempt_factory()
+    except Exception:
+        _record_attempt(operation, started_at)
+        raise
+    _record_attempt(operation, started_at)
+    return result
+
+
+def hedge_delay_seconds(operation: str):
+    if metrics.sample_count("upstream_attempt_ms", operation=operation) < HEDGE_MIN_SAMPLES:
+        return None
+    delay_ms = metrics.percentile("upstream_attempt_ms", HEDGE_PERCENTILE, operation=operation)
+    return delay_ms / 1000.0 if delay_ms is not None else None
+
+
+async def hedged(
+    operation: str,
+    attempt_factory: Callable[[], Awaitable[T]],
+    is_transient_failure: Optional[Callable[[T], bool]] = None
+) -> T:
+    """
+    Runs attempt_factory() and, if it is still running after the operation's observed p95
+    (and hedging is enabled), starts a second identical attempt. Whichever attempt finishes
+    first without raising wins and the other is cancelled. A result flagged by
+    is_transient_failure (e.g. a timeout status dict) only wins if no other attempt is left.
+    Both plain and hedged end-to-end latencies are recorded so the tail-latency effect shows
+    up in /metrics.
+    """
+    started_at = time.perf_counter()
+    delay = hedge_delay_seconds(operation) if HEDGING_ENABLED else None
+
+    primary = asyncio.ensure_future(_timed_attempt(operation, attempt_factory))
+    attempts = {primary: "primary"}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            left = deadline.remaining()
+            if not done and (left is None or left > 0):
+                hedge = asyncio.ensure_future(_timed_attempt(operation, attempt_factory))
+                attempts[hedge] = "hedge"
+                metrics.increment("hedge_fired", operation=operation)
+
+        pending = set(attempts)
+        last_error = None
+        fallback_task = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                if is_transient_failure is not None and is_transient_failure(task.result()):
+                    fallback_task = fallback_task or task
+                    continue
+                if len(attempts) > 1:
+                    metrics.increment("hedge_winner", operation=operation, winner=attempts[task])
+                return task.result()
+        if fallback_task is not None:
+            return fallback_task.result()
+        raise last_error
+    finally:
+        for task in attempts:
+            if not task.done():
+                task.cancel()
+        leftover = [task for task in attempts if not task.done()]
+        if leftover:
+            await asyncio.gather(*leftover, return_exceptions=True)
+        metrics.observe(
+            "upstream_call_ms", (time.perf_counter() - started_at) * 1000,
+            operation=operation, hedged="yes" if len(attempts) > 1 else "no"
+        )
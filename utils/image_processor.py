@@ -1,126 +1,250 @@
 # utils/image_processor.py
 
-import base64
-import re
-import json
 import httpx
-from typing import Optional, Dict, Any
-import os
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Sequence, Tuple
 import asyncio
+import io
+import logging
+
+from utils import deadline
+from utils.deadline import DeadlineExceeded
+from utils.gemini_client import PACKED_TRANSACTION_IDS_SCHEMA, prepare_array_for_gemini, prepare_image_for_gemini, TRANSACTION_ID_SCHEMA
+from utils.metrics import metrics
+from utils.model_router import model_router, GeminiRateLimited
+from utils.transaction_ids import classify_transaction_id, find_transaction_ids, split_cbe_qr_reference
+from utils.uploads import Buffer
+
+logger = logging.getLogger(__name__)
+
+# Below this self-reported confidence the fast tier's answer is re-checked by the stronger model.
+MIN_OCR_CONFIDENCE = 0.6
+
+TRANSACTION_ID_PROMPT = """
+Analyze this bank transaction receipt image.
+Your task is to extract only the **Transaction ID**. Look for labels like "Invoice No.", "Reference No.", "Transaction Ref", "Receipt No.", "VAT Receipt No.". This is typically an alphanumeric string, often 10-15 characters long. If it's part of a URL, extract only the ID part.
+If the Transaction ID is not found, return null.
+Set confidence between 0 and 1 for how sure you are that every character is read correctly.
+"""
+
+PACKED_TRANSACTION_IDS_PROMPT = """
+Each image below, labelled "Image N:", is a separate bank transaction receipt.
+For every image, extract only its **Transaction ID**. Look for labels like "Invoice No.", "Reference No.", "Transaction Ref", "Receipt No.", "VAT Receipt No.". This is typically an alphanumeric string, often 10-15 characters long. If it's part of a URL, extract only the ID part.
+Return one entry per image with its number. If an image has no Transaction ID, return null for it.
+Set confidence between 0 and 1 for how sure you are that every character is read correctly.
+"""
+
+def _is_confident_transaction_id(result: Dict[str, Any]) -> bool:
+    transaction_id = result.get("transaction_id")
+    if not isinstance(transaction_id, str) or not classify_transaction_id(transaction_id):
+        return False
+    confidence = result.get("confidence")
+    return not isinstance(confidence, (int, float)) or confidence >= MIN_OCR_CONFIDENCE
+
+async def extract_text_id_from_image_gemini(image: Buffer) -> Optional[Dict[str, Any]]:
+    # Decoding and re-encoding is CPU-bound; keep it off the event loop.
+    image_base64, mime_type = await asyncio.to_thread(prepare_image_for_gemini, image)
+    return await extract_text_id_from_prepared_image(image, image_base64, mime_type)
+
+async def extract_text_id_from_prepared_image(image: Buffer, image_base64: str, mime_type: str) -> Optional[Dict[str, Any]]:
+    """The OCR half of extract_text_id_from_image_gemini(), for an image already prepared for upload."""
+    try:
+        result = await model_router.generate_json(
+            ["fast", "strong"],
+            TRANSACTION_ID_PROMPT,
+            image_base64,
+            mime_type,
+            TRANSACTION_ID_SCHEMA,
+            operation="gemini_ocr",
+            accept=_is_confident_transaction_id
+        )
+    except GeminiRateLimited:
+        metrics.increment("ocr_local_fallbacks", reason="rate_limited")
+        return await asyncio.to_thread(extract_text_id_locally, image)
+    except DeadlineExceeded:
+        raise
+    except httpx.TimeoutException as e:
+        if deadline.expired():
+            raise DeadlineExceeded("Request deadline exceeded while waiting for Gemini OCR.") from e
+        logger.warning("Gemini OCR timed out: %s", e)
+        return None
+    except Exception as e:
+        logger.exception("Gemini OCR failed")
+        return None
 
-from PIL import Image
-from pyzbar.pyzbar import decode
-import cv2
-import numpy as np
-
-async def extract_text_id_from_image_gemini(image_base64: str) -> Optional[Dict[str, Any]]:
-    max_retries = 3
-    initial_delay = 1
-
-    for attempt in range(max_retries):
-        try:
-            prompt = """
-            Analyze this bank transaction receipt image.
-            Your task is to extract only the **Transaction ID**. Look for labels like "Invoice No.", "Reference No.", "Transaction Ref", "Receipt No.", "VAT Receipt No.". This is typically an alphanumeric string, often 10-15 characters long. If it's part of a URL, extract only the ID part.
-
-            Output the Transaction ID clearly labeled.
-            If the Transaction ID is not found, state "Transaction ID: Not Found".
-
-            Example Output:
-            Transaction ID: FT25188TN19J
-            """
-
-            payload = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [
-                            {"text": prompt},
-                            {
-                                "inlineData": {
-                                    "mimeType": "image/png",
-                                    "data": image_base64
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.1
-                }
-            }
-
-            apiKey = os.environ.get("GEMINI_API_KEY", "") 
-            if not apiKey:
-                return None
-
-            apiUrl = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={apiKey}"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    apiUrl, 
-                    json=payload,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=90.0
-                )
-                response.raise_for_status()
-                result = response.json()
-
-            extracted_id = None
-
-            if result and result.get('candidates') and len(result['candidates']) > 0 and \
-               result['candidates'][0].get('content') and result['candidates'][0].get('content').get('parts') and \
-               len(result['candidates'][0]['content']['parts']) > 0:
-                
-                raw_gemini_text = result['candidates'][0]['content']['parts'][0]['text']
-                
-                id_match = re.search(r'Transaction ID:\s*([A-Z0-9]+)', raw_gemini_text, re.IGNORECASE)
-                if id_match:
-                    extracted_id = id_match.group(1).strip()
-                else:
-                    pass
-
-                final_extracted_details = {
-                    "transaction_id": extracted_id.upper() if extracted_id else None,
-                }
-                
-                return final_extracted_details
-            else:
-                return None
-
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 503 and attempt < max_retries - 1:
-                delay = initial_delay * (2 ** attempt)
-                await asyncio.sleep(delay)
-                continue
-            return None
-        except Exception as e:
-            return None
-    
+    if result is None:
+        # No API key configured, or neither tier produced parsable output.
+        metrics.increment("ocr_local_fallbacks", reason="no_gemini_result")
+        return await asyncio.to_thread(extract_text_id_locally, image)
+
+    extracted_id = result.get("transaction_id")
+    if isinstance(extracted_id, str):
+        extracted_id = "".join(extracted_id.split()).upper() or None
+    else:
+        extracted_id = None
+
+    return {
+        "transaction_id": extracted_id,
+    }
+
+async def extract_text_ids_packed(images: Sequence[Tuple[str, str]]) -> List[Optional[str]]:
+    """
+    Reads the transaction IDs of several prepared (base64, mime type) images with one fast-tier
+    Gemini call. Returns one entry per image: the ID when the model read it confidently,
+    otherwise None, for the caller to retry that image on its own. Any failure of the packed
+    call yields all None.
+    """
+    found: List[Optional[str]] = [None] * len(images)
+    try:
+        result = await model_router.generate_json_for_images(
+            ["fast"],
+            PACKED_TRANSACTION_IDS_PROMPT,
+            images,
+            PACKED_TRANSACTION_IDS_SCHEMA,
+            operation="gemini_ocr_packed"
+        )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning("Packed Gemini OCR of %s images failed: %s", len(images), e)
+        return found
+
+    receipts = result.get("receipts") if result else None
+    for receipt in receipts if isinstance(receipts, list) else []:
+        if not isinstance(receipt, dict) or not isinstance(receipt.get("image"), int) or not 1 <= receipt["image"] <= len(images):
+            continue
+        transaction_id = receipt.get("transaction_id")
+        if isinstance(transaction_id, str):
+            receipt = {**receipt, "transaction_id": "".join(transaction_id.split()).upper()}
+        if _is_confident_transaction_id(receipt):
+            found[receipt["image"] - 1] = receipt["transaction_id"]
+    resolved = sum(1 for transaction_id in found if transaction_id)
+    metrics.increment("ocr_packed_images", resolved, outcome="resolved")
+    metrics.increment("ocr_packed_images", len(images) - resolved, outcome="unresolved")
+    return found
+
+def transaction_id_from_qr(qr_data: Optional[str]) -> Optional[Tuple[str, Optional[str]]]:
+    """(transaction ID, account number or None) from decoded QR text, if it carries a reference."""
+    if not qr_data:
+        return None
+    cbe_qr_reference = split_cbe_qr_reference(qr_data)
+    if cbe_qr_reference:
+        return cbe_qr_reference
+    candidates = find_transaction_ids(qr_data)
+    if candidates:
+        return candidates[0], None
     return None
 
-def extract_qr_code_data(image_bytes: bytes) -> Optional[str]:
+def extract_text_id_locally(image: Buffer) -> Optional[Dict[str, Any]]:
+    """
+    Local fallback when Gemini is unavailable: reads the QR code if there is one, otherwise runs
+    Tesseract (when installed) and keeps the first token that matches a provider's ID grammar.
+    """
+    qr_reference = transaction_id_from_qr(extract_qr_code_data(image))
+    if qr_reference:
+        return {"transaction_id": qr_reference[0]}
+
+    # OpenCV/numpy cost ~100ms to import; only workers that actually see images pay for them.
+    import cv2
+    import numpy as np
+
     try:
-        np_array = np.frombuffer(image_bytes, np.uint8)
-        cv_image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+        import pytesseract
 
-        if cv_image is None:
+        np_array = np.frombuffer(image, np.uint8)
+        gray_image = cv2.imdecode(np_array, cv2.IMREAD_GRAYSCALE)
+        if gray_image is None:
             return None
+        _, binary_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray_image)
+        text = pytesseract.image_to_string(binary_image)
+    except Exception as e:
+        logger.warning("Local OCR fallback failed: %s", e)
+        return None
 
-        gray_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+    candidates = find_transaction_ids(text)
+    if not candidates:
+        return None
+    return {"transaction_id": candidates[0]}
+
+def _binarize_for_qr(image: Buffer):
+    """
+    Decodes straight to grayscale from the upload buffer (no BGR matrix, no bytes copy) and
+    thresholds in place, so a large photo costs a single 8-bit matrix.
+    """
+    import cv2
+    import numpy as np
+
+    gray_image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray_image is None:
+        return None
+    return cv2.adaptiveThreshold(gray_image, 255,
+                                 cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, 11, 2, dst=gray_image)
+
+def extract_qr_code_data(image: Buffer) -> Optional[str]:
+    from pyzbar.pyzbar import decode
 
-        thresh_image = cv2.adaptiveThreshold(gray_image, 255, 
-                                             cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                             cv2.THRESH_BINARY, 11, 2)
-        
-        pil_image = Image.fromarray(thresh_image)
+    try:
+        binary_image = _binarize_for_qr(image)
+        if binary_image is None:
+            return None
 
-        decoded_objects = decode(pil_image)
+        # pyzbar reads numpy arrays directly; no PIL copy needed.
+        decoded_objects = decode(binary_image)
         if decoded_objects:
             qr_data = decoded_objects[0].data.decode('utf-8')
             return qr_data
         else:
             return None
     except Exception as e:
+        logger.warning("QR decoding failed: %s", e)
         return None
 
+@dataclass(frozen=True)
+class PreparedReceipt:
+    """What one decode of a receipt image yields: a QR reference, or the image ready for OCR."""
+
+    decodable: bool
+    transaction_id: Optional[str] = None
+    # Only CBE QR codes carry the account.
+    account_number: Optional[str] = None
+    image_base64: Optional[str] = None
+    mime_type: Optional[str] = None
+
+def prepare_receipt(image: Buffer) -> PreparedReceipt:
+    """
+    Decodes a receipt image once, to grayscale, and uses that array for both QR detection and,
+    when the QR code gives no reference, the downscaled copy sent to Gemini. OpenCV and zbar
+    release the GIL, so batches run this in parallel on a thread pool.
+    """
+    import cv2
+    import numpy as np
+
+    gray_image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray_image is None:
+        return PreparedReceipt(decodable=False)
+
+    qr_reference = None
+    try:
+        from pyzbar.pyzbar import decode
+
+        binary_image = cv2.adaptiveThreshold(gray_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+        decoded_objects = decode(binary_image)
+        if decoded_objects:
+            qr_reference = transaction_id_from_qr(decoded_objects[0].data.decode("utf-8"))
+    except Exception as e:
+        logger.warning("QR decoding failed: %s", e)
+    if qr_reference:
+        return PreparedReceipt(decodable=True, transaction_id=qr_reference[0], account_number=qr_reference[1])
+
+    image_base64, mime_type = prepare_array_for_gemini(gray_image)
+    return PreparedReceipt(decodable=True, image_base64=image_base64, mime_type=mime_type)
+
+def warm_up() -> None:
+    """Loads the image stack (PIL codecs, OpenCV, numpy, zbar) by running it once on a blank image."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("L", (64, 64), 255).save(buffer, format="PNG")
+    extract_qr_code_data(buffer.getvalue())
+    prepare_image_for_gemini(buffer.getvalue())
@@ -0,0 +1,77 @@
+# utils/image_sessions.py
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# Signs session tokens. Set it when running more than one worker, so a token issued by one
+# worker is accepted by the others; otherwise each process signs with its own random key.
+IMAGE_SESSION_SECRET = os.environ.get("IMAGE_SESSION_SECRET", "")
+IMAGE_SESSION_TTL_SECONDS = int(os.environ.get("IMAGE_SESSION_TTL_SECONDS", "600"))
+
+_signing_key = IMAGE_SESSION_SECRET.encode() if IMAGE_SESSION_SECRET else secrets.token_bytes(32)
+if not IMAGE_SESSION_SECRET:
+    logger.info("IMAGE_SESSION_SECRET is not set; image session tokens are only valid in this process.")
+
+
+class ImageSessionError(ValueError):
+    """Raised when a session token is malformed, forged or expired."""
+
+
+@dataclass(frozen=True)
+class ImageSession:
+    """What an image verification extracted before it stopped to ask for the account number."""
+
+    provider: str
+    transaction_id: str
+    # The ID came from a QR code rather than OCR (cheap to finish; see utils/admission.py).
+    from_qr: bool
+    expires_at: int
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_signing_key, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_session_token(provider: str, transaction_id: str, from_qr: bool = False) -> str:
+    """
+    Returns a signed token binding provider and transaction ID for IMAGE_SESSION_TTL_SECONDS.
+    The token is self-contained, so nothing is stored and any worker can redeem it.
+    """
+    payload = _b64encode(json.dumps(
+        {"p": provider, "t": transaction_id, "q": from_qr, "e": int(time.time()) + IMAGE_SESSION_TTL_SECONDS},
+        separators=(",", ":")
+    ).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def open_session_token(token: str) -> ImageSession:
+    payload, _, signature = (token or "").partition(".")
+    if not payload or not signature or not token.isascii():
+        raise ImageSessionError("Malformed session token.")
+    if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+        raise ImageSessionError("Session token signature is invalid.")
+    try:
+        claims = json.loads(_b64decode(payload))
+        session = ImageSession(str(claims["p"]), str(claims["t"]), bool(claims.get("q")), int(claims["e"]))
+    except (ValueError, KeyError, TypeError):
+        raise ImageSessionError("Malformed session token.")
+    if session.expires_at < time.time():
+        raise ImageSessionError("Session token has expired. Upload the image again.")
+    return session
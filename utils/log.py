@@ -0,0 +1,248 @@
+# utils/log.py
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from utils.metrics import metrics
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# Fraction of requests whose DEBUG events are kept; the decision is per request, so a sampled
+# request is logged completely. LOG_LEVEL=DEBUG keeps everything.
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+# Records waiting for the writer thread. When it falls behind, records are dropped rather than
+# blocking the event loop.
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Our own loggers; third-party libraries stay at the root level.
+APP_LOGGERS = ("main", "services", "utils", "reconcile")
+
+REQUEST_ID_HEADER = "x-request-id"
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._\-]{1,64}")
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_debug_sampled: ContextVar[Optional[bool]] = ContextVar("debug_sampled", default=None)
+_summary: ContextVar[Optional["RequestSummary"]] = ContextVar("request_summary", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is emitted as a field.
+_STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+class _RequestContextFilter(logging.Filter):
+    """Stamps the request ID on each record and drops DEBUG records of unsampled requests."""
+
+    def __init__(self, keep_all_debug: bool):
+        super().__init__()
+        self.keep_all_debug = keep_all_debug
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.INFO and not self.keep_all_debug:
+            sampled = _debug_sampled.get()
+            if sampled is None:
+                sampled = random.random() < LOG_DEBUG_SAMPLE_RATE
+            if not sampled:
+                return False
+        record.request_id = _request_id.get()
+        return True
+
+
+class _SampledLogger(logging.Logger):
+    """Skips building DEBUG records at all while the current request is not sampled."""
+
+    def isEnabledFor(self, level: int) -> bool:
+        if level < logging.INFO and _debug_sampled.get() is False and LOG_LEVEL != "DEBUG":
+            return False
+        return super().isEnabledFor(level)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; the caller never waits on stdout."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now, while the arguments still hold their values;
+        # JSON encoding and the write happen on the listener thread. This is the only handler,
+        # so the record is modified in place rather than copied.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped")
+
+
+class _DrainingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # On shutdown, wait for room instead of failing when the queue is full.
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging() -> None:
+    """
+    Routes all logging through a bounded queue to one writer thread. Safe to call more than once.
+    Format: one JSON object per line (LOG_FORMAT=json, the default) or plain text.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    keep_all_debug = LOG_LEVEL == "DEBUG"
+    queue_handler = _NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(_RequestContextFilter(keep_all_debug))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(logging.INFO if keep_all_debug else getattr(logging, LOG_LEVEL, logging.INFO))
+    # DEBUG records are only created for our own modules, and only when some of them can be kept.
+    app_level = logging.DEBUG if keep_all_debug or LOG_DEBUG_SAMPLE_RATE > 0 else root.level
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(app_level)
+    # Module loggers are created at import time, before this runs, so the existing ones are converted too.
+    logging.setLoggerClass(_SampledLogger)
+    for name, existing in list(logging.root.manager.loggerDict.items()):
+        if type(existing) is logging.Logger and name.split(".")[0] in APP_LOGGERS:
+            existing.__class__ = _SampledLogger
+
+    _listener = _DrainingQueueListener(queue_handler.queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records; called on application shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestSummary:
+    """What one request did, logged as a single line when it finishes."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.fields: Dict[str, Any] = {}
+        self.stages: Dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 1)
+
+
+def annotate(**fields) -> None:
+    """Adds fields (provider, outcome, ...) to the current request's summary line."""
+    summary = _summary.get()
+    if summary is not None:
+        summary.fields.update(fields)
+
+
+def summary_fields() -> Dict[str, Any]:
+    """The fields annotated on the current request's summary so far."""
+    summary = _summary.get()
+    return dict(summary.fields) if summary is not None else {}
+
+
+def mark_stage(name: str) -> None:
+    """Records when a stage was reached, in ms since the request started."""
+    summary = _summary.get()
+    if summary is not None and name not in summary.stages:
+        summary.stages[name] = summary.elapsed_ms()
+
+
+class RequestLogMiddleware:
+    """
+    Gives every HTTP request an ID (the caller's X-Request-ID if it is sane, otherwise a new
+    one), echoes it in the response, attaches it to every log record of the request, decides
+    whether the request's DEBUG events are sampled, and logs one summary line once the
+    response body has been sent.
+    """
+
+    def __init__(self, app, logger_name: str = "main.requests"):
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get("headers") or []).get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")
+        request_id = incoming if _REQUEST_ID_RE.fullmatch(incoming) else uuid.uuid4().hex[:16]
+        summary = RequestSummary()
+        tokens = (
+            _request_id.set(request_id),
+            _debug_sampled.set(random.random() < LOG_DEBUG_SAMPLE_RATE),
+            _summary.set(summary),
+        )
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            self.logger.info(
+                "request_completed",
+                extra={
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": status_code,
+                    "duration_ms": summary.elapsed_ms(),
+                    **summary.fields,
+                    "stages": summary.stages,
+                },
+            )
+            _summary.reset(tokens[2])
+            _debug_sampled.reset(tokens[1])
+            _request_id.reset(tokens[0])
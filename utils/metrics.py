@@ -0,0 +1,89 @@
+# utils/metrics.py
+
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+# Number of recent samples kept per timing series for percentile calculations.
+DEFAULT_WINDOW = 2048
+
+
+def _series_key(name: str, labels: Dict[str, object]) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{key}={labels[key]}" for key in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics store: monotonically increasing counters, last-value gauges
+    and sliding-window sample series (latencies, sizes) with percentile summaries.
+    Exposed as JSON by the /metrics endpoint.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._window = window
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._samples: Dict[str, deque] = {}
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        key = _series_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _series_key(name, labels)
+        with self._lock:
+            series = self._samples.get(key)
+            if series is None:
+                series = self._samples[key] = deque(maxlen=self._window)
+            series.append(value)
+
+    def sample_count(self, name: str, **labels) -> int:
+        key = _series_key(name, labels)
+        with self._lock:
+            series = self._samples.get(key)
+            return len(series) if series else 0
+
+    def percentile(self, name: str, pct: float, **labels) -> Optional[float]:
+        key = _series_key(name, labels)
+        with self._lock:
+            series = self._samples.get(key)
+            if not series:
+                return None
+            ordered = sorted(series)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            samples = {key: sorted(series) for key, series in self._samples.items()}
+
+        summaries = {}
+        for key, ordered in samples.items():
+            if not ordered:
+                continue
+            def pick(pct, ordered=ordered):
+                return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+            summaries[key] = {
+                "count": len(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p50": pick(50),
+                "p95": pick(95),
+                "p99": pick(99),
+                "max": ordered[-1],
+            }
+        return {"counters": counters, "gauges": gauges, "series": summaries}
+
+
+metrics = MetricsRegistry()
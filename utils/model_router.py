@@ -0,0 +1,170 @@
+# utils/model_router.py
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from utils.gemini_client import generate_json_for_images
+from utils.metrics import metrics
+
+# How long a call may wait for its tier's rate budget before the tier counts as rate-limited.
+MAX_BUDGET_WAIT_SECONDS = 0.5
+
+
+class GeminiRateLimited(Exception):
+    """Every tier that was tried is rate-limited, either by Gemini (429) or by our own budget."""
+
+
+class _BudgetExhausted(Exception):
+    """A tier's rate budget had no token for an attempt; never retried."""
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    name: str
+    model: str
+    max_concurrency: int
+    requests_per_minute: int
+
+
+FAST_TIER = ModelTier(
+    name="fast",
+    model=os.environ.get("GEMINI_FAST_MODEL", "gemini-2.0-flash-lite"),
+    max_concurrency=int(os.environ.get("GEMINI_FAST_CONCURRENCY", "16")),
+    requests_per_minute=int(os.environ.get("GEMINI_FAST_RPM", "60")),
+)
+
+STRONG_TIER = ModelTier(
+    name="strong",
+    model=os.environ.get("GEMINI_STRONG_MODEL", "gemini-2.0-flash"),
+    max_concurrency=int(os.environ.get("GEMINI_STRONG_CONCURRENCY", "8")),
+    requests_per_minute=int(os.environ.get("GEMINI_STRONG_RPM", "30")),
+)
+
+
+class RateBudget:
+    """Token bucket refilled continuously at requests_per_minute."""
+
+    def __init__(self, requests_per_minute: int):
+        self.capacity = max(1, requests_per_minute)
+        self.tokens = float(self.capacity)
+        self.refill_per_second = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    async def acquire(self, max_wait: float) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.refill_per_second
+            if wait > max_wait:
+                return False
+            await asyncio.sleep(wait)
+            self._refill()
+            if self.tokens < 1:
+                return False
+        self.tokens -= 1
+        return True
+
+
+class ModelRouter:
+    """
+    Tries the cheapest tier first and escalates only when its answer is unparsable or rejected
+    by the caller's accept() check. Each tier has its own concurrency limit and request budget,
+    charged for every request sent, hedges and retries included; when every tier is
+    rate-limited, GeminiRateLimited tells the caller to use its local path.
+    """
+
+    def __init__(self, tiers: Sequence[ModelTier]):
+        self.tiers = {tier.name: tier for tier in tiers}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._budgets = {tier.name: RateBudget(tier.requests_per_minute) for tier in tiers}
+
+    def _semaphore(self, tier: ModelTier) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(tier.name)
+        if semaphore is None:
+            semaphore = self._semaphores[tier.name] = asyncio.Semaphore(tier.max_concurrency)
+        return semaphore
+
+    def _attempt_slot(self, tier: ModelTier, operation: str):
+        @asynccontextmanager
+        async def slot():
+            if not await self._budgets[tier.name].acquire(MAX_BUDGET_WAIT_SECONDS):
+                metrics.increment("gemini_budget_exhausted", operation=operation, tier=tier.name)
+                raise _BudgetExhausted(tier.name)
+            async with self._semaphore(tier):
+                yield
+
+        return slot
+
+    async def generate_json(
+        self,
+        tier_names: List[str],
+        prompt: str,
+        image_base64: str,
+        mime_type: str,
+        response_schema: Dict[str, Any],
+        operation: str,
+        accept: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        timeout: float = 90.0
+    ) -> Optional[Dict[str, Any]]:
+        return await self.generate_json_for_images(
+            tier_names, prompt, [(image_base64, mime_type)], response_schema, operation, accept=accept, timeout=timeout
+        )
+
+    async def generate_json_for_images(
+        self,
+        tier_names: List[str],
+        prompt: str,
+        images: Sequence[Tuple[str, str]],
+        response_schema: Dict[str, Any],
+        operation: str,
+        accept: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        timeout: float = 90.0
+    ) -> Optional[Dict[str, Any]]:
+        """Same as generate_json() with several images in one call (one request against the tier's budget)."""
+        rate_limited_tiers = 0
+        last_result = None
+
+        for index, tier_name in enumerate(tier_names):
+            tier = self.tiers[tier_name]
+            if index > 0:
+                metrics.increment("gemini_escalations", operation=operation, to_tier=tier.name)
+
+            metrics.increment("gemini_tier_attempts", operation=operation, tier=tier.name)
+            try:
+                result = await generate_json_for_images(
+                    prompt, images, response_schema,
+                    operation=operation, model=tier.model, timeout=timeout,
+                    attempt_slot=self._attempt_slot(tier, operation)
+                )
+            except _BudgetExhausted:
+                rate_limited_tiers += 1
+                continue
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 429:
+                    metrics.increment("gemini_rate_limited", operation=operation, tier=tier.name)
+                    rate_limited_tiers += 1
+                    continue
+                raise
+
+            if result is not None:
+                last_result = result
+                if accept is None or accept(result):
+                    metrics.increment("gemini_accepted", operation=operation, tier=tier.name)
+                    return result
+
+        if last_result is None and rate_limited_tiers == len(tier_names):
+            raise GeminiRateLimited(f"All Gemini tiers rate-limited for {operation}.")
+        return last_result
+
+
+model_router = ModelRouter([FAST_TIER, STRONG_TIER])
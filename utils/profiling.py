@@ -0,0 +1,275 @@
+# utils/profiling.py
+
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from utils import log
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests carrying `X-Profile: <token>` are profiled. With no token configured the header is ignored
+# and the download endpoints answer 404.
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN", "")
+# Fraction of ordinary requests profiled without the header, for catching slow outliers in production.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "verifier-profiles"))
+# Oldest profiles are deleted beyond this many.
+PROFILE_MAX_KEPT = int(os.environ.get("PROFILE_MAX_KEPT", "50"))
+PROFILE_STACK_INTERVAL_MS = float(os.environ.get("PROFILE_STACK_INTERVAL_MS", "5"))
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", "10"))
+
+# When neither is set the middleware is not installed at all, so requests pay nothing.
+PROFILING_ENABLED = bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "x-profile-id"
+
+# Files written for every profile, served by the download endpoint.
+ARTIFACTS = {
+    "cpu.prof": "application/octet-stream",    # cProfile of the event-loop thread; open with snakeviz or pstats
+    "cpu.txt": "text/plain",                   # the same, top functions by cumulative time
+    "stacks.folded": "text/plain",             # sampled stacks of all threads; input for flamegraph.pl or speedscope
+    "memory.txt": "text/plain",                # tracemalloc: peak, and allocations grown during the request
+    "summary.json": "application/json",
+}
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread at a fixed interval from a background thread, so work
+    handed to asyncio.to_thread (OCR, image preparation, cache I/O) shows up alongside the
+    event loop. Stacks are kept in collapsed form: "thread;module:function;... count".
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_seconds):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """CPU profile, stack samples and allocation snapshots for one request."""
+
+    def __init__(self, profile_id: str, request_id: Optional[str], method: str, path: str, reason: str):
+        self.profile_id = profile_id
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.status_code: Optional[int] = None
+        self.cpu = cProfile.Profile()
+        self.sampler = StackSampler(PROFILE_STACK_INTERVAL_MS / 1000)
+        self.started_tracemalloc = False
+        self.memory_before = None
+        self.memory_after = None
+        self.peak_bytes = 0
+        self.started_at = 0.0
+        self.duration_ms = 0.0
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self.started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self.memory_before = tracemalloc.take_snapshot()
+        self.sampler.start()
+        self.started_at = time.perf_counter()
+        self.cpu.enable()
+
+    def stop(self) -> None:
+        self.cpu.disable()
+        self.duration_ms = round((time.perf_counter() - self.started_at) * 1000, 1)
+        self.sampler.stop()
+        self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        self.memory_after = tracemalloc.take_snapshot()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def write(self, directory: str) -> None:
+        """Writes the artifacts. Slow (pstats sorting, snapshot diffing), so run it off the event loop."""
+        os.makedirs(directory, exist_ok=True)
+        self.cpu.dump_stats(os.path.join(directory, "cpu.prof"))
+        with open(os.path.join(directory, "cpu.txt"), "w") as f:
+            pstats.Stats(self.cpu, stream=f).sort_stats("cumulative").print_stats(60)
+        with open(os.path.join(directory, "stacks.folded"), "w") as f:
+            f.write(self.sampler.folded())
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        growth = self.memory_after.filter_traces(ignore).compare_to(self.memory_before.filter_traces(ignore), "traceback")
+        with open(os.path.join(directory, "memory.txt"), "w") as f:
+            f.write(f"peak traced memory during request: {self.peak_bytes / 1024 / 1024:.2f} MiB\n")
+            f.write("largest allocation growth still held at the end of the request:\n\n")
+            for stat in growth[:25]:
+                f.write(f"{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks\n")
+                f.write("".join(f"    {line}\n" for line in stat.traceback.format()))
+                f.write("\n")
+
+        with open(os.path.join(directory, "summary.json"), "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "profile_id": self.profile_id,
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status_code,
+            "reason": self.reason,
+            "created_at": time.time(),
+            "duration_ms": self.duration_ms,
+            "peak_memory_bytes": self.peak_bytes,
+            "stack_samples": self.sampler.samples,
+            # cProfile and tracemalloc are process-wide: other requests running at the same
+            # time on this worker appear in the profile too.
+            "note": "Includes any other requests that ran concurrently on this worker.",
+        }
+
+
+class ProfileStore:
+    """Profiles on local disk, one directory per profile ID."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def directory(self, profile_id: str) -> str:
+        return os.path.join(self.root, profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return []
+        profiles = []
+        for profile_id in os.listdir(self.root):
+            try:
+                with open(os.path.join(self.root, profile_id, "summary.json")) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda p: p.get("created_at", 0), reverse=True)
+
+    def artifact_path(self, profile_id: str, artifact: str) -> Optional[str]:
+        # Profile IDs come from the URL; only accept ones this store could have written.
+        if artifact not in ARTIFACTS or not profile_id or not all(c.isalnum() or c in "._-" for c in profile_id) or profile_id.startswith("."):
+            return None
+        path = os.path.join(self.directory(profile_id), artifact)
+        return path if os.path.isfile(path) else None
+
+    def prune(self) -> None:
+        for stale in self.list()[PROFILE_MAX_KEPT:]:
+            shutil.rmtree(self.directory(stale["profile_id"]), ignore_errors=True)
+
+
+profile_store = ProfileStore(PROFILE_DIR)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that carry a valid `X-Profile` token, plus a PROFILE_SAMPLE_RATE share of
+    the rest. The profile spans the whole response, including streamed bodies, and its ID is
+    returned in `X-Profile-Id`. cProfile and tracemalloc are process-wide, so one request is
+    profiled at a time; others arriving meanwhile run unprofiled.
+
+    Only installed when PROFILING_ENABLED.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._active = False
+        self._writers = set()
+
+    def _reason(self, scope) -> Optional[str]:
+        token = dict(scope.get("headers") or []).get(PROFILE_HEADER.encode())
+        if token is not None and is_admin(token.decode("latin-1")):
+            return "requested"
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith("/debug/profiles"):
+            await self.app(scope, receive, send)
+            return
+        reason = self._reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        if self._active:
+            metrics.increment("profiles_skipped", reason="busy")
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(uuid.uuid4().hex[:16], log.current_request_id(), scope.get("method"), scope.get("path"), reason)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (PROFILE_ID_HEADER.encode(), profile.profile_id.encode())]}
+            await send(message)
+
+        self._active = True
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            self._active = False
+            log.annotate(profile_id=profile.profile_id)
+            metrics.increment("profiles_captured", reason=reason)
+            # Written in the background so the request's own latency does not include it.
+            writer = asyncio.create_task(self._write(profile))
+            self._writers.add(writer)
+            writer.add_done_callback(self._writers.discard)
+
+    async def _write(self, profile: RequestProfile) -> None:
+        try:
+            await asyncio.to_thread(profile.write, profile_store.directory(profile.profile_id))
+            await asyncio.to_thread(profile_store.prune)
+        except OSError:
+            logger.exception("Could not write profile %s", profile.profile_id)
@@ -0,0 +1,131 @@
+# utils/progress.py
+
+import asyncio
+import json
+import logging
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from utils import log
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Stages a streamed verification can report, roughly in order:
+#   qr_decoded, ocr_done           - image endpoints, once the transaction ID is known
+#   cached, waiting_for_duplicate  - answered from, or waiting on, another request's verification
+#   queued, admitted               - waited for a provider or OCR slot
+#   fetching, page_loaded          - receipt page requested / rendered (Telebirr, BOA)
+#   pdf_downloaded, parsed_page    - receipt PDF fetched / page N of M read (CBE)
+#   parsed                         - all receipt fields extracted
+KEEPALIVE_SECONDS = 15.0
+
+# Fields of VerifiedDataDetails that are sent as soon as they are known.
+PARTIAL_FIELDS = (
+    "sender_name", "sender_bank_name", "receiver_name", "receiver_bank_name", "status", "date", "amount"
+)
+
+_reporter: ContextVar[Optional["ProgressReporter"]] = ContextVar("progress_reporter", default=None)
+
+
+class ProgressReporter:
+    """Queues stage events and partial receipt fields for one streamed verification."""
+
+    def __init__(self):
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.partial: Dict[str, Any] = {}
+
+    def stage(self, name: str, **details) -> None:
+        self.events.put_nowait(("stage", {"stage": name, **details}))
+
+    def merge_partial(self, fields: Dict[str, Any]) -> None:
+        changed = {}
+        for key in PARTIAL_FIELDS:
+            value = fields.get(key)
+            # Failed scrapes report amount 0.0 as a placeholder; it is not a known amount.
+            if value in (None, "") or (key == "amount" and not value):
+                continue
+            if self.partial.get(key) != value:
+                changed[key] = value
+        if changed:
+            self.partial.update(changed)
+            self.events.put_nowait(("partial", dict(self.partial)))
+
+
+def report(stage: str, **details) -> None:
+    """Marks a stage in the request's log summary and, if the request is streamed, sends it to the client."""
+    log.mark_stage(stage)
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter.stage(stage, **details)
+
+
+def report_partial(fields: Dict[str, Any]) -> None:
+    """Sends receipt fields that became known before the final result, if the request is streamed."""
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter.merge_partial(fields)
+
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_events(
+    run: Callable[[], Awaitable[Any]],
+    describe_error: Callable[[Exception], Optional[Tuple[int, Any]]],
+    on_close: Optional[Callable[[], Awaitable[None]]] = None
+) -> AsyncIterator[str]:
+    """
+    Runs one verification and yields it as Server-Sent Events: `stage` and `partial` events
+    while it runs, then a single `result` (the VerificationResult) or `error` event. Errors
+    that would normally be an HTTP error response are sent as {"status_code", "detail"}, as
+    mapped by describe_error. If the client disconnects, the verification is cancelled.
+    """
+    reporter = ProgressReporter()
+    token = _reporter.set(reporter)
+    try:
+        # The task copies the current context, so everything it awaits reports to this stream.
+        task = asyncio.ensure_future(run())
+    finally:
+        _reporter.reset(token)
+    task.add_done_callback(lambda _: reporter.events.put_nowait(None))
+    metrics.increment("progress_streams_started")
+
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(reporter.events.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # A comment line keeps proxies and mobile networks from closing an idle stream.
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield format_event(*event)
+
+        try:
+            result = task.result()
+        except HTTPException as e:
+            yield format_event("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            described = describe_error(e)
+            if described is None:
+                logger.error("Streamed verification failed", exc_info=e)
+                described = (500, {
+                    "transaction_id": "N/A",
+                    "status": "Failed",
+                    "message": "Verification failed unexpectedly.",
+                    "debug_info": str(e)
+                })
+            yield format_event("error", {"status_code": described[0], "detail": described[1]})
+        else:
+            yield format_event("result", result.model_dump(mode="json") if hasattr(result, "model_dump") else result)
+    finally:
+        if not task.done():
+            task.cancel()
+            metrics.increment("progress_streams_abandoned")
+        if on_close is not None:
+            await on_close()
@@ -0,0 +1,88 @@
+# utils/retry.py
+
+import asyncio
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, FrozenSet, Optional, TypeVar
+
+import httpx
+
+from utils import deadline
+from utils.metrics import metrics
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Retry settings shared by every upstream HTTP caller."""
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    retry_statuses: FrozenSet[int] = field(default_factory=lambda: frozenset({429, 500, 502, 503, 504}))
+    retry_on_network_errors: bool = True
+
+
+GEMINI_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=10.0)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Reads a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max_delay, base * 2^attempt)]."""
+    return random.uniform(0, min(policy.max_delay, policy.base_delay * (2 ** attempt)))
+
+
+def _retry_delay(policy: RetryPolicy, attempt: int, error: Exception) -> Optional[float]:
+    """Returns how long to wait before retrying after error, or None if it should not be retried."""
+    if isinstance(error, httpx.HTTPStatusError):
+        if error.response.status_code not in policy.retry_statuses:
+            return None
+        retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+        if retry_after is not None:
+            # The upstream told us exactly when to come back; if that is too far off, give up now.
+            return retry_after if retry_after <= policy.max_delay else None
+        return backoff_delay(policy, attempt)
+    if policy.retry_on_network_errors and isinstance(error, httpx.TransportError):
+        return backoff_delay(policy, attempt)
+    return None
+
+
+async def call_with_retry(operation: str, call: Callable[[], Awaitable[T]], policy: RetryPolicy) -> T:
+    """
+    Runs call() and retries retryable HTTP statuses and network errors with jittered backoff,
+    honoring Retry-After. Never sleeps past the request deadline. The last error is re-raised.
+    """
+    for attempt in range(policy.max_attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt >= policy.max_attempts - 1:
+                raise
+            delay = _retry_delay(policy, attempt, e)
+            if delay is None:
+                raise
+            time_left = deadline.remaining()
+            if time_left is not None and time_left <= delay:
+                raise
+            metrics.increment("upstream_retries", operation=operation)
+            await asyncio.sleep(delay)
+    raise RuntimeError("unreachable")
@@ -0,0 +1,259 @@
+# utils/shared_cache.py
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import orjson
+
+from utils import deadline, progress
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Every uvicorn worker on the host opens the same file, so results and in-flight leases are
+# shared without any external service. WAL mode lets readers proceed while one worker writes.
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "/tmp/tx-verifier-cache.sqlite3")
+SHARED_CACHE_ENABLED = os.environ.get("SHARED_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# Completed receipts never change; negative and pending answers may, so they expire quickly.
+RESULT_TTL_SECONDS = float(os.environ.get("SHARED_CACHE_RESULT_TTL_SECONDS", str(6 * 3600)))
+NEGATIVE_TTL_SECONDS = float(os.environ.get("SHARED_CACHE_NEGATIVE_TTL_SECONDS", "60"))
+PENDING_TTL_SECONDS = float(os.environ.get("SHARED_CACHE_PENDING_TTL_SECONDS", "15"))
+
+# Upper bound on one verification; a leader that dies mid-scrape frees its key after this.
+LEASE_SECONDS = float(os.environ.get("SHARED_CACHE_LEASE_SECONDS", "150"))
+FOLLOWER_MAX_WAIT_SECONDS = float(os.environ.get("SHARED_CACHE_FOLLOWER_MAX_WAIT_SECONDS", "150"))
+POLL_INITIAL_SECONDS = 0.05
+POLL_MAX_SECONDS = 0.5
+PRUNE_EVERY_WRITES = 200
+
+# Outcomes that say nothing about the receipt itself; the next request should try again.
+UNCACHEABLE_STATUSES = frozenset({
+    "Network/Load Timeout", "Playwright Error", "Failed", "Deadline Exceeded",
+    "PDF_FETCH_FAILED", "PDF_PARSE_FAILED", "DEADLINE_EXCEEDED", "INVALID_INPUT_OR_PDF_FORMAT", "UNKNOWN",
+})
+NEGATIVE_STATUSES = frozenset({"Invalid Transaction ID"})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_expires_at REAL NOT NULL
+);
+"""
+
+
+# Bumped whenever the shape of cached values changes, so entries written by older workers are never read.
+KEY_VERSION = 2
+
+
+def verification_key(provider: str, transaction_id: str, account_suffix: Optional[str] = None) -> str:
+    return f"v{KEY_VERSION}:{provider}:{transaction_id}:{account_suffix or ''}"
+
+
+def is_pending_status(status: Optional[str]) -> bool:
+    """The receipt exists but may still change (a Telebirr payment that is not final yet)."""
+    return bool(status) and ("pending" in status.lower() or status == "Partial Data Extracted")
+
+
+def ttl_for_status(status: Optional[str]) -> Optional[float]:
+    """How long a verification outcome may be reused, or None if it must not be cached."""
+    if not status or status in UNCACHEABLE_STATUSES:
+        return None
+    if status in NEGATIVE_STATUSES:
+        return NEGATIVE_TTL_SECONDS
+    if is_pending_status(status):
+        return PENDING_TTL_SECONDS
+    return RESULT_TTL_SECONDS
+
+
+class SharedCache:
+    """
+    Host-wide verification cache with single-flight. For each key, at most one worker on the
+    host runs the upstream fetch (the lease holder); other requests, in this worker or any other,
+    wait for its stored result. If the holder dies, its lease expires and a waiter takes over.
+    SQLite calls are short and run in a thread so they never block the event loop.
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, enabled: bool = SHARED_CACHE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._thread_local = threading.local()
+        self._local_flights: Dict[str, asyncio.Future] = {}
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._thread_local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._thread_local.connection = connection
+        return connection
+
+    def _get_sync(self, key: str, decode: Callable[[bytes], Any] = orjson.loads) -> Any:
+        row = self._connection().execute(
+            "SELECT value FROM results WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return decode(row[0]) if row else None
+
+    def _try_acquire_sync(self, key: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO inflight (key, owner, lease_expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, lease_expires_at = excluded.lease_expires_at "
+            "WHERE inflight.lease_expires_at < ?",
+            (key, owner, now + lease_seconds, now)
+        )
+        return cursor.rowcount == 1
+
+    def _complete_sync(self, key: str, owner: str, value: Optional[bytes], ttl: Optional[float]) -> None:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if value is not None and ttl:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, time.time() + ttl)
+                )
+            connection.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, owner))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % PRUNE_EVERY_WRITES == 0:
+            now = time.time()
+            connection.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+            connection.execute("DELETE FROM inflight WHERE lease_expires_at <= ?", (now,))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        try:
+            value = await asyncio.to_thread(self._get_sync, key)
+        except sqlite3.Error as e:
+            metrics.increment("shared_cache_errors", operation="get")
+            logger.warning("Shared cache read failed for %s: %s", key, e)
+            return None
+        metrics.increment("shared_cache_lookups", outcome="hit" if value is not None else "miss")
+        return value
+
+    async def single_flight(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        ttl_for: Callable[[Any], Optional[float]],
+        encode: Callable[[Any], bytes] = orjson.dumps,
+        decode: Callable[[bytes], Any] = orjson.loads
+    ) -> Any:
+        """
+        Returns a cached result for key, or runs fetch() exactly once across all workers on the
+        host and shares its result. Results for which ttl_for() returns None are handed to
+        requests already waiting in this worker but are not stored. Results are stored as
+        encode(result) and a cache hit returns decode(stored bytes); the defaults are JSON.
+        """
+        if not self.enabled:
+            return await fetch()
+
+        # Requests for the same key in this worker share one future instead of all polling SQLite.
+        local = self._local_flights.get(key)
+        if local is not None:
+            metrics.increment("single_flight", role="local_follower")
+            progress.report("waiting_for_duplicate")
+            try:
+                return await asyncio.shield(local)
+            except asyncio.CancelledError:
+                if not local.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            # The request we were sharing was cancelled, not us; run our own.
+            return await self.single_flight(key, fetch, ttl_for, encode, decode)
+
+        future = asyncio.get_running_loop().create_future()
+        self._local_flights[key] = future
+        try:
+            result = await self._run_or_wait(key, fetch, ttl_for, encode, decode)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting on it.
+            future.exception()
+            raise
+        finally:
+            self._local_flights.pop(key, None)
+
+    async def _run_or_wait(self, key, fetch, ttl_for, encode, decode) -> Any:
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        waited_from = time.perf_counter()
+        waited = False
+        poll = POLL_INITIAL_SECONDS
+        max_wait = FOLLOWER_MAX_WAIT_SECONDS
+        time_left = deadline.remaining()
+        if time_left is not None:
+            max_wait = min(max_wait, time_left)
+
+        while True:
+            try:
+                cached = await asyncio.to_thread(self._get_sync, key, decode)
+                if not waited:
+                    metrics.increment("shared_cache_lookups", outcome="hit" if cached is not None else "miss")
+                if cached is not None:
+                    progress.report("cached")
+                    if waited:
+                        metrics.increment("single_flight", role="cross_worker_follower")
+                        metrics.observe("single_flight_wait_ms", (time.perf_counter() - waited_from) * 1000)
+                    return cached
+                lease = max(1.0, min(LEASE_SECONDS, time_left)) if time_left is not None else LEASE_SECONDS
+                acquired = await asyncio.to_thread(self._try_acquire_sync, key, owner, lease)
+            except sqlite3.Error as e:
+                metrics.increment("shared_cache_errors", operation="lease")
+                logger.warning("Shared cache unavailable for %s, fetching directly: %s", key, e)
+                return await fetch()
+
+            if acquired:
+                metrics.increment("single_flight", role="leader")
+                return await self._lead(key, owner, fetch, ttl_for, encode)
+
+            # Another worker holds the lease: wait for its result, or for the lease to lapse.
+            if not waited:
+                progress.report("waiting_for_duplicate")
+            if time.perf_counter() - waited_from >= max_wait:
+                metrics.increment("single_flight", role="wait_timeout")
+                return await fetch()
+            await asyncio.sleep(poll)
+            waited = True
+            poll = min(POLL_MAX_SECONDS, poll * 2)
+
+    async def _lead(self, key, owner, fetch, ttl_for, encode) -> Any:
+        result = None
+        try:
+            result = await fetch()
+            return result
+        finally:
+            ttl = ttl_for(result) if result is not None else None
+            value = encode(result) if ttl else None
+            try:
+                # Shielded so a cancelled request still releases its lease for the waiters.
+                await asyncio.shield(asyncio.to_thread(self._complete_sync, key, owner, value, ttl))
+            except (sqlite3.Error, asyncio.CancelledError) as e:
+                metrics.increment("shared_cache_errors", operation="complete")
+                logger.warning("Shared cache write failed for %s: %s", key, e)
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,157 @@
+# utils/transaction_ids.py
+
+import calendar
+import re
+from typing import List, Optional, Tuple
+
+PROVIDER_TELEBIRR = "telebirr"
+PROVIDER_BOA = "boa"
+PROVIDER_CBE = "cbe"
+
+PROVIDER_LABELS = {
+    PROVIDER_TELEBIRR: "Telebirr",
+    PROVIDER_BOA: "Bank of Abyssinia",
+    PROVIDER_CBE: "CBE",
+}
+
+# Telebirr receipt numbers: 10 uppercase alphanumerics starting with a letter, e.g. CGK4ABCD12.
+_TELEBIRR_ID_RE = re.compile(r"[A-Z][A-Z0-9]{9}")
+# CBE and BOA both issue core-banking references: FT + YYDDD (Julian date) + 5 alphanumerics,
+# e.g. FT25189TY6KT.
+_FT_REFERENCE_RE = re.compile(r"FT(\d{2})(\d{3})([A-Z0-9]{5})")
+_ALNUM_RE = re.compile(r"[A-Z0-9]+")
+_ACCOUNT_SEPARATORS_RE = re.compile(r"[\s\-]")
+_DIGITS_RE = re.compile(r"\d+")
+_CBE_QR_REFERENCE_RE = re.compile(r"id=(FT\d{5}[A-Z0-9]{5})(\d{8})", re.IGNORECASE)
+_ID_CANDIDATE_RE = re.compile(r"\b[A-Z0-9]{10,12}\b")
+
+# Minimum account digits each bank needs to build its receipt link.
+_MIN_ACCOUNT_DIGITS = {
+    PROVIDER_BOA: 5,
+    PROVIDER_CBE: 8,
+}
+
+
+class TransactionIdError(ValueError):
+    """Raised when a transaction ID or account number cannot possibly be valid for a provider."""
+
+    def __init__(self, message: str, provider: Optional[str] = None, value: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.provider = provider
+        self.value = value
+
+
+def normalize_transaction_id(raw: str) -> str:
+    return "".join((raw or "").split()).upper()
+
+
+def _check_ft_reference(provider: str, transaction_id: str) -> None:
+    label = PROVIDER_LABELS[provider]
+    if not transaction_id.startswith("FT"):
+        raise TransactionIdError(
+            f"{label} transaction ID '{transaction_id}' must start with 'FT'.", provider, transaction_id
+        )
+    if len(transaction_id) != 12:
+        raise TransactionIdError(
+            f"{label} transaction ID '{transaction_id}' must be 12 characters long (got {len(transaction_id)}).",
+            provider, transaction_id
+        )
+    match = _FT_REFERENCE_RE.fullmatch(transaction_id)
+    if not match:
+        raise TransactionIdError(
+            f"{label} transaction ID '{transaction_id}' must be 'FT', a 5-digit date (YYDDD) and 5 letters or digits.",
+            provider, transaction_id
+        )
+    year, day_of_year = 2000 + int(match.group(1)), int(match.group(2))
+    days_in_year = 366 if calendar.isleap(year) else 365
+    if not 1 <= day_of_year <= days_in_year:
+        raise TransactionIdError(
+            f"{label} transaction ID '{transaction_id}' has an invalid embedded date: day {day_of_year:03d} does not exist in {year}.",
+            provider, transaction_id
+        )
+
+
+def _check_telebirr_id(transaction_id: str) -> None:
+    if len(transaction_id) != 10:
+        raise TransactionIdError(
+            f"Telebirr transaction ID '{transaction_id}' must be 10 characters long (got {len(transaction_id)}).",
+            PROVIDER_TELEBIRR, transaction_id
+        )
+    if not _TELEBIRR_ID_RE.fullmatch(transaction_id):
+        raise TransactionIdError(
+            f"Telebirr transaction ID '{transaction_id}' must start with a letter and contain only letters and digits.",
+            PROVIDER_TELEBIRR, transaction_id
+        )
+
+
+def validate_transaction_id(provider: str, raw: str) -> str:
+    """Returns the normalized ID, or raises TransactionIdError describing exactly what is wrong."""
+    transaction_id = normalize_transaction_id(raw)
+    if not transaction_id:
+        raise TransactionIdError("Transaction ID is empty.", provider, raw)
+    if not _ALNUM_RE.fullmatch(transaction_id):
+        raise TransactionIdError(
+            f"Transaction ID '{transaction_id}' may only contain letters and digits.", provider, raw
+        )
+
+    if provider == PROVIDER_TELEBIRR:
+        _check_telebirr_id(transaction_id)
+    elif provider in (PROVIDER_BOA, PROVIDER_CBE):
+        _check_ft_reference(provider, transaction_id)
+    else:
+        raise TransactionIdError(f"Unknown provider '{provider}'.", provider, raw)
+    return transaction_id
+
+
+def validate_account_number(provider: str, raw: str) -> str:
+    """Strips spaces/hyphens and checks the account has enough digits for the provider's receipt link."""
+    account_number = _ACCOUNT_SEPARATORS_RE.sub("", raw or "")
+    label = PROVIDER_LABELS.get(provider, provider)
+    if not _DIGITS_RE.fullmatch(account_number):
+        raise TransactionIdError(f"{label} account number may only contain digits.", provider, raw)
+    min_digits = _MIN_ACCOUNT_DIGITS.get(provider, 1)
+    if len(account_number) < min_digits:
+        raise TransactionIdError(
+            f"{label} account number must have at least {min_digits} digits (got {len(account_number)}).",
+            provider, raw
+        )
+    return account_number
+
+
+def classify_transaction_id(raw: str) -> List[str]:
+    """
+    Returns every provider whose grammar accepts the ID, most likely first. FT references are
+    shared by CBE and BOA, so those come back ambiguous and need an account number to settle.
+    """
+    transaction_id = normalize_transaction_id(raw)
+    providers = []
+    for provider in (PROVIDER_CBE, PROVIDER_BOA, PROVIDER_TELEBIRR):
+        try:
+            validate_transaction_id(provider, transaction_id)
+        except TransactionIdError:
+            continue
+        providers.append(provider)
+    return providers
+
+
+def split_cbe_qr_reference(qr_data: str) -> Optional[Tuple[str, str]]:
+    """Pulls (transaction_id, last 8 account digits) out of a CBE receipt QR link, if present."""
+    match = _CBE_QR_REFERENCE_RE.search(qr_data or "")
+    if not match:
+        return None
+    transaction_id = match.group(1).upper()
+    try:
+        validate_transaction_id(PROVIDER_CBE, transaction_id)
+    except TransactionIdError:
+        return None
+    return transaction_id, match.group(2)
+
+
+def find_transaction_ids(text: str) -> List[str]:
+    """Scans free text (OCR output, QR payloads) for tokens that satisfy some provider's ID grammar."""
+    found = []
+    for candidate in _ID_CANDIDATE_RE.findall((text or "").upper()):
+        if candidate not in found and classify_transaction_id(candidate):
+            found.append(candidate)
+    return found
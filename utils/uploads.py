@@ -0,0 +1,255 @@
+# utils/uploads.py
+
+import io
+import json
+import mmap
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+
+from utils.metrics import metrics
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# One batch request carries many receipts, or a zip of them.
+BATCH_MAX_UPLOAD_BYTES = int(os.environ.get("BATCH_MAX_UPLOAD_BYTES", str(60 * 1024 * 1024)))
+# Multipart framing and form fields ride along with the file; allow a little on top of the file cap.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+READ_CHUNK_BYTES = 256 * 1024
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def _too_large_detail(limit: int) -> dict:
+    return {
+        "transaction_id": "N/A",
+        "status": "Failed",
+        "message": f"Uploaded file is too large. The limit is {limit // (1024 * 1024)} MB.",
+        "debug_info": f"Request body exceeded {limit} bytes."
+    }
+
+
+class _BodyTooLarge(HTTPException):
+    """
+    Raised from receive() while the app is reading the body. FastAPI re-raises HTTPExceptions
+    from body parsing as they are (anything else becomes a 400), so the client gets the 413.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=_too_large_detail(max_bytes - MULTIPART_OVERHEAD_BYTES))
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects multipart bodies over the upload limit with 413 while they are still streaming in,
+    so an oversized photo is never fully received or spooled. Declared Content-Length is
+    checked up front and answered here. Chunked bodies are counted as they arrive, and the
+    first chunk past the limit fails the app's form parsing with a 413 HTTPException, answered
+    by the app's exception handling. path_limits raises (or lowers) the limit for specific paths.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope.get("path"), self.max_bytes)
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+            metrics.increment("uploads_rejected", reason="too_large")
+            await self._reject(send, max_bytes)
+            return
+
+        received = 0
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    metrics.increment("uploads_rejected", reason="too_large")
+                    raise _BodyTooLarge(max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, tracking_send)
+        except _BodyTooLarge:
+            # Only reached when the body is read outside FastAPI's request handling.
+            if response_started:
+                raise
+            await self._reject(send, max_bytes)
+
+    async def _reject(self, send, max_bytes: int):
+        body = json.dumps({"detail": _too_large_detail(max_bytes - MULTIPART_OVERHEAD_BYTES)}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only file object over a buffer, so PIL can decode it without a bytes copy."""
+
+    def __init__(self, buffer: Buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        count = min(len(target), len(self._view) - self._position)
+        target[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = len(self._view) + offset
+        self._position = max(0, self._position)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        self._view.release()
+        super().close()
+
+
+def open_buffer(buffer: Buffer) -> io.BufferedReader:
+    return io.BufferedReader(BufferReader(buffer), buffer_size=READ_CHUNK_BYTES)
+
+
+def _spooled_parts(upload: UploadFile):
+    """Returns (in-memory BytesIO, None) or (None, disk file) for Starlette's SpooledTemporaryFile."""
+    spooled = upload.file
+    inner = getattr(spooled, "_file", None)
+    if inner is None:
+        return None, None
+    if getattr(spooled, "_rolled", False):
+        return None, inner
+    return (inner, None) if isinstance(inner, io.BytesIO) else (None, None)
+
+
+def _read_chunks(upload: UploadFile, limit: int) -> bytearray:
+    upload.file.seek(0)
+    data = bytearray()
+    while True:
+        chunk = upload.file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return data
+        data += chunk
+        if len(data) > limit:
+            raise HTTPException(status_code=413, detail=_too_large_detail(limit))
+
+
+def _release(view: memoryview, mapped: Optional[mmap.mmap]) -> None:
+    try:
+        view.release()
+        if mapped is not None:
+            mapped.close()
+    except BufferError:
+        # A decoder still holds a view; the buffer is freed once that array is collected.
+        pass
+
+
+def detach_upload(upload: UploadFile) -> UploadFile:
+    """
+    Takes ownership of an uploaded file away from the request form. FastAPI closes form files
+    as soon as the endpoint returns, before a streaming response has run; the returned
+    UploadFile keeps the spool open until the caller closes it.
+    """
+    detached = UploadFile(upload.file, size=upload.size, filename=upload.filename, headers=upload.headers)
+    upload.file = io.BytesIO()
+    return detached
+
+
+@asynccontextmanager
+async def open_upload(upload: UploadFile, limit: int = MAX_UPLOAD_BYTES):
+    """
+    Yields the uploaded file as a read-only buffer without copying it onto the Python heap:
+    an mmap of the spool file when Starlette rolled it to disk, otherwise a view of its
+    in-memory buffer. Raises 413 past the size limit and 400 if the upload is empty or unreadable.
+    """
+    if upload.size is not None and upload.size > limit:
+        metrics.increment("uploads_rejected", reason="too_large")
+        raise HTTPException(status_code=413, detail=_too_large_detail(limit))
+
+    mapped: Optional[mmap.mmap] = None
+    view: Optional[memoryview] = None
+    try:
+        in_memory, on_disk = _spooled_parts(upload)
+        if on_disk is not None:
+            on_disk.flush()
+            mapped = mmap.mmap(on_disk.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            source = "disk"
+        elif in_memory is not None:
+            view = in_memory.getbuffer()
+            source = "memory"
+        else:
+            view = memoryview(_read_chunks(upload, limit))
+            source = "copy"
+    except HTTPException:
+        raise
+    except (OSError, ValueError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "transaction_id": "N/A",
+                "status": "Failed",
+                "message": f"Could not read or process uploaded image file: {e}",
+                "debug_info": str(e)
+            }
+        )
+
+    if len(view) == 0:
+        _release(view, mapped)
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "transaction_id": "N/A",
+                "status": "Failed",
+                "message": "Uploaded image file is empty.",
+                "debug_info": "Zero-byte upload."
+            }
+        )
+    if len(view) > limit:
+        _release(view, mapped)
+        metrics.increment("uploads_rejected", reason="too_large")
+        raise HTTPException(status_code=413, detail=_too_large_detail(limit))
+
+    metrics.increment("uploads_opened", source=source)
+    metrics.observe("upload_bytes", len(view))
+    try:
+        yield view
+    finally:
+        _release(view, mapped)